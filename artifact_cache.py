@@ -0,0 +1,275 @@
+"""
+Artifact Cache Module
+
+Persistent on-disk cache for document summaries. An entry holds the
+extracted chunks, the chapter summaries, the overall summary and the
+rendered PDF, keyed by a hash of the source content and the pipeline
+parameters. Aliases (e.g. Telegram file_unique_id) point at entries so a
+repeat upload can be answered without downloading the file again.
+
+It also remembers the Telegram file_id of every file the bot has sent,
+keyed by content hash, so a file that was uploaded once is afterwards sent
+by reference instead of being uploaded again.
+
+Entries are evicted least-recently-used once the cache exceeds its size
+limit, together with the aliases and the file_id pointing at them; an
+entry whose PDF is being sent is kept until the upload is done. The
+file_ids of other sent files (diagrams) are capped in number.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import contextlib
+from collections import Counter
+from typing import Any, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get(
+    "ARTIFACT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "telegram_bot_ai", "artifacts"),
+)
+CACHE_MAX_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Remembered file_ids of sent files, least recently used forgotten first
+MAX_FILE_IDS = int(os.environ.get("ARTIFACT_CACHE_MAX_FILE_IDS", "10000"))
+
+_META_FILE = "meta.json"
+_PDF_FILE = "summary.pdf"
+
+# Paths of files being sent (path -> senders); eviction leaves their entries alone
+_in_use: Counter = Counter()
+
+
+class Artifact(NamedTuple):
+    chunks: List[str]
+    summaries: List[str]
+    overall_summary: str
+    pdf_path: str
+
+
+def make_key(*parts: Any) -> str:
+    """Build a cache key from JSON-serializable parts."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def content_hash(path: str) -> str:
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """SHA-256 of a text string."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _entry_dir(key: str) -> str:
+    return os.path.join(CACHE_DIR, "entries", key)
+
+
+def _alias_file(alias: str) -> str:
+    return os.path.join(CACHE_DIR, "aliases", alias)
+
+
+def lookup(key: str) -> Optional[Artifact]:
+    """Return the cached artifact for key, or None."""
+    entry = _entry_dir(key)
+    try:
+        with open(os.path.join(entry, _META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        pdf_path = os.path.join(entry, _PDF_FILE)
+        if not os.path.exists(pdf_path):
+            return None
+        # Mark as recently used for LRU eviction
+        now = time.time()
+        os.utime(entry, (now, now))
+    except (OSError, ValueError):
+        return None
+
+    return Artifact(meta["chunks"], meta["summaries"], meta["overall_summary"], pdf_path)
+
+
+def lookup_alias(alias: str) -> Optional[Artifact]:
+    """Return the artifact an alias points to, or None."""
+    try:
+        with open(_alias_file(alias), encoding='utf-8') as f:
+            key = f.read().strip()
+    except OSError:
+        return None
+    return lookup(key)
+
+
+def link(alias: str, key: str) -> None:
+    """Point alias at the entry stored under key."""
+    try:
+        os.makedirs(os.path.dirname(_alias_file(alias)), exist_ok=True)
+        with open(_alias_file(alias), 'w', encoding='utf-8') as f:
+            f.write(key)
+    except OSError as e:
+        logger.warning(f"Could not write cache alias: {e}")
+
+
+def _file_id_file(kind: str, digest: str) -> str:
+    return os.path.join(CACHE_DIR, "file_ids", f"{kind}-{digest}")
+
+
+def lookup_file_id(kind: str, digest: str) -> Optional[str]:
+    """Return the Telegram file_id of a sent file (kind: document/photo), or None."""
+    try:
+        with open(_file_id_file(kind, digest), encoding='utf-8') as f:
+            file_id = f.read().strip() or None
+        # Mark as recently used for LRU pruning
+        os.utime(_file_id_file(kind, digest))
+        return file_id
+    except OSError:
+        return None
+
+
+def store_file_id(kind: str, digest: str, file_id: str) -> None:
+    """Remember the Telegram file_id returned for an uploaded file."""
+    try:
+        os.makedirs(os.path.dirname(_file_id_file(kind, digest)), exist_ok=True)
+        with open(_file_id_file(kind, digest), 'w', encoding='utf-8') as f:
+            f.write(file_id)
+    except OSError as e:
+        logger.warning(f"Could not store file_id: {e}")
+        return
+    _prune_file_ids()
+
+
+def _prune_file_ids() -> None:
+    """Forget the least recently used file_ids beyond MAX_FILE_IDS."""
+    directory = os.path.join(CACHE_DIR, "file_ids")
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+        if len(paths) <= MAX_FILE_IDS:
+            return
+        paths.sort(key=os.path.getmtime)
+    except OSError:
+        return
+    for path in paths[:len(paths) - MAX_FILE_IDS]:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+
+def forget_file_id(kind: str, digest: str) -> None:
+    """Drop a file_id that Telegram no longer accepts."""
+    try:
+        os.remove(_file_id_file(kind, digest))
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def in_use(path: str) -> Iterator[None]:
+    """Keep the entry of path (a cached PDF) from being evicted inside the block."""
+    _in_use[path] += 1
+    try:
+        yield
+    finally:
+        _in_use[path] -= 1
+        if not _in_use[path]:
+            del _in_use[path]
+
+
+def store(key: str, chunks: List[str], summaries: List[str], overall_summary: str, pdf_path: str) -> None:
+    """Store a rendered summary under key and evict old entries if needed."""
+    entry = _entry_dir(key)
+    if os.path.exists(entry):
+        return
+
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=os.path.dirname(entry))
+        shutil.copyfile(pdf_path, os.path.join(staging, _PDF_FILE))
+        with open(os.path.join(staging, _META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                "chunks": chunks,
+                "summaries": summaries,
+                "overall_summary": overall_summary,
+            }, f, ensure_ascii=False)
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another update stored the same entry first
+            shutil.rmtree(staging, ignore_errors=True)
+    except OSError as e:
+        logger.warning(f"Could not store cache entry: {e}")
+        return
+
+    evict()
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for name in os.listdir(path):
+        try:
+            total += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return total
+
+
+def evict(max_bytes: int = None) -> None:
+    """Remove least-recently-used entries until the cache fits max_bytes."""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries_dir = os.path.join(CACHE_DIR, "entries")
+    try:
+        names = [name for name in os.listdir(entries_dir) if not name.startswith('.')]
+    except OSError:
+        return
+
+    entries = []
+    for name in names:
+        path = os.path.join(entries_dir, name)
+        try:
+            entries.append((os.path.getmtime(path), _dir_size(path), path))
+        except OSError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    evicted = set()
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        pdf_path = os.path.join(path, _PDF_FILE)
+        if pdf_path in _in_use:
+            continue
+        # The file_id of the entry's PDF goes with it
+        with contextlib.suppress(OSError):
+            forget_file_id('document', content_hash(pdf_path))
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        evicted.add(os.path.basename(path))
+        logger.info(f"Evicted cache entry {os.path.basename(path)}")
+
+    if evicted:
+        _prune_aliases(evicted)
+
+
+def _prune_aliases(evicted: set) -> None:
+    """Remove aliases that point at evicted (or otherwise missing) entries."""
+    aliases_dir = os.path.join(CACHE_DIR, "aliases")
+    try:
+        names = os.listdir(aliases_dir)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(aliases_dir, name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                key = f.read().strip()
+            if key in evicted or not os.path.isdir(_entry_dir(key)):
+                os.remove(path)
+        except OSError:
+            continue
@@ -0,0 +1,341 @@
+"""
+Audio Processing Module
+
+ffmpeg-based helpers for recordings sent to Whisper: preprocessing
+(long silences cut, re-encoded as compact mono speech) so fewer bytes and
+seconds are uploaded and transcribed, and for long recordings silence
+detection, splitting into overlapping segments that are transcribed
+concurrently, and stitching the segment transcripts back together without
+duplicated words.
+"""
+
+import io
+import os
+import re
+import shutil
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Recordings longer than this (seconds) or larger than this (bytes) are segmented
+SEGMENT_THRESHOLD = float(os.environ.get("TRANSCRIBE_SEGMENT_THRESHOLD", "600"))
+MAX_UPLOAD_BYTES = 24 * 1024 * 1024
+
+# Target segment length and overlap between neighbouring segments (seconds)
+SEGMENT_SECONDS = float(os.environ.get("TRANSCRIBE_SEGMENT_SECONDS", "300"))
+SEGMENT_OVERLAP = 2.0
+
+# Segments transcribed at the same time
+TRANSCRIBE_CONCURRENCY = int(os.environ.get("TRANSCRIBE_CONCURRENCY", "4"))
+
+# Silence detection: level below which audio counts as silent, minimum length
+SILENCE_NOISE_DB = -35
+SILENCE_MIN_SECONDS = 0.5
+
+# Preprocessing before upload ("0" sends recordings as received)
+PREPROCESS = os.environ.get("TRANSCRIBE_PREPROCESS", "1") == "1"
+
+# Silent spans longer than this (seconds) are shortened to about this length
+# (plus TRIM_KEEP_SECONDS of the silence kept as padding before speech resumes)
+TRIM_SILENCE_SECONDS = float(os.environ.get("TRANSCRIBE_TRIM_SILENCE_SECONDS", "0.7"))
+TRIM_KEEP_SECONDS = 0.2
+
+# Upload format: mono 16 kHz MP3 (Whisper resamples everything to 16 kHz mono;
+# MP3 encodes several times faster than Opus at the same size)
+SPEECH_BITRATE = os.environ.get("TRANSCRIBE_BITRATE", "24k")
+SPEECH_CODEC_ARGS = ('-vn', '-ac', '1', '-ar', '16000', '-c:a', 'libmp3lame', '-b:a', SPEECH_BITRATE, '-f', 'mp3')
+
+# Less speech than this (seconds) after trimming: the level threshold was wrong, send the original
+MIN_SPEECH_SECONDS = 0.5
+
+# Words compared when removing duplicates at segment overlaps: neighbouring
+# segments share 2 * SEGMENT_OVERLAP seconds of audio (fast speech is about
+# 3 words per second), plus a word cut in half at each segment edge
+SPEECH_WORDS_PER_SECOND = 3
+OVERLAP_WORDS = int(2 * SEGMENT_OVERLAP * SPEECH_WORDS_PER_SECOND) + 2
+MIN_OVERLAP_WORDS = 3
+
+_SILENCE_START = re.compile(r'silence_start:\s*(-?[\d.]+)')
+_SILENCE_END = re.compile(r'silence_end:\s*(-?[\d.]+)')
+_OUT_TIME = re.compile(r'out_time_us=(\d+)')
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which('ffmpeg') is not None
+
+
+async def run_command(*args: str, input: Optional[bytes] = None) -> Tuple[int, bytes, bytes]:
+    """Run a command without blocking the event loop; input is written to its stdin."""
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL if input is None else asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate(input)
+    return process.returncode, stdout, stderr
+
+
+def as_seconds(duration) -> float:
+    """Seconds of a Telegram duration (int or timedelta, possibly None)."""
+    if hasattr(duration, 'total_seconds'):
+        return duration.total_seconds()
+    return float(duration or 0)
+
+
+def compact_size(duration, received_bytes: int) -> int:
+    """Upper bound of the in-memory copy preprocess() makes of a recording (0 when it makes none)."""
+    if not PREPROCESS or not ffmpeg_available():
+        return 0
+    seconds = as_seconds(duration)
+    if not seconds:
+        # Without a duration, assume the compact copy is no larger than the recording
+        return received_bytes
+    multiplier = {'k': 1000, 'm': 1000 * 1000}.get(SPEECH_BITRATE[-1:].lower(), 1)
+    bits_per_second = float(SPEECH_BITRATE.rstrip('kKmM')) * multiplier
+    # Constant bitrate, plus headers and the frame padding of a short file
+    return int(bits_per_second * seconds / 8) + 16 * 1024
+
+
+def speech_filter() -> str:
+    """ffmpeg filter that shortens long silent spans (silenceremove)."""
+    return (
+        f'silenceremove=start_periods=1:start_threshold={SILENCE_NOISE_DB}dB'
+        f':stop_periods=-1:stop_duration={TRIM_SILENCE_SECONDS}'
+        f':stop_threshold={SILENCE_NOISE_DB}dB:stop_silence={TRIM_KEEP_SECONDS}'
+    )
+
+
+def _ffmpeg_error(stderr: bytes) -> str:
+    """ffmpeg's error output without its -progress report lines."""
+    lines = [line for line in stderr.decode(errors='replace').splitlines() if not re.match(r'^\w+=', line)]
+    return "\n".join(lines)[-500:]
+
+
+def _output_seconds(stderr: bytes) -> float:
+    """Duration written by ffmpeg, from its -progress report."""
+    times = _OUT_TIME.findall(stderr.decode(errors='replace'))
+    return int(times[-1]) / 1e6 if times else 0.0
+
+
+def record_upload(received_bytes: int, received_seconds: float, sent_bytes: int, sent_seconds: float) -> None:
+    """Count and log the audio received vs. uploaded for one message."""
+    metrics.AUDIO_BYTES.inc("received", amount=received_bytes)
+    metrics.AUDIO_BYTES.inc("uploaded", amount=sent_bytes)
+    metrics.AUDIO_SECONDS.inc("received", amount=received_seconds)
+    metrics.AUDIO_SECONDS.inc("uploaded", amount=sent_seconds)
+    logger.info(
+        f"Audio preprocessing saved {(received_bytes - sent_bytes) / 1024:.0f} KB "
+        f"({received_bytes / 1024:.0f} -> {sent_bytes / 1024:.0f} KB) and "
+        f"{received_seconds - sent_seconds:.1f}s ({received_seconds:.1f} -> {sent_seconds:.1f}s)"
+    )
+
+
+async def compact_speech(source: Union[str, bytes, memoryview], out_path: str = 'pipe:1') -> Tuple[bytes, float]:
+    """Cut long silences from a recording and re-encode it as mono 16 kHz MP3.
+
+    ``source`` is a file path or the recording itself. Returns the encoded
+    output (empty when written to out_path) and its duration in seconds.
+    """
+    in_memory = not isinstance(source, str)
+    code, stdout, stderr = await run_command(
+        'ffmpeg', '-hide_banner', '-v', 'error', '-nostats', '-progress', 'pipe:2', '-y',
+        '-i', 'pipe:0' if in_memory else source,
+        '-af', speech_filter(), *SPEECH_CODEC_ARGS, out_path,
+        input=source if in_memory else None,
+    )
+    if code != 0:
+        raise RuntimeError(f"ffmpeg preprocessing failed: {_ffmpeg_error(stderr)}")
+    return stdout, _output_seconds(stderr)
+
+
+async def preprocess(source: Union[str, io.BytesIO], duration, workdir: str) -> Union[str, io.BytesIO]:
+    """The recording to upload in place of source (a path or an in-memory file).
+
+    Returns the compacted recording, in the same form as source (a file in
+    workdir for a path), or source itself when preprocessing is disabled,
+    ffmpeg is not installed or fails, or nothing but silence would be left.
+    """
+    if not PREPROCESS or not ffmpeg_available():
+        return source
+
+    try:
+        if isinstance(source, str):
+            received_bytes = os.path.getsize(source)
+            compact = os.path.join(workdir, 'speech.mp3')
+            _, seconds = await compact_speech(source, compact)
+        else:
+            with source.getbuffer() as view:
+                received_bytes = len(view)
+                data, seconds = await compact_speech(view)
+            compact = io.BytesIO(data)
+            compact.name = 'speech.mp3'
+    except (OSError, RuntimeError) as e:
+        # ffmpeg missing or unable to read the file: upload it as received
+        logger.warning(f"Audio preprocessing unavailable: {e}")
+        return source
+
+    if seconds < MIN_SPEECH_SECONDS:
+        return source
+    sent_bytes = os.path.getsize(compact) if isinstance(compact, str) else len(data)
+    record_upload(received_bytes, as_seconds(duration) or seconds, sent_bytes, seconds)
+    return compact
+
+
+async def probe_duration(path: str) -> float:
+    """Duration of an audio file in seconds (ffprobe)."""
+    code, stdout, stderr = await run_command(
+        'ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path
+    )
+    if code != 0:
+        raise RuntimeError(f"ffprobe failed: {stderr.decode(errors='replace').strip()}")
+    return float(stdout.decode().strip())
+
+
+async def detect_silences(path: str) -> List[Tuple[float, float]]:
+    """Return (start, end) times of silent spans (ffmpeg silencedetect)."""
+    code, _, stderr = await run_command(
+        'ffmpeg', '-hide_banner', '-nostats', '-i', path,
+        '-af', f'silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_SECONDS}',
+        '-f', 'null', '-',
+    )
+    if code != 0:
+        raise RuntimeError(f"ffmpeg silencedetect failed: {stderr.decode(errors='replace')[-500:]}")
+
+    silences = []
+    start = None
+    for line in stderr.decode(errors='replace').splitlines():
+        match = _SILENCE_START.search(line)
+        if match:
+            start = max(0.0, float(match.group(1)))
+            continue
+        match = _SILENCE_END.search(line)
+        if match and start is not None:
+            silences.append((start, float(match.group(1))))
+            start = None
+    return silences
+
+
+def plan_segments(
+    duration: float,
+    silences: List[Tuple[float, float]],
+    target: float = SEGMENT_SECONDS,
+    overlap: float = SEGMENT_OVERLAP,
+) -> List[Tuple[float, float]]:
+    """Plan overlapping (start, end) segments cut near silences.
+
+    Each cut is placed at the middle of the silence closest to ``target``
+    seconds after the previous cut (within half a segment); without a
+    suitable silence the cut is made at the target. Segments are widened by
+    ``overlap`` seconds on both sides so no word is lost at a hard cut.
+    """
+    midpoints = [(start + end) / 2 for start, end in silences]
+    cuts = [0.0]
+    while duration - cuts[-1] > target * 1.25:
+        ideal = cuts[-1] + target
+        candidates = [m for m in midpoints if cuts[-1] + target / 2 <= m <= ideal + target / 4]
+        cuts.append(min(candidates, key=lambda m: abs(m - ideal)) if candidates else ideal)
+    cuts.append(duration)
+
+    return [
+        (max(0.0, start - overlap), min(duration, end + overlap))
+        for start, end in zip(cuts, cuts[1:])
+    ]
+
+
+async def cut_segment(path: str, start: float, end: float, out_path: str) -> float:
+    """Write start..end of path to out_path as compact mono speech; return its seconds."""
+    code, _, stderr = await run_command(
+        'ffmpeg', '-hide_banner', '-v', 'error', '-nostats', '-progress', 'pipe:2', '-y',
+        '-ss', f'{start:.3f}', '-i', path, '-t', f'{end - start:.3f}',
+        *(('-af', speech_filter()) if PREPROCESS else ()), *SPEECH_CODEC_ARGS, out_path,
+    )
+    if code != 0:
+        raise RuntimeError(f"ffmpeg segment cut failed: {_ffmpeg_error(stderr)}")
+    return _output_seconds(stderr)
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r'\W+', '', word).lower()
+
+
+def _find_overlap(previous: List[str], current: List[str]) -> Tuple[int, int]:
+    """Locate the words both transcripts share at a segment overlap.
+
+    The shared words must be a suffix of previous and a prefix of current
+    (of at least MIN_OVERLAP_WORDS normalized words, within OVERLAP_WORDS),
+    except that one word at either edge may be a fragment of a word cut in
+    half. Returns how many trailing words to drop from previous and how many
+    leading words to drop from current; (0, 0) when there is no such match,
+    so text is duplicated rather than lost.
+    """
+    tail = [_normalize_word(w) for w in previous[-(OVERLAP_WORDS + 1):]]
+    head = [_normalize_word(w) for w in current[:OVERLAP_WORDS + 1]]
+
+    for length in range(min(OVERLAP_WORDS, len(tail), len(head)), MIN_OVERLAP_WORDS - 1, -1):
+        for tail_fragment, head_fragment in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            end = len(tail) - tail_fragment
+            if length > end:
+                continue
+            shared = tail[end - length:end]
+            if all(shared) and shared == head[head_fragment:head_fragment + length]:
+                return tail_fragment, head_fragment + length
+    return 0, 0
+
+
+def stitch_transcripts(transcripts: List[str]) -> str:
+    """Join segment transcripts in order, removing duplicates at overlaps."""
+    words: List[str] = []
+    for transcript in transcripts:
+        segment_words = transcript.split()
+        if words:
+            drop_previous, drop_current = _find_overlap(words, segment_words)
+            del words[len(words) - drop_previous:]
+            segment_words = segment_words[drop_current:]
+        words.extend(segment_words)
+    return " ".join(words)
+
+
+def needs_segmenting(size: Optional[int], duration) -> bool:
+    """Whether a recording of size bytes should be transcribed in segments."""
+    return as_seconds(duration) > SEGMENT_THRESHOLD or (size or 0) > MAX_UPLOAD_BYTES
+
+
+async def transcribe_segmented(
+    path: str,
+    workdir: str,
+    transcribe: Callable[[str], Awaitable[str]],
+    concurrency: int = TRANSCRIBE_CONCURRENCY,
+) -> str:
+    """Split a recording at silences and transcribe the segments concurrently.
+
+    ``transcribe`` takes the path of one segment file and returns its text.
+    """
+    duration = await probe_duration(path)
+    segments = plan_segments(duration, await detect_silences(path))
+    logger.info(f"Transcribing {duration:.0f}s of audio in {len(segments)} segments")
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    uploaded = []
+
+    async def transcribe_segment(index: int, start: float, end: float) -> str:
+        async with semaphore:
+            segment_path = os.path.join(workdir, f'segment_{index:04d}.mp3')
+            seconds = await cut_segment(path, start, end, segment_path)
+            uploaded.append((os.path.getsize(segment_path), seconds))
+            try:
+                return await transcribe(segment_path)
+            finally:
+                os.remove(segment_path)
+
+    transcripts = await asyncio.gather(
+        *(transcribe_segment(i, start, end) for i, (start, end) in enumerate(segments))
+    )
+    record_upload(
+        os.path.getsize(path), duration, sum(size for size, _ in uploaded), sum(seconds for _, seconds in uploaded)
+    )
+    return stitch_transcripts(list(transcripts))
@@ -0,0 +1,1367 @@
+#!/usr/bin/env python3
+"""
+Offline Benchmarks
+
+Runs the bot's pipelines against local fake backends so performance can be
+measured without API keys or network access.
+
+Usage:
+    python benchmark.py summaries [--chapters 30] [--latency 0.2]
+    python benchmark.py chunker [--words 300000]
+    python benchmark.py html [--corpus DIR]
+    python benchmark.py render [--documents 20]
+    python benchmark.py mermaid [--diagrams 5]
+    python benchmark.py audio [--recordings 5] [--pause-share 0.3]
+    python benchmark.py segments [--minutes 40] [--latency 0.2]
+    python benchmark.py ratelimit [--requests 200] [--limit 20 --window 1]
+    python benchmark.py load [--updates 200] [--rate 20] [--mix text=5,voice=2,document=2,url=1]
+    python benchmark.py isolation [--updates 60] [--chats 20]
+    python benchmark.py webhook [--updates 200] [--rate 50] [--backlog 10]
+    python benchmark.py resume [--chapters 40] [--interrupt-after 1]
+    python benchmark.py fairness [--documents 5] [--chats 30] [--chat-rate 3]
+    python benchmark.py completions [--requests 300] [--distinct 30]
+"""
+
+import io
+import os
+import re
+import sys
+import glob
+import json
+import time
+import logging
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import itertools
+import collections
+import urllib.parse
+from types import SimpleNamespace
+
+from openai import AsyncOpenAI
+
+import artifact_cache
+import audio
+import completion_cache
+import extraction
+import job_store
+import make_summary
+import model_client
+import outbox
+import rate_limit
+import render
+import webhook
+
+
+class FakeModelBackend:
+    """Stand-in for AsyncOpenAI that answers after a configurable delay."""
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        # Requests (create() keyword arguments) this predicate accepts fail like a dropped connection
+        self.fail_when = None
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+
+    async def _sleep(self):
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    async def _create_completion(self, **kwargs):
+        self.calls += 1
+        await self._sleep()
+        if self.fail_when is not None and self.fail_when(kwargs):
+            raise RuntimeError("Connection error.")
+        content = r"\item Fake summary point one. \item Fake summary point two with a few more words."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    async def close(self):
+        pass
+
+
+class FakeHTTPServer:
+    """Minimal keep-alive HTTP/1.1 server on a free local port.
+
+    Subclasses implement ``route(method, path, headers, body)`` returning
+    ``(status, content_type, body, extra_headers)``; ``body`` may be an
+    async iterator of chunks, which is sent with chunked encoding.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self._server = None
+        self._connections = {}
+        self.url = None
+
+    async def start(self) -> str:
+        """Start listening; return the server's base URL."""
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        self._server.close()
+        # Idle keep-alive connections would otherwise keep their handlers waiting
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*self._connections.values(), return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def delay(self):
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    async def route(self, method: str, path: str, headers: dict, body: bytes):
+        raise NotImplementedError
+
+    async def _handle(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                self.requests += 1
+                status, content_type, payload, extra = await self.route(method, path, headers, body)
+                head = [f"HTTP/1.1 {status}", f"Content-Type: {content_type}"]
+                head += [f"{name}: {value}" for name, value in extra.items()]
+                if isinstance(payload, bytes):
+                    head.append(f"Content-Length: {len(payload)}")
+                    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+                else:
+                    head.append("Transfer-Encoding: chunked")
+                    writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+                    async for chunk in payload:
+                        writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        await writer.drain()
+                    writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+
+def _json(data) -> bytes:
+    return json.dumps(data).encode()
+
+
+_MARKER = re.compile(rb'marker\d+')
+
+
+class FakeOpenAIServer(FakeHTTPServer):
+    """Local OpenAI-compatible server that throttles like the real API.
+
+    Serves chat completions (plain and streamed), Whisper transcriptions and
+    image generations after ``latency`` (+/- ``jitter``) seconds. At most
+    ``limit`` requests are allowed per ``window`` seconds (sliding window);
+    every response carries x-ratelimit-* headers and excess requests get a 429.
+
+    Markers (``marker<n>``) in a request are echoed in its answer, so the
+    output produced for one update can be traced back to it.
+    """
+
+    CONTENT = r"\item Fake summary point one. \item Fake summary point two with a few more words."
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, limit: int = None, window: float = 60.0,
+                 stream_chunks: int = 20):
+        super().__init__(latency, jitter)
+        self.limit = limit
+        self.window = window
+        self.stream_chunks = stream_chunks
+        self.throttled = 0
+        self._admitted = collections.deque()
+
+    async def start(self) -> str:
+        """Start listening; return the API base URL."""
+        return await super().start() + "/v1"
+
+    def _admit(self):
+        """Return (allowed, remaining, seconds until the whole budget is back)."""
+        if self.limit is None:
+            return True, 1000000, 0.0
+        now = time.monotonic()
+        while self._admitted and self._admitted[0] <= now - self.window:
+            self._admitted.popleft()
+        allowed = len(self._admitted) < self.limit
+        if allowed:
+            self._admitted.append(now)
+        reset = self._admitted[-1] + self.window - now if self._admitted else 0.0
+        return allowed, self.limit - len(self._admitted), reset
+
+    async def _stream(self, markers: str = "", usage: bool = False):
+        for i in range(self.stream_chunks):
+            await asyncio.sleep(self.latency / self.stream_chunks)
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": "fake",
+                "choices": [{"index": 0, "delta": {"content": f"word{i} "}, "finish_reason": None}],
+            }
+            yield b"data: " + _json(chunk) + b"\n\n"
+        if markers:
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": "fake",
+                "choices": [{"index": 0, "delta": {"content": markers}, "finish_reason": None}],
+            }
+            yield b"data: " + _json(chunk) + b"\n\n"
+        if usage:
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": "fake",
+                "choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": self.stream_chunks,
+                                         "total_tokens": 10 + self.stream_chunks},
+            }
+            yield b"data: " + _json(chunk) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    async def route(self, method, path, headers, body):
+        allowed, remaining, reset = self._admit()
+        extra = {
+            "x-ratelimit-limit-requests": self.limit or 1000000,
+            "x-ratelimit-remaining-requests": max(0, remaining),
+            "x-ratelimit-reset-requests": f"{int(reset * 1000)}ms",
+        }
+        if not allowed:
+            self.throttled += 1
+            error = {"message": "Rate limit reached for requests", "type": "requests", "code": "rate_limit_exceeded"}
+            return "429 Too Many Requests", "application/json", _json({"error": error}), extra
+
+        markers = " ".join(sorted(set(marker.decode() for marker in _MARKER.findall(body))))
+        request = json.loads(body) if path.endswith("/chat/completions") else {}
+        if request.get("stream"):
+            usage = bool((request.get("stream_options") or {}).get("include_usage"))
+            return "200 OK", "text/event-stream", self._stream(markers, usage), extra
+
+        await self.delay()
+        if path.endswith("/audio/transcriptions"):
+            return "200 OK", "text/plain", b"Fake transcription of the recording. " * 10 + markers.encode(), extra
+        if path.endswith("/images/generations"):
+            return "200 OK", "application/json", _json({"created": 0, "data": [{"url": f"{self.url}/image.png"}]}), extra
+        result = {
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": "fake",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": f"{self.CONTENT} {markers}".strip()}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+        }
+        return "200 OK", "application/json", _json(result), extra
+
+
+class FakeTelegramServer(FakeHTTPServer):
+    """Local stand-in for the Telegram Bot API.
+
+    Answers the methods the bot uses with plausible objects, serves the
+    files registered with ``add_file`` for download, and serves synthetic
+    web pages under /web/ for URL summaries.
+    """
+
+    TOKEN = "123456:FAKE"
+
+    def __init__(self, latency: float = 0.02, jitter: float = 0.0):
+        super().__init__(latency, jitter)
+        self.files = {}
+        self.calls = collections.Counter()
+        # chat id -> [(method, text or PDF bytes)] of the messages sent to it
+        self.sent = collections.defaultdict(list)
+        self._message_ids = itertools.count(1)
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"{self.url}/file/bot"
+
+    def add_file(self, file_id: str, content: bytes) -> None:
+        self.files[file_id] = content
+
+    @staticmethod
+    def _params(headers: dict, body: bytes) -> dict:
+        content_type = headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            fields = re.findall(rb'name="([^"]+)"\r\n\r\n([^\r]*)\r\n', body)
+            return {name.decode(): value.decode(errors='replace') for name, value in fields}
+        return {name: values[0] for name, values in urllib.parse.parse_qs(body.decode()).items()}
+
+    def _message(self, params: dict, **content) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": int(params.get("message_id", 0)) or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group", "title": "Load test"},
+            **content,
+        }
+
+    async def route(self, method, path, headers, body):
+        if path.startswith("/web/"):
+            seed = int(path.rsplit("/", 1)[-1] or 0)
+            # Several chapters long: a single short chapter summary is dropped as a fragment
+            page = fake_html_page(paragraphs=60, seed=seed, marker=f"marker{seed}")
+            return "200 OK", "text/html; charset=utf-8", page.encode(), {}
+        if path.startswith("/file/bot"):
+            file_id = path.rsplit("/", 1)[-1]
+            return "200 OK", "application/octet-stream", self.files.get(file_id, b""), {}
+
+        bot_method = path.rsplit("/", 1)[-1]
+        self.calls[bot_method] += 1
+        params = self._params(headers, body)
+        if bot_method in ("sendMessage", "editMessageText"):
+            self.sent[int(params.get("chat_id", 0))].append((bot_method, params.get("text", "")))
+        elif bot_method == "sendDocument":
+            # A document sent again by file_id is the one uploaded under that id
+            pdf = re.search(rb'%PDF-.*%%EOF', body, re.DOTALL)
+            document = pdf.group(0) if pdf else self.files.get(params.get("document", ""), b"")
+            self.sent[int(params.get("chat_id", 0))].append((bot_method, document))
+        await self.delay()
+
+        if bot_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif bot_method in ("setWebhook", "deleteWebhook"):
+            result = True
+        elif bot_method == "getFile":
+            file_id = params.get("file_id", "")
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files.get(file_id, b"")),
+                      "file_path": f"files/{file_id}"}
+        elif bot_method == "sendDocument":
+            file_id = f"sent-document-{next(self._message_ids)}"
+            self.files[file_id] = document
+            result = self._message(params, document={"file_id": file_id, "file_unique_id": file_id})
+        elif bot_method == "sendPhoto":
+            file_id = f"sent-photo-{next(self._message_ids)}"
+            result = self._message(params, photo=[{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}])
+        else:
+            # sendMessage, editMessageText and anything else that returns a message
+            result = self._message(params, text=params.get("text", ""))
+        return "200 OK", "application/json", _json({"ok": True, "result": result}), {}
+
+
+async def iterate(texts):
+    """Yield texts as an async iterable, like an extraction stream."""
+    for text in texts:
+        yield text
+
+
+def fake_chapters(count: int, words: int = 1000):
+    """Build ``count`` chapters of filler text."""
+    return [" ".join(f"word{i}" for i in range(words)) for _ in range(count)]
+
+
+def legacy_extract_chapters(text: str, max_words: int = 1000):
+    """The original word-count chunker, kept as the chunker baseline."""
+    words = text.split()
+    chunks = []
+    chunk = ""
+
+    for word in words:
+        if len(chunk.split()) + 1 <= max_words:
+            chunk += " " + word
+        else:
+            chunks.append(chunk.strip())
+            chunk = word
+
+    if chunk.strip():
+        chunks.append(chunk.strip())
+
+    return chunks
+
+
+def fake_document(words: int, paragraph_words: int = 120):
+    """Build a document of sentences grouped into paragraphs."""
+    vocabulary = ["model", "latency", "summary", "chapter", "token", "budget", "page", "text"]
+    rng = random.Random(0)
+    paragraphs = []
+    for start in range(0, words, paragraph_words):
+        count = min(paragraph_words, words - start)
+        sentence = [rng.choice(vocabulary) for _ in range(count)]
+        for i in range(11, count, 12):
+            sentence[i] += "."
+        paragraphs.append(" ".join(sentence))
+    return "\n\n".join(paragraphs)
+
+
+def bench_chunker(args):
+    text = fake_document(args.words)
+    print(f"{args.words} words, {len(text) / 1e6:.1f} MB")
+    print(f"{'implementation':>16} {'time (s)':>10} {'chunks':>8}")
+
+    start = time.perf_counter()
+    chunks = list(make_summary.iter_chunks([text]))
+    print(f"{'iter_chunks':>16} {time.perf_counter() - start:>10.3f} {len(chunks):>8}")
+
+    if args.words > args.legacy_limit:
+        print(f"{'legacy':>16} {'skipped':>10} (over --legacy-limit {args.legacy_limit} words)")
+        return
+    start = time.perf_counter()
+    chunks = legacy_extract_chapters(text)
+    print(f"{'legacy':>16} {time.perf_counter() - start:>10.3f} {len(chunks):>8}")
+
+
+def fake_html_page(paragraphs: int = 12, seed: int = 0, marker: str = "") -> str:
+    """Build a page with an article surrounded by typical boilerplate (marker starts the article)."""
+    rng = random.Random(seed)
+    vocabulary = ["model", "latency", "summary", "chapter", "token", "budget", "page", "text", "cache"]
+
+    def sentence(words):
+        return " ".join(rng.choice(vocabulary) for _ in range(words)).capitalize() + ", and more text."
+
+    links = "".join(f'<li><a href="/section/{i}">{sentence(3)}</a></li>' for i in range(40))
+    article = "".join(f"<p>{sentence(25)} {sentence(20)}</p>" for _ in range(paragraphs))
+    if marker:
+        article = f"<p>{marker} {sentence(25)}</p>" + article
+    comments = "".join(f'<div class="comment"><p>{sentence(15)}</p></div>' for _ in range(30))
+    return (
+        f'<html><head><style>body {{ margin: 0 }}</style><script>var x = 1;</script></head><body>'
+        f'<nav><ul>{links}</ul></nav>'
+        f'<div class="cookie-consent"><p>{sentence(30)}</p></div>'
+        f'<main><article><h1>{sentence(6)}</h1>{article}</article></main>'
+        f'<aside class="related"><ul>{links}</ul></aside>'
+        f'<section id="comments">{comments}</section>'
+        f'<footer><p>{sentence(40)}</p><ul>{links}</ul></footer>'
+        f'</body></html>'
+    )
+
+
+def bench_html(args):
+    if args.corpus:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(args.corpus, "*.htm*"))):
+            with open(path, 'rb') as f:
+                pages.append((os.path.basename(path), f.read()))
+    else:
+        pages = [(f"synthetic-{i}", fake_html_page(paragraphs=6 + 6 * i, seed=i)) for i in range(5)]
+
+    print(f"parser: {extraction.HTML_PARSER}")
+    print(f"{'page':>24} {'full ms':>8} {'main ms':>8} {'full tok':>9} {'main tok':>9} {'drop':>6} {'chapters':>9}")
+    totals = [0, 0, 0, 0]
+    for name, html in pages:
+        start = time.perf_counter()
+        full = extraction.extract_html_text(html)
+        full_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        main = extraction.extract_main_content(html)
+        main_ms = (time.perf_counter() - start) * 1000
+
+        full_tokens = make_summary.estimate_tokens(full)
+        main_tokens = make_summary.estimate_tokens(main)
+        chapters = f"{len(make_summary.extract_chapters(full))}->{len(make_summary.extract_chapters(main))}"
+        drop = 1 - main_tokens / full_tokens if full_tokens else 0
+        print(f"{name[-24:]:>24} {full_ms:>8.1f} {main_ms:>8.1f} {full_tokens:>9} {main_tokens:>9} {drop:>6.0%} {chapters:>9}")
+        for i, value in enumerate((full_ms, main_ms, full_tokens, main_tokens)):
+            totals[i] += value
+
+    if pages and totals[2]:
+        print(f"{'total':>24} {totals[0]:>8.1f} {totals[1]:>8.1f} {totals[2]:>9} {totals[3]:>9} {1 - totals[3] / totals[2]:>6.0%}")
+
+
+async def bench_render(args):
+    summaries = [r"\item Fake summary point one. \item Fake summary point two." for _ in range(args.chapters)]
+    overall = "An overall summary of the fake document. " * 5
+    body = make_summary.latex_body(summaries, overall)
+    blocks = make_summary.plain_blocks(summaries, overall)
+
+    print(f"{args.documents} documents of {args.chapters} chapters, LaTeX concurrency {render.LATEX_CONCURRENCY}")
+    print(f"{'renderer':>22} {'wall (s)':>10} {'docs/s':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        for i in range(args.documents):
+            render.write_text_pdf(os.path.join(workdir, f"plain_{i}.pdf"), blocks)
+        elapsed = time.perf_counter() - start
+        print(f"{'plain PDF':>22} {elapsed:>10.2f} {args.documents / elapsed:>8.1f}")
+
+        if not render.latex_available():
+            print(f"{'pdflatex':>22} {'skipped':>10} (pdflatex not installed)")
+            return
+
+        for use_format, label in ((False, "pdflatex"), (True, "pdflatex + format")):
+            outputs = [os.path.join(workdir, f"{use_format}_{i}", "doc.pdf") for i in range(args.documents + 1)]
+            for output in outputs:
+                os.makedirs(os.path.dirname(output))
+            # Untimed first compile (builds the format file when used)
+            await render.render_latex(body, outputs.pop(), use_format=use_format)
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(
+                render.render_latex(body, output, use_format=use_format) for output in outputs
+            ))
+            elapsed = time.perf_counter() - start
+            print(f"{label:>22} {elapsed:>10.2f} {args.documents / elapsed:>8.1f}"
+                  f"{'' if all(results) else '  (some compiles failed)'}")
+
+
+async def bench_mermaid(args):
+    if not render.mermaid_available():
+        print("mmdc not installed, skipping")
+        return
+
+    diagrams = [f"graph TD; A{i}-->B{i}; B{i}-->C{i}; A{i}-->C{i};" for i in range(args.diagrams)]
+    print(f"{args.diagrams} diagrams, mmdc concurrency {render.MERMAID_CONCURRENCY}")
+    print(f"{'cache':>8} {'PNG mean (s)':>13} {'PDF mean (s)':>13}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        render.MERMAID_CACHE_DIR = cache_dir
+        for label in ("cold", "warm"):
+            png_times, pdf_times = [], []
+            for source in diagrams:
+                start = time.perf_counter()
+                png_future, pdf_future = render.render_mermaid(source)
+                await png_future
+                png_times.append(time.perf_counter() - start)
+                await pdf_future
+                pdf_times.append(time.perf_counter() - start)
+            print(f"{label:>8} {sum(png_times) / len(png_times):>13.3f} {sum(pdf_times) / len(pdf_times):>13.3f}")
+
+    # A cache smaller than the diagrams in flight: pruning must spare the sources of queued renders
+    check = Checks()
+    max_files = render.MERMAID_CACHE_MAX_FILES
+    with tempfile.TemporaryDirectory() as cache_dir:
+        render.MERMAID_CACHE_DIR = cache_dir
+        render.MERMAID_CACHE_MAX_FILES = 3
+        try:
+            futures = [future for source in diagrams for future in render.render_mermaid(source)]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+        finally:
+            render.MERMAID_CACHE_MAX_FILES = max_files
+    failed = [result for result in results if isinstance(result, Exception)]
+    check(not failed, f"{args.diagrams} diagrams at once with a 3-file cache rendered"
+                      + (f" ({len(failed)} failed, first: {failed[0]})" if failed else ""))
+    check.finish()
+
+
+async def fake_recording(path: str, seconds: float, pause_share: float, codec_args) -> float:
+    """Tone bursts ("speech") separated by silent pauses, encoded with codec_args; return its length."""
+    inputs, speech = [], True
+    total = 0.0
+    while total < seconds:
+        if speech:
+            length = random.uniform(2, 8)
+            inputs += ['-f', 'lavfi', '-i', f'sine=f={random.randint(200, 800)}:r=48000:d={length:.2f}']
+        else:
+            # Speech bursts average 5 s
+            length = random.uniform(0.2, 1.8) * 5 * pause_share / (1 - pause_share)
+            inputs += ['-f', 'lavfi', '-i', f'anullsrc=r=48000:cl=mono:d={length:.2f}']
+        total += length
+        speech = not speech
+    count = len(inputs) // 4
+    graph = "".join(f"[{i}]" for i in range(count)) + f"concat=n={count}:v=0:a=1"
+    code, _, stderr = await audio.run_command(
+        'ffmpeg', '-v', 'error', '-y', *inputs, '-filter_complex', graph, *codec_args, path
+    )
+    if code != 0:
+        raise RuntimeError(stderr.decode(errors='replace'))
+    return total
+
+
+class Checks:
+    """Named pass/fail checks; exits non-zero when any failed."""
+
+    def __init__(self):
+        self.failed = 0
+
+    def __call__(self, ok: bool, label: str) -> None:
+        print(f"{'ok' if ok else 'FAIL':>4}  {label}")
+        self.failed += not ok
+
+    def finish(self) -> None:
+        if self.failed:
+            raise SystemExit(f"{self.failed} checks failed")
+
+
+def fake_speech(seconds: float, rng: random.Random):
+    """(start, word) script of speech at 2.5 words/s from a small vocabulary, so phrases repeat often."""
+    vocabulary = "in the and we then to a of it was day long back river morning evening".split()
+    return [(i / 2.5, rng.choice(vocabulary)) for i in range(int(seconds * 2.5))]
+
+
+async def bench_segments(args):
+    check = Checks()
+
+    # Segment planning
+    check(audio.plan_segments(200, []) == [(0.0, 200)], "short recording is one segment")
+    segments = audio.plan_segments(1000, [(290, 291), (612, 614)], target=300, overlap=2)
+    cuts = [start + 2 for start, _ in segments[1:]]
+    check(cuts[:2] == [290.5, 613], "cuts are placed in the middle of silences near the target")
+    check(cuts[2] == 913, "without a silence nearby the cut is made at the target")
+    check(segments[0][0] == 0 and segments[-1][1] == 1000, "segments cover the whole recording")
+    check(all(a_end - b_start == 4 for (_, a_end), (b_start, _) in zip(segments, segments[1:])),
+          "neighbouring segments overlap by twice the overlap")
+    segments = audio.plan_segments(3000, [], target=300, overlap=2)
+    check(all(end - start <= 300 * 1.25 + 4 for start, end in segments), "segments stay near the target length")
+
+    # Stitching
+    first = ("we met in the morning and then walked to the river where the boats "
+             "were waiting for us all day long")
+    second = "day long and after that we drove back in the evening to see friends"
+    check(audio.stitch_transcripts([first, second]) == f"{first} {second}",
+          "a common phrase or a short repeat deletes no text")
+    check(audio.stitch_transcripts(["so the plan is to leave at nine and arrive by noo",
+                                    "ive at nine and arrive by noon then we eat"])
+          == "so the plan is to leave at nine and arrive by noon then we eat",
+          "an overlap with words cut in half at both edges is joined once")
+    check(audio.stitch_transcripts(["one two three", "", "four five"]) == "one two three four five",
+          "an empty segment transcript is skipped")
+
+    # Segmented transcription against a fake transcriber that "hears" a script of words:
+    # a segment's transcript is the words spoken in it, with words cut at its edges in half
+    rng = random.Random(0)
+    duration = args.minutes * 60
+    script = fake_speech(duration, rng)
+    silences = [(t, t + 0.8) for t in range(37, int(duration), 41)]
+    cuts = {}
+
+    async def probe_duration(path):
+        return float(duration)
+
+    async def detect_silences(path):
+        return silences
+
+    async def cut_segment(path, start, end, out_path):
+        with open(out_path, "w") as f:
+            f.write(f"{start} {end}")
+        return end - start
+
+    async def transcribe(segment_path):
+        with open(segment_path) as f:
+            start, end = map(float, f.read().split())
+        cuts[segment_path] = (start, end)
+        await asyncio.sleep(args.latency)
+        words = []
+        for at, word in script:
+            if start <= at and at + 0.3 <= end:
+                words.append(word)
+            elif at < start < at + 0.3:
+                words.append(word[len(word) // 2:] or word)
+            elif at < end < at + 0.3:
+                words.append(word[:len(word) // 2] or word)
+        return " ".join(words)
+
+    originals = audio.probe_duration, audio.detect_silences, audio.cut_segment
+    audio.probe_duration, audio.detect_silences, audio.cut_segment = probe_duration, detect_silences, cut_segment
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            recording = os.path.join(workdir, "recording.oga")
+            with open(recording, "wb") as f:
+                f.write(b"\0" * 1024)
+            start = time.perf_counter()
+            text = await audio.transcribe_segmented(recording, workdir, transcribe)
+            elapsed = time.perf_counter() - start
+    finally:
+        audio.probe_duration, audio.detect_silences, audio.cut_segment = originals
+
+    expected = " ".join(word for _, word in script)
+    check(len(cuts) > 1, f"{args.minutes} min recording transcribed in {len(cuts)} segments ({elapsed:.2f}s, "
+                         f"concurrency {audio.TRANSCRIBE_CONCURRENCY})")
+    check(text == expected, f"stitched transcript equals the script ({len(text.split())} of {len(script)} words)")
+    check.finish()
+
+
+async def bench_audio(args):
+    if not audio.ffmpeg_available():
+        print("ffmpeg not installed, skipping")
+        return
+
+    random.seed(0)
+    kinds = {
+        "voice note": (('-ac', '1', '-c:a', 'libopus', '-b:a', '32k'), 'voice.oga'),
+        "audio file": (('-ac', '2', '-ar', '44100', '-c:a', 'libmp3lame', '-b:a', '128k'), 'audio.mp3'),
+    }
+    print(f"{args.recordings} recordings of {args.seconds:.0f}s per kind, pauses ~{args.pause_share:.0%} of the time")
+    print(f"{'recording':>12} {'received':>10} {'uploaded':>10} {'received':>10} {'uploaded':>10} {'ffmpeg':>8}")
+    print(f"{'':>12} {'(KB)':>10} {'(KB)':>10} {'(s)':>10} {'(s)':>10} {'(s)':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for label, (codec_args, name) in kinds.items():
+            received_bytes = uploaded_bytes = received_seconds = uploaded_seconds = elapsed = 0.0
+            for index in range(args.recordings):
+                path = os.path.join(workdir, f"{index}_{name}")
+                length = await fake_recording(path, args.seconds, args.pause_share, codec_args)
+                with open(path, 'rb') as f:
+                    buffer = io.BytesIO(f.read())
+                buffer.name = name
+
+                start = time.perf_counter()
+                with buffer.getbuffer() as view:
+                    data, seconds = await audio.compact_speech(view)
+                elapsed += time.perf_counter() - start
+                received_bytes += len(buffer.getvalue())
+                received_seconds += length
+                uploaded_bytes += len(data)
+                uploaded_seconds += seconds
+            n = args.recordings
+            print(f"{label:>12} {received_bytes / n / 1024:>10.0f} {uploaded_bytes / n / 1024:>10.0f} "
+                  f"{received_seconds / n:>10.1f} {uploaded_seconds / n:>10.1f} {elapsed / n:>8.2f}")
+
+
+async def bench_ratelimit(args):
+    messages = [{"role": "user", "content": "Summarize this fake chapter."}]
+    print(f"{args.requests} requests against a fake API allowing {args.limit} per {args.window:g}s")
+    print(f"{'client':>22} {'wall (s)':>10} {'ok':>5} {'failed':>7} {'429s':>6} {'retries':>8}")
+
+    # Baseline: the SDK's own retries (2 by default), no shared pacing
+    server = FakeOpenAIServer(latency=args.latency, limit=args.limit, window=args.window)
+    client = AsyncOpenAI(api_key="fake", base_url=await server.start())
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        client.chat.completions.create(model="fake", messages=messages, max_tokens=50)
+        for _ in range(args.requests)
+    ), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    failed = sum(isinstance(result, Exception) for result in results)
+    print(f"{'SDK retries':>22} {elapsed:>10.2f} {len(results) - failed:>5} {failed:>7} {server.throttled:>6} {'-':>8}")
+    await client.close()
+    await server.stop()
+
+    server = FakeOpenAIServer(latency=args.latency, limit=args.limit, window=args.window)
+    model_client.governor = rate_limit.RateGovernor()
+    model_client.set_client(model_client.create_client(base_url=await server.start(), api_key="fake"))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        model_client.chat_completion(messages, max_tokens=50) for _ in range(args.requests)
+    ), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    failed = sum(isinstance(result, Exception) for result in results)
+    governor = model_client.governor
+    print(f"{'rate governor':>22} {elapsed:>10.2f} {len(results) - failed:>5} {failed:>7} {server.throttled:>6} "
+          f"{governor.retries:>8}   (final concurrency limit {int(governor.limit)})")
+    await model_client.close()
+    await server.stop()
+
+    # 429s come from probing before the budget is known (11-31 here, for any request count), not one per request
+    check = Checks()
+    check(not failed, f"every request through the governor completed ({failed} failed)")
+    bound = 2 * int(governor.maximum)
+    check(server.throttled <= bound, f"{server.throttled} requests throttled, at most {bound}")
+    check.finish()
+
+
+def fake_update(kind: str, index: int, chat_id: int, telegram: FakeTelegramServer) -> dict:
+    """Telegram update JSON of the given kind; its files are registered with the fake server.
+
+    The content carries the marker ``marker<index>``, which the fake servers echo into the outputs.
+    """
+    message = {
+        "message_id": index,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+    }
+    if kind == "text":
+        message["text"] = f"Question {index} (marker{index}): how do I keep a sourdough starter alive on vacation?"
+    elif kind == "url":
+        message["text"] = f"{telegram.url}/web/{index}"
+    elif kind == "voice":
+        file_id = f"voice-{index}"
+        telegram.add_file(file_id, f"marker{index} ".encode() + os.urandom(16 * 1024))
+        message["voice"] = {"file_id": file_id, "file_unique_id": file_id, "duration": 20}
+    elif kind == "document":
+        # Unique content per update so the artifact cache does not answer it
+        file_id = f"document-{index}"
+        telegram.add_file(file_id, f"Report {index} marker{index}\n\n{fake_document(3000)}".encode())
+        message["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": f"report_{index}.txt"}
+    else:
+        raise ValueError(f"Unknown update kind: {kind}")
+    return {"update_id": index, "message": message}
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def fake_application(telegram: FakeTelegramServer, backlog: int = None):
+    """The bot's Application with its handlers, talking to the fake Telegram server."""
+    from telegram.ext import ApplicationBuilder
+    import bot
+
+    application = (
+        ApplicationBuilder()
+        .token(FakeTelegramServer.TOKEN)
+        .base_url(telegram.base_url)
+        .base_file_url(telegram.base_file_url)
+        .concurrent_updates(webhook.BoundedUpdateProcessor(bot.CONCURRENT_UPDATES, bot.UPDATE_BACKLOG if backlog is None else backlog))
+        .build()
+    )
+    bot.add_handlers(application)
+    return application
+
+
+def update_kinds(mix: str, count: int):
+    """``count`` update kinds drawn (reproducibly) from a mix like "text=5,voice=2"."""
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        weights[kind.strip()] = float(weight or 1)
+    return random.Random(0).choices(list(weights), weights=list(weights.values()), k=count)
+
+
+async def bench_load(args):
+    from telegram import Update
+    import bot
+
+    kinds = update_kinds(args.mix, args.updates)
+
+    openai_server = FakeOpenAIServer(latency=args.openai_latency, jitter=args.jitter)
+    telegram = FakeTelegramServer(latency=args.telegram_latency, jitter=args.jitter)
+    model_client.set_client(model_client.create_client(base_url=await openai_server.start(), api_key="fake"))
+    await telegram.start()
+    if args.unlimited_outbox:
+        outbox._global_bucket = outbox.TokenBucket(1e6, 1000000)
+        outbox.PRIVATE_CHAT_RATE = 1e6
+
+    latencies = collections.defaultdict(list)
+    with tempfile.TemporaryDirectory() as workdir:
+        bot.temp_dir = workdir
+        artifact_cache.CACHE_DIR = os.path.join(workdir, "artifacts")
+        job_store.JOB_STORE_DIR = os.path.join(workdir, "jobs")
+
+        application = fake_application(telegram)
+        await application.initialize()
+
+        async def replay(kind: str, data: dict):
+            update = Update.de_json(data, application.bot)
+            arrived = time.perf_counter()
+            # Same concurrency limit as the running bot
+            await application.update_processor.process_update(update, application.process_update(update))
+            latencies[kind].append(time.perf_counter() - arrived)
+
+        print(f"{args.updates} updates ({args.mix}), {'as fast as possible' if not args.rate else f'{args.rate:g}/s'}, "
+              f"{bot.CONCURRENT_UPDATES} concurrent, fake latency OpenAI {args.openai_latency * 1000:.0f} ms / "
+              f"Telegram {args.telegram_latency * 1000:.0f} ms")
+        start = time.perf_counter()
+        tasks = []
+        for index, kind in enumerate(kinds, start=1):
+            # Each update comes from its own chat unless --chats limits them
+            chat_id = 1000 + (index % args.chats if args.chats else index)
+            tasks.append(asyncio.create_task(replay(kind, fake_update(kind, index, chat_id, telegram))))
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+        await application.shutdown()
+        await model_client.close()
+        await openai_server.stop()
+        await telegram.stop()
+        extraction.shutdown()
+        job_store.close()
+
+    print(f"{'type':>10} {'count':>6} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8}")
+    for kind, values in sorted(latencies.items()) + [("all", sum(latencies.values(), []))]:
+        print(f"{kind:>10} {len(values):>6} {percentile(values, 0.5):>8.2f} "
+              f"{percentile(values, 0.95):>8.2f} {percentile(values, 0.99):>8.2f}")
+    print(f"throughput {args.updates / elapsed:.1f} updates/s ({elapsed:.1f}s), OpenAI calls {openai_server.requests}")
+    print("Telegram calls " + ", ".join(f"{method} {count}" for method, count in sorted(telegram.calls.items())))
+    # ru_maxrss is in KiB on Linux
+    print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB "
+          f"(largest extraction worker {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} MB)")
+
+
+async def bench_isolation(args):
+    from pdfminer.high_level import extract_text
+    from telegram import Update
+    import bot
+
+    kinds = update_kinds(args.mix, args.updates)
+    openai_server = FakeOpenAIServer(latency=args.openai_latency, jitter=args.openai_latency / 2)
+    telegram = FakeTelegramServer(latency=0.01, jitter=0.01)
+    model_client.set_client(model_client.create_client(base_url=await openai_server.start(), api_key="fake"))
+    await telegram.start()
+    outbox._global_bucket = outbox.TokenBucket(1e6, 1000000)
+    outbox.PRIVATE_CHAT_RATE = 1e6
+
+    # chat id -> markers of the updates it sent, and update marker -> (kind, chat id)
+    owned = collections.defaultdict(set)
+    updates = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        bot.temp_dir = workdir
+        artifact_cache.CACHE_DIR = os.path.join(workdir, "artifacts")
+        job_store.JOB_STORE_DIR = os.path.join(workdir, "jobs")
+        application = fake_application(telegram)
+        await application.initialize()
+
+        async def replay(data: dict):
+            update = Update.de_json(data, application.bot)
+            try:
+                await application.update_processor.process_update(update, application.process_update(update))
+            except Exception as e:
+                failures.append(f"update {update.update_id}: {e!r}")
+
+        tasks = []
+        for index, kind in enumerate(kinds, start=1):
+            chat_id = 1000 + index % args.chats
+            owned[chat_id].add(f"marker{index}")
+            updates[f"marker{index}"] = (kind, chat_id)
+            tasks.append(asyncio.create_task(replay(fake_update(kind, index, chat_id, telegram))))
+        print(f"{args.updates} simultaneous updates ({args.mix}) from {args.chats} chats")
+        start = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+        await application.shutdown()
+        await model_client.close()
+        await openai_server.stop()
+        await telegram.stop()
+        extraction.shutdown()
+        job_store.close()
+
+    check = Checks()
+    check(not failures, f"all updates handled in {elapsed:.1f}s" + (f" (first failure: {failures[0]})" if failures else ""))
+
+    # Markers each chat received, in messages and in PDFs
+    in_text, in_pdf = collections.defaultdict(set), collections.defaultdict(set)
+    for chat_id, messages in telegram.sent.items():
+        for method, payload in messages:
+            if method == "sendDocument":
+                in_pdf[chat_id] |= set(re.findall(r'\bmarker\d+\b', extract_text(io.BytesIO(payload))))
+            else:
+                in_text[chat_id] |= set(re.findall(r'\bmarker\d+\b', payload))
+    foreign = {
+        chat_id: sorted((in_text[chat_id] | in_pdf[chat_id]) - owned[chat_id])
+        for chat_id in telegram.sent if (in_text[chat_id] | in_pdf[chat_id]) - owned[chat_id]
+    }
+    check(not foreign, "no chat received output made for another chat"
+          + (f" (e.g. chat {next(iter(foreign))} got {foreign[next(iter(foreign))][:3]})" if foreign else ""))
+
+    missing = collections.Counter()
+    for marker, (kind, chat_id) in updates.items():
+        # Transcripts and chat answers arrive as messages, document and URL summaries in the PDF
+        if marker not in (in_pdf[chat_id] if kind in ("document", "url") else in_text[chat_id]):
+            missing[kind] += 1
+    for kind in sorted(set(kinds)):
+        check(not missing[kind], f"every {kind} update's own output reached its chat ({kinds.count(kind)} updates"
+                                 + (f", {missing[kind]} missing)" if missing[kind] else ")"))
+    check.finish()
+
+
+async def bench_webhook(args):
+    import httpx
+    import bot
+    import metrics
+
+    kinds = update_kinds(args.mix, args.updates)
+    openai_server = FakeOpenAIServer(latency=args.openai_latency)
+    telegram = FakeTelegramServer(latency=args.telegram_latency)
+    model_client.set_client(model_client.create_client(base_url=await openai_server.start(), api_key="fake"))
+    await telegram.start()
+    webhook.WEBHOOK_ENQUEUE_TIMEOUT = args.enqueue_timeout
+
+    accept_latencies = []
+    refused = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        bot.temp_dir = workdir
+        artifact_cache.CACHE_DIR = os.path.join(workdir, "artifacts")
+        job_store.JOB_STORE_DIR = os.path.join(workdir, "jobs")
+
+        application = fake_application(telegram, backlog=args.backlog)
+        await application.initialize()
+        await application.start()
+        secret = "benchmark-secret"
+        server = webhook.WebhookServer(application, "/telegram", secret)
+        url = f"http://127.0.0.1:{await server.start('127.0.0.1', 0)}/telegram"
+
+        print(f"{args.updates} updates ({args.mix}), {'as fast as possible' if not args.rate else f'{args.rate:g}/s'}, "
+              f"backlog {args.backlog}, {bot.CONCURRENT_UPDATES} concurrent")
+        async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.connections), timeout=60) as client:
+            forbidden = await client.post(url, json=fake_update("text", 0, 999, telegram),
+                                          headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            print(f"delivery with a wrong secret: {forbidden.status_code}")
+
+            async def deliver(data: dict):
+                # Like Telegram: a refused delivery is sent again later
+                nonlocal refused
+                while True:
+                    sent = time.perf_counter()
+                    response = await client.post(url, json=data, headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+                    if response.status_code == 200:
+                        accept_latencies.append(time.perf_counter() - sent)
+                        return
+                    refused += 1
+                    await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+
+            start = time.perf_counter()
+            tasks = []
+            for index, kind in enumerate(kinds, start=1):
+                tasks.append(asyncio.create_task(deliver(fake_update(kind, index, 1000 + index, telegram))))
+                if args.rate:
+                    await asyncio.sleep(1 / args.rate)
+            await asyncio.gather(*tasks)
+            accepted = time.perf_counter() - start
+
+            # Telegram delivers an update again when it missed the answer, possibly while the first is handled
+            duplicates = [fake_update("text", index, 1000 + index, telegram) for index in range(1, args.duplicates + 1)]
+            await asyncio.gather(*(deliver(data) for data in duplicates for _ in range(2)))
+
+        # Stopping handles every accepted update first
+        await server.stop()
+        await application.stop()
+        elapsed = time.perf_counter() - start
+        processor = application.update_processor
+        room = processor._room._value
+        await application.shutdown()
+        await model_client.close()
+        await openai_server.stop()
+        await telegram.stop()
+        extraction.shutdown()
+        job_store.close()
+
+    handled = sum(metrics.HANDLER_SECONDS.count(handler) for (handler,) in metrics.HANDLER_SECONDS.values)
+    print(f"accept latency p50 {percentile(accept_latencies, 0.5) * 1000:.1f} ms, "
+          f"p95 {percentile(accept_latencies, 0.95) * 1000:.1f} ms, p99 {percentile(accept_latencies, 0.99) * 1000:.1f} ms")
+    print(f"{len(accept_latencies)} accepted in {accepted:.1f}s, {refused} refused while the backlog was full "
+          f"(delivered again), {handled} handled in {elapsed:.1f}s")
+
+    check = Checks()
+    check(processor.backlog == 0 and room == bot.CONCURRENT_UPDATES + args.backlog,
+          f"every admitted delivery released its slot, {args.duplicates} updates delivered twice "
+          f"(backlog {processor.backlog}, {room} of {bot.CONCURRENT_UPDATES + args.backlog} slots free)")
+    check.finish()
+
+
+async def bench_resume(args):
+    from telegram import Update
+    import bot
+
+    openai_server = FakeOpenAIServer(latency=args.latency)
+    telegram = FakeTelegramServer()
+    model_client.set_client(model_client.create_client(base_url=await openai_server.start(), api_key="fake"))
+    await telegram.start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot.temp_dir = workdir
+        artifact_cache.CACHE_DIR = os.path.join(workdir, "artifacts")
+        job_store.JOB_STORE_DIR = os.path.join(workdir, "jobs")
+        application = fake_application(telegram)
+        await application.initialize()
+
+        # Chapters checkpointed per phase of the benchmark, as (job id, chapter)
+        checkpoints = collections.defaultdict(list)
+        phase = "uninterrupted"
+        checkpoint = job_store.checkpoint
+
+        def recording_checkpoint(job_id: int, chunk: str, summary: str) -> None:
+            checkpoints[phase].append((job_id, chunk))
+            checkpoint(job_id, chunk, summary)
+
+        job_store.checkpoint = recording_checkpoint
+
+        async def document(index: int) -> None:
+            data = fake_update("document", index, 1000 + index, telegram)
+            telegram.add_file(data["message"]["document"]["file_id"],
+                              f"Report {index}\n\n{fake_document(args.chapters * 750)}".encode())
+            await application.process_update(Update.de_json(data, application.bot))
+
+        # Reference: the same amount of work without an interruption
+        before = openai_server.requests
+        start = time.perf_counter()
+        await document(1)
+        uninterrupted = openai_server.requests - before
+        print(f"uninterrupted: {time.perf_counter() - start:.1f}s, {uninterrupted} model requests")
+
+        # Cancelled mid-way like a restart would; the job stays in the store
+        phase = "interrupted"
+        before = openai_server.requests
+        start = time.perf_counter()
+        handling = asyncio.create_task(document(2))
+        await asyncio.sleep(args.interrupt_after)
+        handling.cancel()
+        await asyncio.gather(handling, return_exceptions=True)
+        interrupted = openai_server.requests - before
+        print(f"interrupted:   {time.perf_counter() - start:.1f}s, {interrupted} model requests")
+
+        phase = "resumed"
+        sent_before = len(telegram.sent[1002])
+        before = openai_server.requests
+        start = time.perf_counter()
+        await bot.resume_jobs(application)
+        resumed = openai_server.requests - before
+        print(f"resumed:       {time.perf_counter() - start:.1f}s, {resumed} model requests "
+              f"({interrupted + resumed - uninterrupted} requests repeated)")
+        documents = [payload for method, payload in telegram.sent[1002][sent_before:]
+                     if method == "sendDocument" and payload.startswith(b"%PDF-")]
+
+        job_store.checkpoint = checkpoint
+        await application.shutdown()
+        await model_client.close()
+        await openai_server.stop()
+        await telegram.stop()
+        extraction.shutdown()
+        job_store.close()
+
+    # Both documents have the same chapter count; the uninterrupted run checkpointed every chapter
+    chapters = len(checkpoints["uninterrupted"])
+    overhead = uninterrupted - chapters
+    saved = {chunk for _, chunk in checkpoints["interrupted"]}
+    redone = [chunk for _, chunk in checkpoints["resumed"] if chunk in saved]
+    check = Checks()
+    check(not redone, f"the resumed job skipped the {len(saved)} checkpointed chapters"
+                      + (f" ({len(redone)} summarized again)" if redone else ""))
+    check(resumed <= chapters - len(saved) + overhead,
+          f"the resumed job made {resumed} model requests, at most the {chapters - len(saved)} chapters "
+          f"not yet done + {overhead} for the overall summary")
+    check(bool(documents), "the resumed job sent the summary PDF")
+    check.finish()
+
+
+async def bench_fairness(args):
+    from telegram import Update
+    import bot
+    import scheduler
+
+    openai_server = FakeOpenAIServer(latency=args.latency)
+    telegram = FakeTelegramServer()
+    await openai_server.start()
+    await telegram.start()
+    indexes = itertools.count(1)
+
+    async def run(documents: int, fair: bool):
+        scheduler.FAIR = fair
+        # Fixed backend capacity, so only the order of the requests differs between runs
+        model_client.governor = rate_limit.RateGovernor(initial=args.capacity, maximum=args.capacity)
+        model_client.set_client(model_client.create_client(base_url=openai_server.url, api_key="fake"))
+        application = fake_application(telegram)
+        await application.initialize()
+        latencies = collections.defaultdict(list)
+
+        async def replay(kind: str, data: dict):
+            update = Update.de_json(data, application.bot)
+            arrived = time.perf_counter()
+            await application.update_processor.process_update(update, application.process_update(update))
+            latencies[kind].append(time.perf_counter() - arrived)
+
+        tasks = []
+        for _ in range(documents):
+            # All documents come from one user; unique content keeps the artifact cache out of it
+            index = next(indexes)
+            data = fake_update("document", index, 1, telegram)
+            telegram.add_file(data["message"]["document"]["file_id"],
+                              f"Report {index}\n\n{fake_document(args.chapters * 750)}".encode())
+            tasks.append(asyncio.create_task(replay("document", data)))
+        for _ in range(args.chats):
+            index = next(indexes)
+            tasks.append(asyncio.create_task(replay("chat", fake_update("text", index, 1000 + index, telegram))))
+            await asyncio.sleep(1 / args.chat_rate)
+        await asyncio.gather(*tasks)
+
+        await application.shutdown()
+        await model_client.close()
+        return latencies
+
+    print(f"{args.chats} chat messages at {args.chat_rate:g}/s from other users while one user's "
+          f"{args.documents} documents of ~{args.chapters} chapters run; {args.capacity} model slots, "
+          f"{args.latency * 1000:.0f} ms fake latency")
+    print(f"{'run':>22} {'chat p50':>9} {'chat p95':>9} {'documents done (s)':>19}")
+    with tempfile.TemporaryDirectory() as workdir:
+        bot.temp_dir = workdir
+        artifact_cache.CACHE_DIR = os.path.join(workdir, "artifacts")
+        job_store.JOB_STORE_DIR = os.path.join(workdir, "jobs")
+        for name, documents, fair in (("chat only", 0, True), ("arrival order", args.documents, False),
+                                      ("fair scheduler", args.documents, True)):
+            latencies = await run(documents, fair)
+            chat, done = latencies["chat"], latencies["document"]
+            print(f"{name:>22} {percentile(chat, 0.5):>8.2f}s {percentile(chat, 0.95):>8.2f}s "
+                  f"{(f'{max(done):.1f}' if done else '-'):>19}")
+        job_store.close()
+
+    await openai_server.stop()
+    await telegram.stop()
+
+
+async def bench_completions(args):
+    # Repeated chat messages: a few questions are asked often, most rarely
+    questions = [f"What is a good  name for pet number {i}? " for i in range(args.distinct)]
+    weights = [1 / (rank + 1) for rank in range(args.distinct)]
+    prompts = random.Random(0).choices(questions, weights=weights, k=args.requests)
+
+    print(f"{args.requests} chat requests over {args.distinct} distinct questions, fake model latency "
+          f"{args.latency * 1000:.0f} ms")
+    print(f"{'cache':>18} {'hits':>6} {'model calls':>12} {'hit p50 (us)':>13} {'miss p50 (ms)':>14}")
+    with tempfile.TemporaryDirectory() as workdir:
+        runs = (
+            ("off", 0, ""),
+            ("memory", 3600, ""),
+            ("memory + SQLite", 3600, os.path.join(workdir, "completions.sqlite3")),
+            ("SQLite, restarted", 3600, os.path.join(workdir, "completions.sqlite3")),
+        )
+        for label, ttl, db_path in runs:
+            backend = FakeModelBackend(latency=args.latency)
+            model_client.set_client(backend)
+            completion_cache.TTL = ttl
+            completion_cache.DB_PATH = db_path
+            # Every run starts with an empty memory tier (the last one: as after a restart)
+            completion_cache._memory.clear()
+            completion_cache.close()
+
+            hits, misses = [], []
+            for prompt in prompts:
+                calls = backend.calls
+                start = time.perf_counter()
+                # Extra whitespace differs from request to request; normalization ignores it
+                content = prompt if random.random() < 0.5 else " ".join(prompt.split())
+                messages = [{"role": "user", "content": content}]
+                await model_client.chat_completion(messages, max_tokens=300, cache=True)
+                elapsed = time.perf_counter() - start
+                (misses if backend.calls > calls else hits).append(elapsed)
+            hit_p50 = f"{percentile(hits, 0.5) * 1e6:.0f}" if hits else "-"
+            miss_p50 = f"{percentile(misses, 0.5) * 1e3:.0f}" if misses else "-"
+            print(f"{label:>18} {len(hits):>6} {backend.calls:>12} {hit_p50:>13} {miss_p50:>14}")
+        completion_cache.close()
+
+
+async def bench_summaries(args):
+    backend = FakeModelBackend(latency=args.latency, jitter=args.jitter)
+    model_client.set_client(backend)
+    # The fake backend has no rate limits; start the governor fully open
+    model_client.governor.limit = model_client.governor.maximum
+    texts = fake_chapters(args.chapters)
+    chapters = len(list(make_summary.iter_chunks(texts)))
+
+    # The document path end to end: chunking, chapter fan-out, overall summary and PDF
+    print(f"{chapters} chapters, {args.latency * 1000:.0f} ms fake model latency")
+    print(f"{'concurrency':>12} {'wall (s)':>10} {'speedup':>8}")
+    baseline = None
+    for concurrency in args.concurrency:
+        with tempfile.TemporaryDirectory() as workdir:
+            start = time.perf_counter()
+            result = await make_summary.summarize_stream(
+                iterate(texts), os.path.join(workdir, "summary.pdf"), concurrency=concurrency
+            )
+            elapsed = time.perf_counter() - start
+        if result[0] == "Error":
+            raise SystemExit(f"summary failed: {result[1]}")
+        baseline = baseline or elapsed
+        print(f"{concurrency:>12} {elapsed:>10.2f} {baseline / elapsed:>7.1f}x")
+
+    # A failed chapter must fail the document, even the last one (whose short error text looks like a fragment)
+    check = Checks()
+    for label, document in (("last chapter", texts), ("only chapter", fake_chapters(1, words=200))):
+        last = list(make_summary.iter_chunks(document))[-1]
+        backend.fail_when = lambda request: last in request["messages"][-1]["content"]
+        with tempfile.TemporaryDirectory() as workdir:
+            result = await make_summary.summarize_stream(
+                iterate(document), os.path.join(workdir, "summary.pdf")
+            )
+        check(result == ("Error", make_summary.SUMMARY_BUSY_MESSAGE),
+              f"a failed request for the {label} fails the summary ({result[1]!r})")
+    backend.fail_when = None
+    check.finish()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    summaries = subparsers.add_parser("summaries", help="document summarization vs. chapter concurrency limit")
+    summaries.add_argument("--chapters", type=int, default=30)
+    summaries.add_argument("--latency", type=float, default=0.2)
+    summaries.add_argument("--jitter", type=float, default=0.0)
+    summaries.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    summaries.set_defaults(func=bench_summaries)
+
+    chunker = subparsers.add_parser("chunker", help="streaming chunker vs. the legacy word chunker")
+    chunker.add_argument("--words", type=int, default=300000)
+    chunker.add_argument("--legacy-limit", type=int, default=1000000)
+    chunker.set_defaults(func=bench_chunker)
+
+    html = subparsers.add_parser("html", help="main-content extraction: parse time and token drop")
+    html.add_argument("--corpus", help="directory of saved .html pages (default: synthetic pages)")
+    html.set_defaults(func=bench_html)
+
+    rendering = subparsers.add_parser("render", help="summary PDF rendering throughput")
+    rendering.add_argument("--documents", type=int, default=20)
+    rendering.add_argument("--chapters", type=int, default=10)
+    rendering.set_defaults(func=bench_render)
+
+    mermaid = subparsers.add_parser("mermaid", help="Mermaid rendering latency, cold vs. cached")
+    mermaid.add_argument("--diagrams", type=int, default=5)
+    mermaid.set_defaults(func=bench_mermaid)
+
+    segments = subparsers.add_parser("segments", help="segment planning and stitching checks, fake segmented run")
+    segments.add_argument("--minutes", type=float, default=40, help="length of the fake recording")
+    segments.add_argument("--latency", type=float, default=0.2, help="fake transcription latency per segment")
+    segments.set_defaults(func=bench_segments)
+
+    recordings = subparsers.add_parser("audio", help="audio preprocessing: bytes and seconds saved before Whisper")
+    recordings.add_argument("--recordings", type=int, default=5)
+    recordings.add_argument("--seconds", type=float, default=120, help="length of each recording")
+    recordings.add_argument("--pause-share", type=float, default=0.3, help="rough share of pauses")
+    recordings.set_defaults(func=bench_audio)
+
+    ratelimit = subparsers.add_parser("ratelimit", help="throttled fake API: SDK retries vs. the rate governor")
+    ratelimit.add_argument("--requests", type=int, default=200)
+    ratelimit.add_argument("--limit", type=int, default=20, help="requests allowed per window")
+    ratelimit.add_argument("--window", type=float, default=1.0, help="window length in seconds")
+    ratelimit.add_argument("--latency", type=float, default=0.05)
+    ratelimit.set_defaults(func=bench_ratelimit)
+
+    load = subparsers.add_parser("load", help="replay a mix of updates through the bot's handlers")
+    load.add_argument("--updates", type=int, default=200)
+    load.add_argument("--rate", type=float, default=0, help="arrivals per second (0 = all at once)")
+    load.add_argument("--mix", default="text=5,voice=2,document=2,url=1")
+    load.add_argument("--chats", type=int, default=0, help="number of distinct chats (0 = one per update)")
+    load.add_argument("--openai-latency", type=float, default=0.3)
+    load.add_argument("--telegram-latency", type=float, default=0.03)
+    load.add_argument("--jitter", type=float, default=0.0)
+    load.add_argument("--unlimited-outbox", action="store_true", help="disable the outbound flood limits")
+    load.set_defaults(func=bench_load)
+
+    isolation = subparsers.add_parser("isolation", help="simultaneous updates from many chats: no crossed outputs")
+    isolation.add_argument("--updates", type=int, default=60)
+    isolation.add_argument("--chats", type=int, default=20)
+    isolation.add_argument("--mix", default="voice=1,document=1,url=1,text=1")
+    isolation.add_argument("--openai-latency", type=float, default=0.1)
+    isolation.set_defaults(func=bench_isolation)
+
+    intake = subparsers.add_parser("webhook", help="webhook intake: accept latency and backpressure")
+    intake.add_argument("--updates", type=int, default=200)
+    intake.add_argument("--rate", type=float, default=50, help="deliveries per second (0 = all at once)")
+    intake.add_argument("--mix", default="text")
+    intake.add_argument("--backlog", type=int, default=10, help="updates accepted beyond the handler slots")
+    intake.add_argument("--enqueue-timeout", type=float, default=0.5)
+    intake.add_argument("--connections", type=int, default=40, help="concurrent deliveries, like max_connections")
+    intake.add_argument("--duplicates", type=int, default=5, help="updates delivered twice at once")
+    intake.add_argument("--openai-latency", type=float, default=0.3)
+    intake.add_argument("--telegram-latency", type=float, default=0.03)
+    intake.set_defaults(func=bench_webhook)
+
+    resume = subparsers.add_parser("resume", help="interrupt a document summary and resume it from checkpoints")
+    resume.add_argument("--chapters", type=int, default=40)
+    resume.add_argument("--latency", type=float, default=0.3, help="fake model latency")
+    resume.add_argument("--interrupt-after", type=float, default=1.0, help="seconds before the interruption")
+    resume.set_defaults(func=bench_resume)
+
+    fairness = subparsers.add_parser("fairness", help="chat latency while one user's documents are summarized")
+    fairness.add_argument("--documents", type=int, default=5)
+    fairness.add_argument("--chapters", type=int, default=60)
+    fairness.add_argument("--chats", type=int, default=30)
+    fairness.add_argument("--chat-rate", type=float, default=3.0, help="chat messages per second")
+    fairness.add_argument("--capacity", type=int, default=8, help="concurrent model requests")
+    fairness.add_argument("--latency", type=float, default=0.3, help="fake model latency")
+    fairness.set_defaults(func=bench_fairness)
+
+    completions = subparsers.add_parser("completions", help="repeated chat messages with the completion cache")
+    completions.add_argument("--requests", type=int, default=300)
+    completions.add_argument("--distinct", type=int, default=30, help="distinct questions among the requests")
+    completions.add_argument("--latency", type=float, default=0.05, help="fake model latency")
+    completions.set_defaults(func=bench_completions)
+
+    args = parser.parse_args(argv)
+    # Per-update warnings (e.g. plain PDF fallback without TeX) would drown the reports. Configured
+    # before a benchmark imports bot, whose own logging setup then leaves this one in place.
+    logging.basicConfig(level=logging.ERROR)
+    result = args.func(args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
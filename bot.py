@@ -19,12 +19,15 @@ import logging
 import os
 import sys
 import time
+import shutil
 import tempfile
+import contextlib
 import urllib.parse
 import asyncio
-from typing import Optional
+import datetime
+from typing import Iterator, Optional
 
-from telegram import Update
+from telegram import Chat, File, Message, Update
 from telegram.ext import (
     filters,
     MessageHandler,
@@ -33,10 +36,22 @@ from telegram.ext import (
     ContextTypes,
     CallbackContext,
 )
-from telegram.error import NetworkError, TimedOut
-from openai import OpenAI
-
+from telegram.error import BadRequest, NetworkError, TimedOut
+
+import artifact_cache
+import audio
+import completion_cache
+import downloads
+import extraction
+import fetcher
+import job_store
 import make_summary
+import metrics
+import model_client
+import outbox
+import render
+import scheduler
+import webhook
 
 # Configure logging
 logging.basicConfig(
@@ -51,11 +66,49 @@ logger = logging.getLogger(__name__)
 # Reduce noise from httpx
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-# Global clients (initialized in main)
-openai_client: Optional[OpenAI] = None
+# Number of updates processed concurrently (each gets its own workspace)
+CONCURRENT_UPDATES = int(os.environ.get("BOT_CONCURRENT_UPDATES", "8"))
+
+# Webhook updates accepted while all handler slots are busy; beyond that Telegram is asked to retry
+UPDATE_BACKLOG = int(os.environ.get("BOT_UPDATE_BACKLOG", "100"))
+
+# Voice/audio longer than this (seconds) is transcribed in the batch lane
+INTERACTIVE_AUDIO_SECONDS = float(os.environ.get("SCHEDULER_INTERACTIVE_AUDIO_SECONDS", "120"))
+
+# Stream chat replies into a progressively edited message
+CHAT_STREAMING = os.environ.get("CHAT_STREAMING", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.0"))
+GROUP_STREAM_EDIT_INTERVAL = float(os.environ.get("GROUP_STREAM_EDIT_INTERVAL", "3.0"))
+
+# Supported document types: extension -> (status message, summary pipeline)
+DOCUMENT_PIPELINES = {
+    '.PDF': ('📄 Creating PDF summary...', make_summary.pdf_to_summary),
+    '.DOC': ('📝 Creating Word document summary...', make_summary.docx_to_summary),
+    '.DOCX': ('📝 Creating Word document summary...', make_summary.docx_to_summary),
+    '.PPT': ('📊 Creating PowerPoint summary...', make_summary.pptx_to_summary),
+    '.PPTX': ('📊 Creating PowerPoint summary...', make_summary.pptx_to_summary),
+    '.TXT': ('📃 Creating text file summary...', make_summary.txt_to_summary),
+}
+
+# Global state (initialized in main)
 temp_dir: Optional[str] = None
 
 
+@contextlib.contextmanager
+def scratch_directory(prefix: str) -> Iterator[str]:
+    """Create a private scratch directory and remove it afterwards."""
+    workspace = tempfile.mkdtemp(prefix=prefix, dir=temp_dir)
+    try:
+        yield workspace
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def update_workspace(update: Update):
+    """Scratch directory for one update."""
+    return scratch_directory(f"update-{update.update_id}-")
+
+
 def is_url(string: str) -> bool:
     """Check if a string is a valid URL."""
     try:
@@ -65,24 +118,49 @@ def is_url(string: str) -> bool:
         return False
 
 
-def transcribe_audio(file_path: str) -> str:
-    """Transcribe audio using OpenAI Whisper API."""
+async def transcribe_file(audio_file) -> str:
+    """Transcribe an open audio file using OpenAI Whisper API."""
     try:
-        with open(file_path, "rb") as audio_file:
-            transcript = openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="text",
-                language=None  # Auto-detect language
-            )
-        return transcript.text if hasattr(transcript, 'text') else transcript
+        return await model_client.transcribe(audio_file)
     except Exception as e:
         logger.error(f"Transcription error: {e}")
         raise Exception(f"Transcription Error: {str(e)}")
 
 
-def create_summary(text: str) -> str:
-    """Create a concise bullet-point summary using GPT-4o-mini."""
+async def transcribe_audio(file_path: str) -> str:
+    """Transcribe an audio file on disk."""
+    with open(file_path, "rb") as audio_file:
+        return await transcribe_file(audio_file)
+
+
+async def transcribe_recording(file: File, duration, workspace: str, name: str) -> str:
+    """Download and transcribe a voice/audio file, in parallel segments when it is long.
+
+    Recordings sent in one upload are kept in memory while the download
+    budget allows it; the others are saved to the workspace as name. Long
+    silences are cut and the audio re-encoded as compact speech first.
+    """
+    if not audio.needs_segmenting(file.file_size, duration):
+        # The preprocessed copy is held in memory next to the download
+        extra = audio.compact_size(duration, file.file_size)
+        async with downloads.memory_download(file, name, extra=extra) as buffer:
+            if buffer is not None:
+                return await transcribe_file(await audio.preprocess(buffer, duration, workspace))
+
+    file_path = os.path.join(workspace, name)
+    await file.download_to_drive(file_path)
+    metrics.DOWNLOADS.inc("disk")
+    if audio.needs_segmenting(os.path.getsize(file_path), duration):
+        try:
+            return await audio.transcribe_segmented(file_path, workspace, transcribe_audio)
+        except (OSError, RuntimeError) as e:
+            # ffmpeg missing or unable to read the file: fall back to one upload
+            logger.warning(f"Segmented transcription unavailable: {e}")
+    return await transcribe_audio(await audio.preprocess(file_path, duration, workspace))
+
+
+async def create_summary(text: str, cache: bool = True) -> str:
+    """Create a concise bullet-point summary using GPT-4o-mini (cached unless cache=False)."""
     try:
         # Detect if text is German or English
         german_words = ['und', 'der', 'die', 'das', 'ist', 'eine', 'ein', 'ich', 'bin', 'haben', 'sind']
@@ -115,17 +193,17 @@ TEXT:
 
 SUMMARY:"""
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
+        response = await model_client.chat_completion(
             messages=[
                 {"role": "system", "content": "You are an expert at creating concise, bullet-point summaries."},
                 {"role": "user", "content": prompt}
             ],
             max_tokens=200,
-            temperature=0.3
+            temperature=0.3,
+            cache=cache,
         )
 
-        return response.choices[0].message.content.strip()
+        return response.strip()
 
     except Exception as e:
         logger.error(f"Summary error: {e}")
@@ -136,12 +214,13 @@ SUMMARY:"""
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command."""
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="👋 Hi! I'm your AI assistant bot.\n\n"
+    await outbox.send(
+        context.bot,
+        update.effective_chat,
+        "👋 Hi! I'm your AI assistant bot.\n\n"
              "I can:\n"
              "• 🎤 Transcribe voice messages\n"
-             "• 💬 Chat with you (just send text)\n"
+             "• 💬 Chat with you (just send text, /fresh text for a new answer)\n"
              "• 🖼️ Generate images (/image description)\n"
              "• 📄 Summarize documents (PDF, DOC, PPT)\n"
              "• 🌐 Summarize URLs (just paste a link)\n"
@@ -152,174 +231,267 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def caps(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /caps command - convert text to uppercase."""
     text_caps = ' '.join(context.args).upper()
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=text_caps)
+    await outbox.send(context.bot, update.effective_chat, text_caps)
 
 
 async def voice_message(update: Update, context: CallbackContext):
     """Handle voice messages - transcribe and summarize."""
-    out_file_name = os.path.join(temp_dir, "voice_received.oga")
-
-    try:
-        file_id = update.message.voice.file_id
-        file = await context.bot.get_file(file_id)
-        await file.download_to_drive(out_file_name)
-        await update.message.reply_text('🎤 Processing voice message...')
-
-        # Transcribe
-        transcription = transcribe_audio(out_file_name)
-        response = transcription
-
-        # Add summary
+    with update_workspace(update) as workspace:
+        status = outbox.Status(update.message)
         try:
-            summary = create_summary(transcription)
-            response += "\n\n📋 **Summary:**\n" + summary
-        except Exception as e:
-            logger.error(f"Summary failed: {e}")
-            response += "\n\n⚠️ Summary unavailable"
-
-        await update.message.reply_text(response)
+            recording = update.message.voice
+            if (recording.duration or 0) > INTERACTIVE_AUDIO_SECONDS:
+                scheduler.set_lane(scheduler.BATCH)
+            file = await context.bot.get_file(recording.file_id)
+            await status.update('🎤 Processing voice message...')
+
+            # Transcribe
+            transcription = await transcribe_recording(file, recording.duration, workspace, "voice_received.oga")
+            response = transcription
+
+            # Add summary
+            try:
+                summary = await create_summary(transcription)
+                response += "\n\n📋 **Summary:**\n" + summary
+            except Exception as e:
+                logger.error(f"Summary failed: {e}")
+                response += "\n\n⚠️ Summary unavailable"
+
+            await status.finish(response)
 
-    except Exception as e:
-        logger.error(f"Voice message error: {e}")
-        await update.message.reply_text("❌ Failed to process voice message")
+        except Exception as e:
+            logger.error(f"Voice message error: {e}")
+            await status.finish("❌ Failed to process voice message")
 
 
 async def audio_message(update: Update, context: CallbackContext):
     """Handle audio files - transcribe and summarize."""
-    out_file_name = os.path.join(temp_dir, "audio_received.oga")
-
-    try:
-        file_id = update.message.audio.file_id
-        file = await context.bot.get_file(file_id)
-        await file.download_to_drive(out_file_name)
-        await update.message.reply_text('🎵 Processing audio file...')
-
-        # Transcribe
-        transcription = transcribe_audio(out_file_name)
-        response = transcription
-
-        # Add summary
+    with update_workspace(update) as workspace:
+        status = outbox.Status(update.message)
         try:
-            summary = create_summary(transcription)
-            response += "\n\n📋 **Summary:**\n" + summary
-        except Exception as e:
-            logger.error(f"Summary failed: {e}")
-            response += "\n\n⚠️ Summary unavailable"
+            recording = update.message.audio
+            if (recording.duration or 0) > INTERACTIVE_AUDIO_SECONDS:
+                scheduler.set_lane(scheduler.BATCH)
+            file = await context.bot.get_file(recording.file_id)
+            await status.update('🎵 Processing audio file...')
+
+            # Transcribe
+            transcription = await transcribe_recording(file, recording.duration, workspace, "audio_received.oga")
+            response = transcription
+
+            # Add summary
+            try:
+                summary = await create_summary(transcription)
+                response += "\n\n📋 **Summary:**\n" + summary
+            except Exception as e:
+                logger.error(f"Summary failed: {e}")
+                response += "\n\n⚠️ Summary unavailable"
+
+            await status.finish(response)
 
-        await update.message.reply_text(response)
-
-    except Exception as e:
-        logger.error(f"Audio message error: {e}")
-        await update.message.reply_text("❌ Failed to process audio file")
+        except Exception as e:
+            logger.error(f"Audio message error: {e}")
+            await status.finish("❌ Failed to process audio file")
 
 
 async def file_receive(update: Update, context: CallbackContext):
     """Handle document uploads - extract and summarize."""
-    try:
-        file_id = update.message.document.file_id
-        file_name = update.message.document.file_name
-        file = await context.bot.get_file(file_id)
-        out_file_name = os.path.join(temp_dir, file_name)
-        await file.download_to_drive(out_file_name)
-        await update.message.reply_text('📁 File received, processing...')
+    with update_workspace(update) as workspace:
+        status = outbox.Status(update.message)
+        try:
+            document = update.message.document
+            file_name = os.path.basename(document.file_name or 'document')
+            _, file_extension = os.path.splitext(file_name)
+
+            pipeline = DOCUMENT_PIPELINES.get(file_extension.upper())
+            if pipeline is None:
+                await status.finish(f'⚠️ Unsupported file type: {file_extension}')
+                return
+            status_text, summarize = pipeline
+
+            # Same Telegram file as before -> answer from the cache without downloading
+            params = make_summary.pipeline_params()
+            alias = artifact_cache.make_key('telegram-file', document.file_unique_id, file_extension.upper(), params)
+            cached = artifact_cache.lookup_alias(alias)
+            if cached:
+                await send_summary(context, update.effective_chat, (cached.pdf_path, cached.overall_summary), status)
+                return
+
+            file = await context.bot.get_file(document.file_id)
+            out_file_name = os.path.join(workspace, file_name)
+            await file.download_to_drive(out_file_name)
+            await status.update('📁 File received, processing...')
+
+            # Same content under a different file id (e.g. re-uploaded)
+            cache_key = artifact_cache.make_key(
+                'content', artifact_cache.content_hash(out_file_name), file_extension.upper(), params
+            )
+            cached = artifact_cache.lookup(cache_key)
+            if cached:
+                artifact_cache.link(alias, cache_key)
+                await send_summary(context, update.effective_chat, (cached.pdf_path, cached.overall_summary), status)
+                return
+
+            await status.update(status_text)
+            # Recorded so a restart in the middle resumes instead of losing the work
+            job = job_store.create(
+                'document', update.effective_chat.id, update.effective_chat.type, update.message.message_id,
+                status.message.message_id, file_name, input_path=out_file_name,
+                extension=file_extension.upper(), cache_key=cache_key, alias=alias,
+            )
+            await run_summary_job(context, job, status, workspace)
 
-        _, file_extension = os.path.splitext(out_file_name)
-        summary_file_name = os.path.join(temp_dir, 'pdf_summary.pdf')
+        except Exception as e:
+            logger.error(f"File processing error: {e}")
+            await status.finish("❌ Failed to process file")
 
-        if file_extension.upper() == '.PDF':
-            await update.message.reply_text('📄 Creating PDF summary...')
-            out = make_summary.pdf_to_summary(out_file_name, summary_file_name)
 
-        elif file_extension.upper() in ['.DOC', '.DOCX']:
-            await update.message.reply_text('📝 Creating Word document summary...')
-            out = make_summary.docx_to_summary(out_file_name, summary_file_name)
+async def send_summary(context: CallbackContext, chat: Chat, out, status: outbox.Status) -> None:
+    """Finish the status message with a summary pipeline result (error text or summary + PDF)."""
+    if out[0] == "Error":
+        await status.finish(f"❌ {out[1]}")
+    else:
+        await status.finish(f"✅ {out[1]}")
+        await send_file(context, chat, out[0], 'document')
 
-        elif file_extension.upper() in ['.PPT', '.PPTX']:
-            await update.message.reply_text('📊 Creating PowerPoint summary...')
-            out = make_summary.pptx_to_summary(out_file_name, summary_file_name)
 
-        elif file_extension.upper() == '.TXT':
-            await update.message.reply_text('📃 Creating text file summary...')
-            out = make_summary.txt_to_summary(out_file_name, summary_file_name)
+async def run_summary_job(context: CallbackContext, job: job_store.Job, status: outbox.Status, workspace: str) -> None:
+    """Run a recorded document or URL summary job, send the result and delete the job.
 
+    A job interrupted by a shutdown stays in the job store (cancellation is
+    not an Exception) and is resumed by resume_jobs() on the next start.
+    """
+    summary_file_name = os.path.join(workspace, 'pdf_summary.pdf')
+    try:
+        if job.kind == 'url':
+            out = await make_summary.url_to_summary(job.source, summary_file_name, job_id=job.id)
         else:
-            await update.message.reply_text(f'⚠️ Unsupported file type: {file_extension}')
-            return
-
-        if out[0] == "Error":
-            await update.message.reply_text(f"❌ {out[1]}")
-        else:
-            await update.message.reply_text(f"✅ {out[1]}")
-            with open(out[0], 'rb') as document:
-                await context.bot.send_document(chat_id=update.effective_chat.id, document=document)
-
-    except Exception as e:
-        logger.error(f"File processing error: {e}")
-        await update.message.reply_text("❌ Failed to process file")
+            _, summarize = DOCUMENT_PIPELINES[job.params['extension']]
+            cache_key = job.params['cache_key']
+            out = await summarize(job.params['input_path'], summary_file_name, cache_key=cache_key, job_id=job.id)
+            if out[0] != "Error":
+                artifact_cache.link(job.params['alias'], cache_key)
+
+        await send_summary(context, Chat(job.chat_id, job.chat_type), out, status)
+    except Exception:
+        job_store.finish(job.id)
+        raise
+    job_store.finish(job.id)
+
+
+def _restore_status(bot, job: job_store.Job) -> outbox.Status:
+    """The status message of a job recorded by an earlier run."""
+    chat = Chat(job.chat_id, job.chat_type)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    request = Message(job.request_message_id, now, chat)
+    request.set_bot(bot)
+    status = outbox.Status(request)
+    if job.status_message_id is not None:
+        status.message = Message(job.status_message_id, now, chat)
+        status.message.set_bot(bot)
+    return status
+
+
+async def resume_jobs(application) -> None:
+    """Finish the summary jobs that the previous run was interrupted in."""
+    jobs = job_store.claim_unfinished()
+    if not jobs:
+        return
+    logger.info(f"Resuming {len(jobs)} interrupted summary job(s)")
+    slots = asyncio.Semaphore(CONCURRENT_UPDATES)
+
+    async def resume(job: job_store.Job) -> None:
+        async with slots:
+            status = _restore_status(application.bot, job)
+            try:
+                if job_store.exhausted(job):
+                    logger.warning(f"Giving up job {job.id} ({job.kind} {job.source}) after {job.attempts - 1} attempt(s)")
+                    job_store.finish(job.id)
+                    await status.finish("❌ Could not finish the summary, please send it again")
+                    return
+                await status.update('♻️ Resuming your summary after a restart...')
+                with scratch_directory(f"job-{job.id}-") as workspace, scheduler.flow(job.chat_id, scheduler.BATCH):
+                    context = CallbackContext(application, chat_id=job.chat_id)
+                    await run_summary_job(context, job, status, workspace)
+            except Exception as e:
+                logger.error(f"Resumed job {job.id} failed: {e}")
+                with contextlib.suppress(Exception):
+                    await status.finish("❌ Failed to finish the summary")
+
+    await asyncio.gather(*(metrics.instrument('resume', resume)(job) for job in jobs))
+
+
+async def send_file(context: CallbackContext, chat: Chat, path: str, kind: str) -> None:
+    """Send a file as a document or photo, by file_id if it was uploaded before."""
+    send = context.bot.send_document if kind == 'document' else context.bot.send_photo
+
+    # A cached summary PDF must not be evicted while it is uploaded
+    with artifact_cache.in_use(path):
+        digest = artifact_cache.content_hash(path)
+
+        file_id = artifact_cache.lookup_file_id(kind, digest)
+        if file_id is not None:
+            try:
+                await outbox.call(chat, lambda: send(chat_id=chat.id, **{kind: file_id}))
+                return
+            except BadRequest as e:
+                logger.warning(f"Cached file_id rejected, uploading again: {e}")
+                artifact_cache.forget_file_id(kind, digest)
+
+        async def upload():
+            with open(path, 'rb') as fh:
+                return await send(chat_id=chat.id, **{kind: fh})
+
+        message = await outbox.call(chat, upload)
+    sent = message.document if kind == 'document' else message.photo[-1]
+    artifact_cache.store_file_id(kind, digest, sent.file_id)
 
 
 async def image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /image command - generate images with DALL-E."""
+    chat = update.effective_chat
     try:
         prompt_in = ' '.join(context.args)
         if not prompt_in:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Usage: /image <description>\nExample: /image a cat wearing a hat"
+            await outbox.send(
+                context.bot,
+                chat,
+                "Usage: /image <description>\nExample: /image a cat wearing a hat"
             )
             return
 
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="🎨 Generating image...")
-
-        out = openai_client.images.generate(
-            prompt=prompt_in,
-            n=1,
-            size="512x512",
-        )
+        await outbox.send(context.bot, chat, "🎨 Generating image...")
 
-        response = out.data[0].url
-        await context.bot.sendPhoto(chat_id=update.effective_chat.id, photo=response)
+        response = await model_client.generate_image(prompt_in, size="512x512")
+        await outbox.call(chat, lambda: context.bot.send_photo(chat_id=chat.id, photo=response))
 
     except Exception as e:
         logger.error(f"Image generation error: {e}")
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="❌ Image generation failed (prompt may have been refused)"
-        )
+        await outbox.send(context.bot, chat, "❌ Image generation failed (prompt may have been refused)")
 
 
 async def mermaid(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /mermaid command - generate diagrams."""
+    chat = update.effective_chat
     try:
         prompt_in = ' '.join(context.args)
         if not prompt_in:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Usage: /mermaid <diagram code>\nExample: /mermaid graph TD; A-->B; B-->C;"
+            await outbox.send(
+                context.bot,
+                chat,
+                "Usage: /mermaid <diagram code>\nExample: /mermaid graph TD; A-->B; B-->C;"
             )
             return
 
-        command_file_name = os.path.join(temp_dir, 'mm_in.txt')
-        with open(command_file_name, "w") as f:
-            f.write(prompt_in)
-
-        out_file_name = os.path.join(temp_dir, 'out.png')
-        out_file_name_pdf = os.path.join(temp_dir, 'out.pdf')
+        # Both formats render concurrently; the PNG is sent as soon as it is ready
+        png_future, pdf_future = render.render_mermaid(prompt_in)
 
-        os.system(f'mmdc -i {command_file_name} -o {out_file_name}')
-        os.system(f'mmdc -i {command_file_name} -o {out_file_name_pdf}')
-
-        with open(out_file_name, 'rb') as photo:
-            await context.bot.sendPhoto(chat_id=update.effective_chat.id, photo=photo)
-        with open(out_file_name_pdf, 'rb') as document:
-            await context.bot.send_document(chat_id=update.effective_chat.id, document=document)
+        await send_file(context, chat, await png_future, 'photo')
+        await send_file(context, chat, await pdf_future, 'document')
 
     except Exception as e:
         logger.error(f"Mermaid generation error: {e}")
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="❌ Mermaid diagram generation failed"
-        )
+        await outbox.send(context.bot, chat, "❌ Mermaid diagram generation failed")
 
 
 async def text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -328,44 +500,103 @@ async def text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Check if it's a URL
     if is_url(prompt_in):
-        await update.message.reply_text('🌐 Summarizing URL...')
-        summary_file_name = os.path.join(temp_dir, 'pdf_summary.pdf')
-
+        scheduler.set_lane(scheduler.BATCH)
+        status = outbox.Status(update.message)
         try:
-            out = make_summary.url_to_summary(prompt_in, summary_file_name)
-
-            if out[0] == "Error":
-                await update.message.reply_text(f"❌ {out[1]}")
-            else:
-                await update.message.reply_text(f"✅ {out[1]}")
-                with open(out[0], 'rb') as document:
-                    await context.bot.send_document(chat_id=update.effective_chat.id, document=document)
+            await status.update('🌐 Summarizing URL...')
+            job = job_store.create(
+                'url', update.effective_chat.id, update.effective_chat.type, update.message.message_id,
+                status.message.message_id, prompt_in,
+            )
+            with update_workspace(update) as workspace:
+                await run_summary_job(context, job, status, workspace)
         except Exception as e:
             logger.error(f"URL summarization error: {e}")
-            await update.message.reply_text("❌ Failed to summarize URL")
+            await status.finish("❌ Failed to summarize URL")
+        return
+
+    await chat_reply(update, prompt_in)
+
+
+async def fresh(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /fresh command - chat reply that bypasses the completion cache."""
+    prompt_in = ' '.join(context.args)
+    if not prompt_in:
+        await outbox.reply(update.message, "Usage: /fresh <message>")
+        return
+    await chat_reply(update, prompt_in, cache=False)
+
+
+async def chat_reply(update: Update, prompt_in: str, cache: bool = True) -> None:
+    """Answer a chat message, from the completion cache for recent repeats unless cache=False."""
+    messages = [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant. Respond naturally and concisely in the same language as the user's message. Keep responses under 150 words unless more detail is specifically requested."
+        },
+        {"role": "user", "content": prompt_in}
+    ]
+
+    if CHAT_STREAMING:
+        await stream_reply(update, messages, max_tokens=300, temperature=0.7, cache=cache)
         return
 
-    # Regular chat message
     try:
-        response_obj = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant. Respond naturally and concisely in the same language as the user's message. Keep responses under 150 words unless more detail is specifically requested."
-                },
-                {"role": "user", "content": prompt_in}
-            ],
-            max_tokens=300,
-            temperature=0.7
+        response = await model_client.chat_completion(
+            messages=messages, max_tokens=300, temperature=0.7, cache=cache
         )
+        await outbox.reply(update.message, response)
 
-        response = response_obj.choices[0].message.content
-        await update.message.reply_text(response)
+    except Exception as e:
+        logger.error(f"Chat error: {e}")
+        await outbox.reply(update.message, "❌ Failed to generate response")
+
+
+async def stream_reply(update: Update, messages, **params) -> None:
+    """Reply with a streamed completion, editing a placeholder as tokens arrive.
+
+    Edits are throttled to one per STREAM_EDIT_INTERVAL seconds
+    (GROUP_STREAM_EDIT_INTERVAL in groups) to stay under Telegram's edit limits.
+    """
+    start = time.perf_counter()
+    interval = STREAM_EDIT_INTERVAL if update.effective_chat.type == 'private' else GROUP_STREAM_EDIT_INTERVAL
+    placeholder = None
+    first_token = None
+
+    try:
+        placeholder = await outbox.reply(update.message, '💭 ...')
+        text = ""
+        shown = ""
+        last_edit = time.monotonic()
+
+        async for delta in model_client.stream_chat_completion(messages, **params):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            text += delta
+            if time.monotonic() - last_edit >= interval and text.strip() != shown:
+                shown = text.strip()
+                # Partial text stays in one message; the final edit splits it
+                await outbox.edit(placeholder, shown[:outbox.MAX_MESSAGE_LENGTH - 2] + ' ▌')
+                last_edit = time.monotonic()
+
+        await outbox.edit(placeholder, text.strip() or "❌ Empty response")
+
+        total = time.perf_counter() - start
+        logger.info(f"Chat reply: first token {first_token or total:.2f}s, total {total:.2f}s")
 
     except Exception as e:
         logger.error(f"Chat error: {e}")
-        await update.message.reply_text("❌ Failed to generate response")
+        if placeholder is not None:
+            await outbox.edit(placeholder, "❌ Failed to generate response")
+        else:
+            await outbox.reply(update.message, "❌ Failed to generate response")
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /stats command - latency and throughput summary (admins only)."""
+    if not metrics.is_admin(update.effective_user and update.effective_user.id):
+        return
+    await outbox.send(context.bot, update.effective_chat, metrics.stats_report())
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -380,14 +611,63 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     # For other errors, try to notify user if possible
     if update and hasattr(update, 'effective_chat'):
         try:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="⚠️ An error occurred. Please try again."
-            )
+            await outbox.send(context.bot, update.effective_chat, "⚠️ An error occurred. Please try again.")
         except Exception:
             pass
 
 
+async def post_init(application) -> None:
+    """Start the metrics endpoint, register the queue gauges and resume interrupted jobs."""
+    metrics.QUEUE_DEPTH.set_function(application.update_queue.qsize, "updates")
+    if isinstance(application.update_processor, webhook.BoundedUpdateProcessor):
+        metrics.QUEUE_DEPTH.set_function(lambda: application.update_processor.backlog, "webhook")
+    metrics.QUEUE_DEPTH.set_function(lambda: model_client.governor.waiting, "openai")
+    metrics.DOWNLOAD_MEMORY.set_function(lambda: downloads.budget.used)
+    metrics.OPENAI_CONCURRENCY.set_function(lambda: model_client.governor.in_flight, "in_flight")
+    metrics.OPENAI_CONCURRENCY.set_function(lambda: model_client.governor.limit, "limit")
+    application.bot_data["metrics_server"] = await metrics.start_server()
+    application.bot_data["resume_jobs"] = asyncio.create_task(resume_jobs(application))
+
+
+async def post_shutdown(application) -> None:
+    """Release the shared connection pools, extraction workers, the job store and the completion cache."""
+    server = application.bot_data.get("metrics_server")
+    if server is not None:
+        server.close()
+    # Jobs still being resumed stay in the job store for the next start
+    resuming = application.bot_data.get("resume_jobs")
+    if resuming is not None and not resuming.done():
+        resuming.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await resuming
+    job_store.close()
+    completion_cache.close()
+    await model_client.close()
+    await fetcher.close()
+    extraction.shutdown()
+
+
+def _handler(name: str, callback, lane: str = scheduler.INTERACTIVE):
+    """A handler timed under name whose backend work is scheduled for the update's user in lane."""
+    return metrics.instrument(name, scheduler.handler(lane, callback))
+
+
+def add_handlers(application) -> None:
+    """Register the bot's handlers (each one timed under its own name) and the error handler."""
+    application.add_handler(CommandHandler('start', _handler('start', start)))
+    application.add_handler(CommandHandler('caps', _handler('caps', caps)))
+    application.add_handler(CommandHandler('mermaid', _handler('mermaid', mermaid)))
+    application.add_handler(CommandHandler('image', _handler('image', image)))
+    application.add_handler(CommandHandler('fresh', _handler('fresh', fresh)))
+    application.add_handler(CommandHandler('stats', stats))
+    application.add_handler(MessageHandler(filters.VOICE, _handler('voice', voice_message)))
+    application.add_handler(MessageHandler(filters.AUDIO, _handler('audio', audio_message)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, _handler('text', text_message)))
+    application.add_handler(MessageHandler(filters.Document.ALL, _handler('document', file_receive, scheduler.BATCH)))
+
+    application.add_error_handler(error_handler)
+
+
 def run_bot_with_retry(telegram_api_key: str, max_retries: int = None, base_delay: float = 5.0):
     """
     Run the bot with exponential backoff retry on startup failures.
@@ -397,30 +677,24 @@ def run_bot_with_retry(telegram_api_key: str, max_retries: int = None, base_dela
         max_retries: Maximum retry attempts (None = infinite)
         base_delay: Initial delay between retries in seconds
     """
-    global openai_client, temp_dir
-
-    # Initialize OpenAI client
-    openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    global temp_dir
 
     # Create temp directory
     temp_dir = tempfile.mkdtemp()
     logger.info(f"Temp directory: {temp_dir}")
 
     # Build application
-    application = ApplicationBuilder().token(telegram_api_key).build()
-
-    # Add handlers
-    application.add_handler(CommandHandler('start', start))
-    application.add_handler(CommandHandler('caps', caps))
-    application.add_handler(CommandHandler('mermaid', mermaid))
-    application.add_handler(CommandHandler('image', image))
-    application.add_handler(MessageHandler(filters.VOICE, voice_message))
-    application.add_handler(MessageHandler(filters.AUDIO, audio_message))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_message))
-    application.add_handler(MessageHandler(filters.Document.ALL, file_receive))
-
-    # Add error handler
-    application.add_error_handler(error_handler)
+    application = (
+        ApplicationBuilder()
+        .token(telegram_api_key)
+        .concurrent_updates(webhook.BoundedUpdateProcessor(CONCURRENT_UPDATES, UPDATE_BACKLOG))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # Add handlers and the error handler
+    add_handlers(application)
 
     # Retry loop for startup
     attempt = 0
@@ -429,11 +703,15 @@ def run_bot_with_retry(telegram_api_key: str, max_retries: int = None, base_dela
         delay = min(base_delay * (2 ** (attempt - 1)), 300)  # Cap at 5 minutes
 
         try:
-            logger.info(f"Starting bot (attempt {attempt})...")
-            application.run_polling(
-                drop_pending_updates=True,
-                allowed_updates=Update.ALL_TYPES,
-            )
+            if webhook.WEBHOOK_URL:
+                logger.info(f"Starting bot with webhook (attempt {attempt})...")
+                asyncio.run(webhook.run(application))
+            else:
+                logger.info(f"Starting bot (attempt {attempt})...")
+                application.run_polling(
+                    drop_pending_updates=True,
+                    allowed_updates=Update.ALL_TYPES,
+                )
             # If we get here, bot exited cleanly
             logger.info("Bot stopped cleanly")
             break
@@ -0,0 +1,148 @@
+"""
+Completion Cache Module
+
+Cache of chat completions for short, frequently repeated requests (chat
+messages, summaries of voice notes), keyed by the model, the sampling
+parameters and the normalized messages. A repeated question in a group or
+the same voice note forwarded again is answered without a model request.
+
+Entries expire after COMPLETION_CACHE_TTL seconds and are evicted
+least-recently-used. The in-memory tier is always on; an optional SQLite
+tier (COMPLETION_CACHE_DB) keeps answers across restarts and holds more
+entries. Callers opt in per request, so any request can bypass the cache.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached completion is served (0 disables the cache)
+TTL = float(os.environ.get("COMPLETION_CACHE_TTL", "3600"))
+
+# Completions kept in memory
+MAX_ENTRIES = int(os.environ.get("COMPLETION_CACHE_MAX_ENTRIES", "1000"))
+
+# SQLite file of the on-disk tier (unset: memory only), and its size in entries
+DB_PATH = os.environ.get("COMPLETION_CACHE_DB", "")
+DB_MAX_ENTRIES = int(os.environ.get("COMPLETION_CACHE_DB_MAX_ENTRIES", "20000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    completion TEXT NOT NULL,
+    expires REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completions_used ON completions (used);
+"""
+
+# key -> (expires, completion), least recently used first
+_memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_connection: Optional[sqlite3.Connection] = None
+
+
+def enabled() -> bool:
+    return TTL > 0
+
+
+def normalize(text: str) -> str:
+    """Prompt text as it is compared: Unicode NFKC, whitespace runs collapsed."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def make_key(model: str, messages: List[Dict[str, str]], **params: Any) -> str:
+    """Cache key of a completion request."""
+    normalized = [(message.get("role"), normalize(message.get("content") or "")) for message in messages]
+    raw = json.dumps([model, normalized, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _connect() -> Optional[sqlite3.Connection]:
+    """Open the on-disk tier if one is configured (lazy initialization)."""
+    global _connection
+    if _connection is None and DB_PATH:
+        directory = os.path.dirname(DB_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _connection = sqlite3.connect(DB_PATH, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.executescript(_SCHEMA)
+    return _connection
+
+
+def close() -> None:
+    global _connection
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+
+
+def _remember(key: str, expires: float, completion: str) -> None:
+    _memory[key] = (expires, completion)
+    _memory.move_to_end(key)
+    while len(_memory) > MAX_ENTRIES:
+        _memory.popitem(last=False)
+
+
+def lookup(key: str) -> Optional[str]:
+    """The cached completion for key, or None."""
+    now = time.time()
+    entry = _memory.get(key)
+    if entry is not None:
+        if entry[0] > now:
+            _memory.move_to_end(key)
+            metrics.COMPLETION_CACHE.inc("memory_hit")
+            return entry[1]
+        del _memory[key]
+
+    connection = _connect()
+    if connection is not None:
+        try:
+            row = connection.execute(
+                "SELECT completion, expires FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] > now:
+                connection.execute("UPDATE completions SET used = ? WHERE key = ?", (now, key))
+                _remember(key, row[1], row[0])
+                metrics.COMPLETION_CACHE.inc("disk_hit")
+                return row[0]
+            if row is not None:
+                connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning(f"Completion cache lookup failed: {e}")
+
+    metrics.COMPLETION_CACHE.inc("miss")
+    return None
+
+
+def store(key: str, completion: str) -> None:
+    """Cache a completion under key for TTL seconds."""
+    now = time.time()
+    _remember(key, now + TTL, completion)
+
+    connection = _connect()
+    if connection is None:
+        return
+    try:
+        connection.execute(
+            "INSERT OR REPLACE INTO completions (key, completion, expires, used) VALUES (?, ?, ?, ?)",
+            (key, completion, now + TTL, now),
+        )
+        connection.execute(
+            "DELETE FROM completions WHERE expires <= ? OR key IN "
+            "(SELECT key FROM completions ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (now, DB_MAX_ENTRIES),
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"Completion cache store failed: {e}")
@@ -0,0 +1,100 @@
+"""
+Download Module
+
+Voice and audio files are downloaded into memory and handed to Whisper
+as an in-memory file, instead of being written to the scratch directory and
+read back. The bytes held this way are reserved against a process-wide
+budget, by default an eighth of the service's memory limit (systemd
+MemoryMax / cgroup memory.max, 512 MB in the shipped unit, which also has
+to cover the extraction workers), so concurrent uploads cannot run the bot
+out of memory: a download that does not fit the budget right now, or is
+larger than DOWNLOAD_MEMORY_MAX_FILE, goes to disk as before. Copies made
+from the download in memory (the preprocessed recording) are reserved
+with it.
+"""
+
+import io
+import os
+import contextlib
+from typing import AsyncIterator, Optional
+
+from telegram import File
+
+import metrics
+
+# Largest file downloaded into memory (bytes)
+DOWNLOAD_MEMORY_MAX_FILE = int(os.environ.get("DOWNLOAD_MEMORY_MAX_FILE", str(20 * 1024 * 1024)))
+
+# Budget when no memory limit is configured or detected (bytes)
+DEFAULT_BUDGET = 64 * 1024 * 1024
+
+
+def _cgroup_memory_limit() -> Optional[int]:
+    """Memory limit in bytes from cgroup v2 (memory.max) or v1, if any."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # v1 reports "no limit" as a huge number
+        if value.isdigit() and int(value) < 1 << 50:
+            return int(value)
+    return None
+
+
+def budget_size() -> int:
+    """Bytes of downloads held in memory at once, across all updates."""
+    configured = os.environ.get("DOWNLOAD_MEMORY_BUDGET")
+    if configured:
+        return int(configured)
+    limit = _cgroup_memory_limit()
+    return limit // 8 if limit else DEFAULT_BUDGET
+
+
+class MemoryBudget:
+    """Bytes reserved by in-memory downloads, up to a limit."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    def try_reserve(self, size: int) -> bool:
+        """Reserve size bytes if they fit; never waits."""
+        if self.used + size > self.limit:
+            return False
+        self.used += size
+        return True
+
+    def release(self, size: int) -> None:
+        self.used -= size
+
+
+budget = MemoryBudget(budget_size())
+
+
+@contextlib.asynccontextmanager
+async def memory_download(file: File, name: str, extra: int = 0) -> AsyncIterator[Optional[io.BytesIO]]:
+    """Download file into memory when the budget allows it.
+
+    Yields a buffer positioned at the start whose ``name`` (used for the
+    upload's file name) is name, or None when the file should be downloaded
+    to disk instead. ``extra`` bytes are reserved on top of the file for
+    copies the block makes in memory. The reservation is released when the
+    block exits.
+    """
+    size = file.file_size
+    reserved = (size or 0) + extra
+    if not size or size > DOWNLOAD_MEMORY_MAX_FILE or not budget.try_reserve(reserved):
+        yield None
+        return
+
+    metrics.DOWNLOADS.inc("memory")
+    try:
+        buffer = io.BytesIO()
+        buffer.name = name
+        await file.download_to_memory(out=buffer)
+        buffer.seek(0)
+        yield buffer
+    finally:
+        budget.release(reserved)
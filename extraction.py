@@ -0,0 +1,307 @@
+"""
+Text Extraction Module
+
+CPU-bound document parsing (pdfminer, python-docx, python-pptx,
+BeautifulSoup) runs in a process pool so it neither blocks the bot's event
+loop nor competes for its GIL. The pool size follows the CPU quota of the
+service (systemd CPUQuota / cgroup cpu.max), and large PDFs are split into
+page ranges that are extracted in parallel.
+"""
+
+import io
+import os
+import re
+import math
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Iterable, List, Optional
+
+import docx
+import pptx
+from bs4 import BeautifulSoup
+from pdfminer.converter import TextConverter
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.layout import LAParams
+
+import metrics
+import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Prefer the C-based lxml parser when it is installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# Elements that never belong to the main content of a page
+_BOILERPLATE_TAGS = [
+    "script", "style", "noscript", "nav", "header", "footer", "aside",
+    "form", "iframe", "svg", "button", "select", "template",
+]
+_BOILERPLATE_ATTRS = re.compile(
+    r'cookie|consent|banner|comment|footer|header|nav|menu|sidebar|share|social|'
+    r'related|advert|promo|newsletter|subscribe|popup|modal|breadcrumb',
+    re.IGNORECASE,
+)
+_CONTENT_ATTRS = re.compile(r'article|body|content|main|post|entry|story', re.IGNORECASE)
+_TEXT_BLOCKS = ["p", "pre", "blockquote", "li", "h1", "h2", "h3", "h4", "h5", "h6"]
+
+# Main content shorter than this falls back to the whole page text
+MIN_MAIN_CONTENT_CHARS = 250
+
+# PDF extraction parameters
+laparams = LAParams()
+laparams.char_margin = 1
+laparams.word_margin = 2
+
+# Pages per extraction task when a PDF is split across workers
+PAGES_PER_TASK = int(os.environ.get("EXTRACTION_PAGES_PER_TASK", "8"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_slots: Optional[scheduler.FairQueue] = None
+
+
+def worker_count() -> int:
+    """Number of extraction workers allowed by the CPU quota and affinity."""
+    configured = os.environ.get("EXTRACTION_WORKERS")
+    if configured:
+        return max(1, int(configured))
+
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """CPU quota in cores from cgroup v2 (cpu.max) or v1 (cfs_quota), if any."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Get or create the extraction process pool (lazy initialization)."""
+    global _pool
+    if _pool is None:
+        workers = worker_count()
+        logger.info(f"Starting extraction pool with {workers} worker(s)")
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown() -> None:
+    """Shut down the extraction pool."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run(func, *args):
+    """Run an extraction function in the process pool.
+
+    Calls wait for a worker in a FairQueue rather than in the pool's own
+    FIFO, so one user's large documents do not hold up everyone else's.
+    """
+    global _slots
+    if _slots is None:
+        workers = worker_count()
+        _slots = scheduler.FairQueue(workers, flow_cap=scheduler.user_share(workers))
+    loop = asyncio.get_running_loop()
+    async with _slots.slot():
+        with metrics.stage("extraction"):
+            return await loop.run_in_executor(get_pool(), func, *args)
+
+
+# ============ Worker functions (run in the pool) ============
+
+def extract_text_by_page(pdf_path: str, pagenos: Optional[Iterable[int]] = None):
+    """Extract text from PDF page by page (optionally only the given page numbers)."""
+    with open(pdf_path, 'rb') as fh:
+        pages = PDFPage.get_pages(
+            fh,
+            pagenos=set(pagenos) if pagenos is not None else None,
+            caching=True,
+            check_extractable=True,
+        )
+        for page in pages:
+            resource_manager = PDFResourceManager()
+            fake_file_handle = io.StringIO()
+            converter = TextConverter(resource_manager, fake_file_handle, laparams=laparams)
+            page_interpreter = PDFPageInterpreter(resource_manager, converter)
+            page_interpreter.process_page(page)
+
+            text = fake_file_handle.getvalue()
+            yield text
+
+            converter.close()
+            fake_file_handle.close()
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    """Count the pages of a PDF without interpreting their content."""
+    with open(pdf_path, 'rb') as fh:
+        return sum(1 for _ in PDFPage.get_pages(fh, check_extractable=True))
+
+
+def extract_pdf_pages(pdf_path: str, first: int, last: int) -> List[str]:
+    """Extract the text of pages first..last-1 (zero-based)."""
+    return list(extract_text_by_page(pdf_path, pagenos=range(first, last)))
+
+
+def extract_docx_text(file_in: str) -> str:
+    """Extract paragraph text from a Word document."""
+    document = docx.Document(file_in)
+    return "".join(paragraph.text + "\n" for paragraph in document.paragraphs)
+
+
+def extract_pptx_text(file_in: str) -> str:
+    """Extract the text of all text frames in a PowerPoint presentation."""
+    presentation = pptx.Presentation(file_in)
+    parts = []
+    for slide in presentation.slides:
+        for shape in slide.shapes:
+            if shape.has_text_frame:
+                parts.append(shape.text + "\n")
+    return "".join(parts)
+
+
+def extract_html_text(html) -> str:
+    """Extract visible text from an HTML page (str, or bytes with encoding detection)."""
+    soup = BeautifulSoup(html, HTML_PARSER)
+
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.decompose()
+
+    text = soup.get_text()
+
+    # Clean up whitespace
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
+
+def _link_density(element) -> float:
+    text_length = len(element.get_text(" ", strip=True))
+    if not text_length:
+        return 1.0
+    link_length = sum(len(a.get_text(" ", strip=True)) for a in element.find_all("a"))
+    return link_length / text_length
+
+
+def _is_boilerplate(element) -> bool:
+    if element.attrs is None:
+        return False
+    marker = " ".join(element.get("class") or []) + " " + (element.get("id") or "")
+    if not _BOILERPLATE_ATTRS.search(marker) or _CONTENT_ATTRS.search(marker):
+        return False
+    # Keep wrappers (e.g. class="with-sidebar") that contain the article itself
+    return (
+        element.find(["article", "main"]) is None
+        and element.find(class_=_CONTENT_ATTRS) is None
+        and element.find(id=_CONTENT_ATTRS) is None
+    )
+
+
+def extract_main_content(html) -> str:
+    """Extract the article body of an HTML page.
+
+    Paragraph-like blocks with little link text contribute a score (based
+    on text length and commas) to their parent and grandparent containers;
+    the container with the best score, discounted by its link density, is
+    taken as the main content. Pages where no convincing container is found
+    fall back to extract_html_text().
+    """
+    soup = BeautifulSoup(html, HTML_PARSER)
+    for element in soup(_BOILERPLATE_TAGS):
+        element.decompose()
+    for element in soup.find_all(_is_boilerplate):
+        if element.name not in ("html", "body") and not element.decomposed:
+            element.decompose()
+
+    # Keyed by id(): hashing a bs4 Tag serializes its whole subtree
+    candidates = {}
+    scores = {}
+
+    def add_score(element, score):
+        candidates[id(element)] = element
+        scores[id(element)] = scores.get(id(element), 0) + score
+
+    for block in soup.find_all(["p", "pre", "td"]):
+        text = block.get_text(" ", strip=True)
+        if len(text) < 25 or _link_density(block) > 0.5:
+            continue
+        score = 1 + text.count(",") + min(len(text) / 100, 3)
+        parent = block.parent
+        if parent is not None:
+            add_score(parent, score)
+            if parent.parent is not None:
+                add_score(parent.parent, score / 2)
+
+    if not scores:
+        return extract_html_text(html)
+
+    best = candidates[max(scores, key=lambda key: scores[key] * (1 - _link_density(candidates[key])))]
+
+    paragraphs = []
+    for block in best.find_all(_TEXT_BLOCKS):
+        # Nested blocks (e.g. <p> inside <li>) are covered by their outer block
+        if block.find_parent(_TEXT_BLOCKS) is not None:
+            continue
+        text = block.get_text(" ", strip=True)
+        if text and _link_density(block) <= 0.5:
+            paragraphs.append(text)
+
+    content = "\n\n".join(paragraphs)
+    if len(content) < MIN_MAIN_CONTENT_CHARS:
+        return extract_html_text(html)
+    return content
+
+
+# ============ Async entry points ============
+
+async def iter_pdf_pages(pdf_path: str) -> AsyncIterator[str]:
+    """Yield PDF pages in order as soon as their page range is extracted.
+
+    All page ranges are submitted to the pool up front; the first pages can
+    be consumed while later ranges are still being parsed.
+    """
+    page_count = await run(pdf_page_count, pdf_path)
+    ranges = [(first, min(first + PAGES_PER_TASK, page_count)) for first in range(0, page_count, PAGES_PER_TASK)]
+    futures = [asyncio.ensure_future(run(extract_pdf_pages, pdf_path, first, last)) for first, last in ranges]
+    try:
+        for future in futures:
+            for page in await future:
+                yield page
+    finally:
+        for future in futures:
+            future.cancel()
+
@@ -0,0 +1,166 @@
+"""
+URL Fetcher Module
+
+Async HTTP fetcher for URL summaries. All requests share one pooled
+httpx client, bodies are streamed and capped at a maximum size, responses
+are kept in a small in-memory HTTP cache that is revalidated with
+ETag/Last-Modified conditional requests, and concurrent requests for the
+same URL are coalesced into a single fetch.
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FETCH_TIMEOUT = 30.0
+MAX_BYTES = int(os.environ.get("FETCH_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# Freshness for responses without Cache-Control max-age, and cache size
+DEFAULT_TTL = float(os.environ.get("FETCH_CACHE_TTL", "300"))
+CACHE_MAX_BYTES = int(os.environ.get("FETCH_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+USER_AGENT = "Mozilla/5.0 (compatible; telegram-bot-ai)"
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class FetchError(Exception):
+    """Raised when a response cannot be used (e.g. it exceeds MAX_BYTES)."""
+
+
+class CachedResponse:
+    """A cached response body with its validators and freshness deadline."""
+
+    def __init__(self, body: bytes, etag: Optional[str], last_modified: Optional[str], expires: float):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+
+_client: Optional[httpx.AsyncClient] = None
+_cache: "OrderedDict[str, CachedResponse]" = OrderedDict()
+_cache_bytes = 0
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get or create the shared HTTP client (lazy initialization)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=FETCH_TIMEOUT,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _client
+
+
+async def close() -> None:
+    """Close the shared HTTP client."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _freshness(headers: httpx.Headers) -> Optional[float]:
+    """Seconds a response may be served without revalidation (None = do not store)."""
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0.0
+    match = _MAX_AGE.search(cache_control)
+    if match:
+        return float(match.group(1))
+    return DEFAULT_TTL
+
+
+def _store(url: str, entry: CachedResponse) -> None:
+    global _cache_bytes
+    previous = _cache.pop(url, None)
+    if previous is not None:
+        _cache_bytes -= len(previous.body)
+    _cache[url] = entry
+    _cache_bytes += len(entry.body)
+
+    while _cache_bytes > CACHE_MAX_BYTES and _cache:
+        _, evicted = _cache.popitem(last=False)
+        _cache_bytes -= len(evicted.body)
+
+
+async def _read_capped(response: httpx.Response) -> bytes:
+    length = response.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_BYTES:
+        raise FetchError(f"Page is larger than {MAX_BYTES // (1024 * 1024)} MB")
+
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        if len(body) > MAX_BYTES:
+            raise FetchError(f"Page is larger than {MAX_BYTES // (1024 * 1024)} MB")
+    return bytes(body)
+
+
+async def _fetch(url: str, cached: Optional[CachedResponse]) -> bytes:
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    async with get_client().stream("GET", url, headers=headers) as response:
+        ttl = _freshness(response.headers)
+
+        if response.status_code == 304 and cached is not None:
+            logger.info(f"Revalidated cached page: {url}")
+            if ttl is not None:
+                cached.expires = time.monotonic() + ttl
+                _store(url, cached)
+            return cached.body
+
+        response.raise_for_status()
+        body = await _read_capped(response)
+
+    etag = response.headers.get("etag")
+    last_modified = response.headers.get("last-modified")
+    if ttl is not None:
+        _store(url, CachedResponse(body, etag, last_modified, time.monotonic() + ttl))
+    return body
+
+
+async def _timed_fetch(url: str, cached: Optional[CachedResponse]) -> bytes:
+    with metrics.stage("fetch"):
+        return await _fetch(url, cached)
+
+
+async def fetch(url: str) -> bytes:
+    """Fetch a URL body, served from cache while fresh.
+
+    Stale entries are revalidated with a conditional GET; callers asking for
+    a URL that is already being fetched share that request.
+    """
+    cached = _cache.get(url)
+    if cached is not None and cached.expires > time.monotonic():
+        _cache.move_to_end(url)
+        return cached.body
+
+    task = _inflight.get(url)
+    if task is None:
+        task = asyncio.ensure_future(_timed_fetch(url, cached))
+        _inflight[url] = task
+        task.add_done_callback(lambda _: _inflight.pop(url, None))
+    return await asyncio.shield(task)
@@ -0,0 +1,176 @@
+"""
+Job Store Module
+
+Durable record of the document and URL summary jobs in progress, kept in
+SQLite. A job holds what is needed to run it again (the chat and status
+message, a copy of the uploaded file or the URL, the cache keys) and a
+checkpoint for every finished chapter summary, keyed by the hash of the
+chapter text.
+
+When the bot is restarted in the middle of a job, the job is resumed on
+startup and only the chapters without a checkpoint are summarized again.
+Finished jobs are deleted together with their checkpoints and input copy.
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_STORE_DIR = os.environ.get(
+    "JOB_STORE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "telegram_bot_ai", "jobs"),
+)
+
+# Resume attempts per job (a job that keeps crashing the bot is given up)
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+# Unfinished jobs older than this (seconds) are not resumed
+MAX_AGE = float(os.environ.get("JOB_MAX_AGE", str(24 * 3600)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    chat_type TEXT NOT NULL,
+    request_message_id INTEGER,
+    status_message_id INTEGER,
+    source TEXT NOT NULL,
+    params TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    chunk_hash TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    PRIMARY KEY (job_id, chunk_hash)
+);
+"""
+
+_connection: Optional[sqlite3.Connection] = None
+
+
+class Job(NamedTuple):
+    id: int
+    kind: str
+    chat_id: int
+    chat_type: str
+    request_message_id: Optional[int]
+    status_message_id: Optional[int]
+    source: str
+    params: dict
+    attempts: int
+    created: float
+
+
+def _connect() -> sqlite3.Connection:
+    """Open the database (lazy initialization)."""
+    global _connection
+    if _connection is None:
+        os.makedirs(JOB_STORE_DIR, exist_ok=True)
+        _connection = sqlite3.connect(os.path.join(JOB_STORE_DIR, "jobs.sqlite3"), isolation_level=None)
+        # WAL with NORMAL sync: a checkpoint costs no fsync, a power loss at worst loses the last few
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.execute("PRAGMA foreign_keys=ON")
+        _connection.executescript(_SCHEMA)
+    return _connection
+
+
+def close() -> None:
+    global _connection
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+
+
+def _input_dir(job_id: int) -> str:
+    return os.path.join(JOB_STORE_DIR, "inputs", str(job_id))
+
+
+def _chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+
+
+def create(
+    kind: str,
+    chat_id: int,
+    chat_type: str,
+    request_message_id: Optional[int],
+    status_message_id: Optional[int],
+    source: str,
+    input_path: Optional[str] = None,
+    **params,
+) -> Job:
+    """Record a new job; input_path (an uploaded file) is moved into the store.
+
+    ``source`` is the URL, or the file name of the upload; ``params`` are
+    JSON-serializable values the job needs to run again (e.g. cache keys).
+    """
+    connection = _connect()
+    created = time.time()
+    cursor = connection.execute(
+        "INSERT INTO jobs (kind, chat_id, chat_type, request_message_id, status_message_id, source, params, created) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (kind, chat_id, chat_type, request_message_id, status_message_id, source, json.dumps(params), created),
+    )
+    job_id = cursor.lastrowid
+    if input_path is not None:
+        directory = _input_dir(job_id)
+        os.makedirs(directory, exist_ok=True)
+        stored = os.path.join(directory, os.path.basename(input_path))
+        shutil.move(input_path, stored)
+        params = dict(params, input_path=stored)
+        connection.execute("UPDATE jobs SET params = ? WHERE id = ?", (json.dumps(params), job_id))
+    return Job(job_id, kind, chat_id, chat_type, request_message_id, status_message_id, source, params, 0, created)
+
+
+def checkpoint(job_id: int, chunk: str, summary: str) -> None:
+    """Save the summary of one chapter of a job."""
+    _connect().execute(
+        "INSERT OR REPLACE INTO chapters (job_id, chunk_hash, summary) VALUES (?, ?, ?)",
+        (job_id, _chunk_hash(chunk), summary),
+    )
+
+
+def lookup_chapter(job_id: int, chunk: str) -> Optional[str]:
+    """The saved summary of a chapter of a job, or None."""
+    row = _connect().execute(
+        "SELECT summary FROM chapters WHERE job_id = ? AND chunk_hash = ?", (job_id, _chunk_hash(chunk))
+    ).fetchone()
+    return row[0] if row else None
+
+
+def finish(job_id: int) -> None:
+    """Delete a job (done or given up) with its checkpoints and input."""
+    _connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+    shutil.rmtree(_input_dir(job_id), ignore_errors=True)
+
+
+def claim_unfinished() -> List[Job]:
+    """Jobs left over by a previous run, each with its attempt counter increased."""
+    connection = _connect()
+    rows = connection.execute(
+        "SELECT id, kind, chat_id, chat_type, request_message_id, status_message_id, source, params, attempts, created "
+        "FROM jobs ORDER BY id"
+    ).fetchall()
+
+    jobs = []
+    for row in rows:
+        job = Job(*row[:7], json.loads(row[7]), row[8] + 1, row[9])
+        connection.execute("UPDATE jobs SET attempts = ? WHERE id = ?", (job.attempts, job.id))
+        jobs.append(job)
+    return jobs
+
+
+def exhausted(job: Job) -> bool:
+    """Whether a job should be given up instead of resumed (too many attempts or too old)."""
+    return job.attempts > MAX_ATTEMPTS or time.time() - job.created > MAX_AGE
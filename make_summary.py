@@ -6,91 +6,186 @@ Uses OpenAI GPT-4o-mini for summarization
 """
 
 import re
-import io
 import os
+import time
+import asyncio
 import logging
-from typing import List, Tuple
-
-import docx
-import pptx
-import requests
-from bs4 import BeautifulSoup
-from openai import OpenAI
-from pdfminer.converter import TextConverter
-from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
-from pdfminer.pdfpage import PDFPage
-from pdfminer.layout import LAParams
-
-logger = logging.getLogger(__name__)
-
-# PDF extraction parameters
-laparams = LAParams()
-laparams.char_margin = 1
-laparams.word_margin = 2
-
-# Lazy-initialized OpenAI client
-_openai_client = None
-
-
-def get_openai_client():
-    """Get or create OpenAI client (lazy initialization)."""
-    global _openai_client
-    if _openai_client is None:
-        _openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-    return _openai_client
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import httpx
 
-def extract_text_by_page(pdf_path: str):
-    """Extract text from PDF page by page."""
-    with open(pdf_path, 'rb') as fh:
-        for page in PDFPage.get_pages(fh, caching=True, check_extractable=True):
-            resource_manager = PDFResourceManager()
-            fake_file_handle = io.StringIO()
-            converter = TextConverter(resource_manager, fake_file_handle, laparams=laparams)
-            page_interpreter = PDFPageInterpreter(resource_manager, converter)
-            page_interpreter.process_page(page)
+import artifact_cache
+import extraction
+import fetcher
+import job_store
+import model_client
+import render
 
-            text = fake_file_handle.getvalue()
-            yield text
+logger = logging.getLogger(__name__)
 
-            converter.close()
-            fake_file_handle.close()
+# Bump when prompts or rendering change so cached summaries are not reused
+PIPELINE_VERSION = 2
 
+# Prefix of the placeholder text create_summary returns on failure
+SUMMARY_ERROR_PREFIX = "Error creating summary"
 
-def extract_text(pdf_path: str) -> List[str]:
-    """Extract and chunk text from PDF."""
-    text = ""
-    for page in extract_text_by_page(pdf_path):
-        text += page
-    return extract_chapters(text)
+# Shown instead of a summary PDF when model requests failed (e.g. rate limited)
+SUMMARY_BUSY_MESSAGE = "The summary service is busy, please try again in a few minutes"
 
+# Estimated token budget per chapter (~1000 words of English text)
+CHAPTER_TOKENS = int(os.environ.get("CHAPTER_TOKENS", "1300"))
 
-def extract_chapters(text: str, max_words: int = 1000) -> List[str]:
-    """Split text into chunks of max_words."""
-    words = text.split()
-    chunks = []
-    chunk = ""
+# Chunk boundaries: blank lines between paragraphs, whitespace after sentences
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t\r\f\v]*\n\s*')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_LAST_SENTENCE_END = re.compile(r'.*[.!?]\s+', re.DOTALL)
 
-    for word in words:
-        if len(chunk.split()) + 1 <= max_words:
-            chunk += " " + word
-        else:
-            chunks.append(chunk.strip())
-            chunk = word
+# Maximum number of chapter summary requests in flight per document
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "8"))
 
-    if chunk.strip():
-        chunks.append(chunk.strip())
+# Chapter summaries combined per request when reducing to the overall summary
+REDUCE_FAN_IN = int(os.environ.get("SUMMARY_REDUCE_FAN_IN", "8"))
 
-    return chunks
+# Summarize only the main article body of web pages (not navigation, footers, comments)
+URL_MAIN_CONTENT = os.environ.get("URL_MAIN_CONTENT", "1") == "1"
 
 
-def create_summary(text: str, max_tokens: int = 100, prompt_prefix: str = '') -> str:
+def get_openai_client():
+    """Get the shared AsyncOpenAI client (lazy initialization)."""
+    return model_client.get_client()
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of text (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+class TextChunker:
+    """Single-pass chunker that packs text into token-budgeted chunks.
+
+    Text is fed in pieces (e.g. one PDF page at a time). Chunks are cut at
+    paragraph boundaries where possible, then at sentence boundaries, and
+    only split mid-sentence when a single sentence exceeds the budget.
+    Whitespace inside a paragraph is normalized to single spaces.
+    """
+
+    def __init__(self, max_tokens: int = CHAPTER_TOKENS):
+        self.max_tokens = max_tokens
+        self._max_chars = max_tokens * 4
+        self._pending = ""
+        self._parts: List[str] = []
+        self._tokens = 0
+        self._ready: List[str] = []
+
+    def feed(self, text: str) -> List[str]:
+        """Add a piece of text and return the chunks it completed."""
+        buffer = self._pending + text
+        start = 0
+        for match in _PARAGRAPH_BREAK.finditer(buffer):
+            self._add_paragraph(buffer[start:match.start()])
+            start = match.end()
+        self._pending = buffer[start:]
+
+        # Keep the unterminated tail bounded when the text has no paragraph breaks
+        if len(self._pending) > 2 * self._max_chars:
+            cut = _last_boundary(self._pending)
+            self._add_paragraph(self._pending[:cut])
+            self._pending = self._pending[cut:]
+
+        return self._take_ready()
+
+    def close(self) -> List[str]:
+        """Flush the remaining text and return the final chunks."""
+        self._add_paragraph(self._pending)
+        self._pending = ""
+        self._emit()
+        return self._take_ready()
+
+    def _take_ready(self) -> List[str]:
+        ready, self._ready = self._ready, []
+        return ready
+
+    def _emit(self):
+        if self._parts:
+            self._ready.append("".join(self._parts))
+            self._parts = []
+            self._tokens = 0
+
+    def _add_paragraph(self, paragraph: str):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            return
+        tokens = estimate_tokens(paragraph)
+        if tokens <= self.max_tokens:
+            self._add_segment(paragraph, tokens, "\n\n")
+            return
+
+        separator = "\n\n"
+        for sentence in _SENTENCE_END.split(paragraph):
+            tokens = estimate_tokens(sentence)
+            if tokens <= self.max_tokens:
+                self._add_segment(sentence, tokens, separator)
+            else:
+                for window in self._split_words(sentence):
+                    self._add_segment(window, estimate_tokens(window), separator)
+                    separator = " "
+            separator = " "
+
+    def _split_words(self, sentence: str):
+        window: List[str] = []
+        length = 0
+        for word in sentence.split(" "):
+            while len(word) > self._max_chars:
+                if window:
+                    yield " ".join(window)
+                    window, length = [], 0
+                yield word[:self._max_chars]
+                word = word[self._max_chars:]
+            if window and length + len(word) + 1 > self._max_chars:
+                yield " ".join(window)
+                window, length = [], 0
+            window.append(word)
+            length += len(word) + 1
+        if window:
+            yield " ".join(window)
+
+    def _add_segment(self, segment: str, tokens: int, separator: str):
+        if self._parts and self._tokens + tokens > self.max_tokens:
+            self._emit()
+        if self._parts:
+            self._parts.append(separator)
+        self._parts.append(segment)
+        self._tokens += tokens
+
+
+def _last_boundary(text: str) -> int:
+    """Index just past the last sentence end in text, else the last space."""
+    match = _LAST_SENTENCE_END.match(text)
+    if match:
+        return match.end()
+    index = text.rfind(" ")
+    return index + 1 if index > 0 else len(text)
+
+
+def iter_chunks(texts: Iterable[str], max_tokens: int = CHAPTER_TOKENS) -> Iterator[str]:
+    """Yield token-budgeted chunks from an iterable of text pieces."""
+    chunker = TextChunker(max_tokens=max_tokens)
+    for text in texts:
+        yield from chunker.feed(text)
+    yield from chunker.close()
+
+
+def extract_chapters(text: str, max_tokens: int = CHAPTER_TOKENS) -> List[str]:
+    """Split text into chunks of at most max_tokens (estimated)."""
+    return list(iter_chunks([text], max_tokens=max_tokens))
+
+
+async def create_summary(text: str, max_tokens: int = 100, prompt_prefix: str = '') -> str:
     """Create summary using GPT-4o-mini."""
     try:
         prompt = prompt_prefix + text
 
-        response = get_openai_client().chat.completions.create(
-            model="gpt-4o-mini",
+        response = await model_client.chat_completion(
             messages=[
                 {
                     "role": "system",
@@ -102,29 +197,46 @@ def create_summary(text: str, max_tokens: int = 100, prompt_prefix: str = '') ->
             temperature=0.7
         )
 
-        summary = response.choices[0].message.content.strip()
+        summary = response.strip()
         summary = summary.rstrip(',').rstrip('.')
         return summary
 
     except Exception as e:
         logger.error(f"Summary creation error: {e}")
-        return f"Error creating summary: {str(e)}"
+        return f"{SUMMARY_ERROR_PREFIX}: {str(e)}"
+
+
+CHAPTER_PROMPT = (
+    'Create a brief summary from the input text in bullet points. '
+    'Start every bullet point with "\\item ". Do not output incomplete sentences. '
+    'This is the input text: '
+)
+
+
+REDUCE_PROMPT = 'Combine the following partial summaries into one brief summary of their main points: '
+
+OVERALL_PROMPT = 'From the given text, generate a concise overall summary: '
 
 
-def generate_summaries(chapters: List[str], min_words_summary: int = 20) -> List[str]:
-    """Generate summaries for each chapter."""
-    summaries = []
-    prompt = (
-        'Create a brief summary from the input text in bullet points. '
-        'Start every bullet point with "\\item ". Do not output incomplete sentences. '
-        'This is the input text: '
-    )
+async def summarize_chapter(chapter: str, semaphore: asyncio.Semaphore, job_id: Optional[int] = None) -> str:
+    """Summarize one chapter once a slot of the semaphore is free.
 
-    for chapter in chapters:
-        if not chapter.strip():
-            continue
-        summary = create_summary(chapter, max_tokens=100, prompt_prefix=prompt)
-        summaries.append(summary)
+    With a job_id, the summary is checkpointed in the job store.
+    """
+    async with semaphore:
+        summary = await create_summary(chapter, max_tokens=100, prompt_prefix=CHAPTER_PROMPT)
+    if job_id is not None and not summary.startswith(SUMMARY_ERROR_PREFIX):
+        job_store.checkpoint(job_id, chapter, summary)
+    return summary
+
+
+async def _checkpointed(summary: str) -> str:
+    return summary
+
+
+def trim_summaries(summaries: List[str], min_words_summary: int) -> List[str]:
+    """Drop a very short final summary and end the last one with a period."""
+    summaries = list(summaries)
 
     # Remove very short final summaries
     if summaries and len(summaries[-1].split()) <= min_words_summary:
@@ -136,195 +248,307 @@ def generate_summaries(chapters: List[str], min_words_summary: int = 20) -> List
     return summaries
 
 
-def summarize_pdf(summaries: List[str], overall_summary: str, file_out: str) -> Tuple[str, str]:
-    """Create LaTeX PDF with summaries."""
-    out_file_raw, _ = os.path.splitext(file_out)
-    pdf_path = os.path.dirname(file_out)
-    tex_file = out_file_raw + '.tex'
+def latex_body(summaries: List[str], overall_summary: str) -> str:
+    """LaTeX document body (without preamble) for a summary."""
+    lines = [
+        r'\begin{document}',
+        r'\section*{Number of Chapters: ' + str(len(summaries)) + '}',
+        r'\subsection*{Overall Summary}',
+        overall_summary,
+        r'\newpage',
+        r'\section*{Chapter Summaries}',
+    ]
+    for i, summary in enumerate(summaries):
+        lines.append(r'\subsection*{Chapter ' + str(i + 1) + ' Summary}')
+        lines.append(r'\begin{itemize}')
+        lines.append(summary.replace("\\item", "\\item "))
+        lines.append(r'\end{itemize}')
+    lines.append(r'\end{document}')
+    return '\n'.join(lines) + '\n'
+
+
+def plain_blocks(summaries: List[str], overall_summary: str) -> List[Tuple[str, str]]:
+    """The summary as (style, text) blocks for the plain PDF fallback."""
+    blocks = [
+        ('title', f'Number of Chapters: {len(summaries)}'),
+        ('heading', 'Overall Summary'),
+        ('text', overall_summary.replace('\\item', '\u2022')),
+        ('title', 'Chapter Summaries'),
+    ]
+    for i, summary in enumerate(summaries):
+        blocks.append(('heading', f'Chapter {i + 1} Summary'))
+        for item in summary.split('\\item'):
+            if item.strip():
+                blocks.append(('text', '\u2022 ' + item.strip()))
+    return blocks
+
+
+async def summarize_pdf(summaries: List[str], overall_summary: str, file_out: str) -> Tuple[str, str]:
+    """Render the summary PDF with LaTeX, or as a plain PDF when TeX is unavailable."""
+    if not await render.render_latex(latex_body(summaries, overall_summary), file_out):
+        logger.warning("LaTeX rendering unavailable or failed, writing plain PDF")
+        render.write_text_pdf(file_out, plain_blocks(summaries, overall_summary))
+
+    return file_out, overall_summary
+
 
-    with open(tex_file, 'w', encoding='utf-8') as f:
-        f.write(r'\documentclass[12pt]{article}' + '\n')
-        f.write(r'\usepackage[utf8]{inputenc}' + '\n')
-        f.write(r'\usepackage{amsmath}' + '\n')
-        f.write(r'\usepackage{amsfonts}' + '\n')
-        f.write(r'\usepackage{amssymb}' + '\n')
-        f.write(r'\usepackage{graphicx}' + '\n')
-        f.write(r'\begin{document}' + '\n')
+def pipeline_params() -> dict:
+    """Parameters that affect summary output (part of every cache key)."""
+    return {
+        "version": PIPELINE_VERSION,
+        "model": model_client.CHAT_MODEL,
+        "chapter_tokens": CHAPTER_TOKENS,
+        "reduce_fan_in": REDUCE_FAN_IN,
+        "url_main_content": URL_MAIN_CONTENT,
+    }
+
+
+async def reduce_summaries(
+    summaries: List[str],
+    fan_in: int = REDUCE_FAN_IN,
+    concurrency: int = SUMMARY_CONCURRENCY,
+) -> str:
+    """Reduce chapter summaries to one overall summary.
+
+    Up to ``fan_in`` summaries go into one request. Larger sets are reduced
+    level by level: each group of ``fan_in`` summaries is condensed in
+    parallel until few enough remain for the final overall summary, so the
+    prompt size is bounded and the depth grows logarithmically. When a
+    request of an intermediate level fails, its error is returned instead.
+    """
+    fan_in = max(2, fan_in)
+    texts = [summary.replace('\\item', '') for summary in summaries]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def reduce_group(group: List[str]) -> str:
+        async with semaphore:
+            return await create_summary(text=" ".join(group), max_tokens=200, prompt_prefix=REDUCE_PROMPT)
+
+    level = 0
+    while len(texts) > fan_in:
+        level += 1
+        groups = [texts[i:i + fan_in] for i in range(0, len(texts), fan_in)]
+        logger.info(f"Reduce level {level}: {len(texts)} summaries in {len(groups)} groups")
+        texts = list(await asyncio.gather(*(reduce_group(group) for group in groups)))
+        failed = [text for text in texts if text.startswith(SUMMARY_ERROR_PREFIX)]
+        if failed:
+            # Error text must not go into the next level's prompt; the caller sees a failed summary
+            return failed[0]
+
+    return await create_summary(text=" ".join(texts), max_tokens=400, prompt_prefix=OVERALL_PROMPT)
+
+
+class StageTimings:
+    """Wall-clock marks for the stages of one summary pipeline."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks: Dict[str, float] = {}
+
+    def mark(self, stage: str, once: bool = False) -> None:
+        """Record the time since start for stage (keep the first mark if once)."""
+        if once and stage in self.marks:
+            return
+        self.marks[stage] = time.perf_counter() - self.start
+
+    def overlap(self) -> float:
+        """Seconds during which extraction and summarization ran together."""
+        if "first_dispatch" not in self.marks or "extracted" not in self.marks:
+            return 0.0
+        return max(0.0, self.marks["extracted"] - self.marks["first_dispatch"])
+
+    def log(self, name: str) -> None:
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.marks.items())
+        logger.info(f"{name} timings: {stages} (extraction/summary overlap {self.overlap():.2f}s)")
+
+
+def _any_failed(summaries: List[str]) -> bool:
+    """Whether a summary request failed (its error text must not reach the PDF)."""
+    failed = [summary for summary in summaries if summary.startswith(SUMMARY_ERROR_PREFIX)]
+    if failed:
+        logger.error(f"{len(failed)} summary request(s) failed, first: {failed[0]}")
+    return bool(failed)
+
+
+async def _finish_document(
+    chapters: List[str],
+    summaries: List[str],
+    file_out: str,
+    cache_key: Optional[str],
+    timings: StageTimings,
+) -> Tuple[str, str]:
+    """Create the overall summary, render the summary PDF and cache the result."""
+    if not summaries:
+        return ("Error", "Could not generate summaries")
+
+    overall_summary = await reduce_summaries(summaries)
+    timings.mark("overall")
+    if _any_failed([overall_summary]):
+        return ("Error", SUMMARY_BUSY_MESSAGE)
+
+    result = await summarize_pdf(summaries, overall_summary, file_out)
+    timings.mark("rendered")
+
+    if cache_key and os.path.exists(result[0]):
+        artifact_cache.store(cache_key, chapters, summaries, overall_summary, result[0])
+
+    return result
+
+
+async def summarize_stream(
+    texts: AsyncIterable[str],
+    file_out: str,
+    cache_key: Optional[str] = None,
+    empty_error: str = "Could not extract text",
+    concurrency: int = SUMMARY_CONCURRENCY,
+    job_id: Optional[int] = None,
+) -> Tuple[str, str]:
+    """Chunk text as it arrives and summarize each chunk as soon as it is complete.
+
+    Extraction, chunking and the chapter model calls overlap: the first
+    chapter request goes out while later pages are still being parsed.
+    With a job_id, chapters checkpointed by an interrupted run of the job
+    are taken from the job store instead of being summarized again.
+    """
+    timings = StageTimings()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    chunker = TextChunker()
+    chapters: List[str] = []
+    tasks: List[asyncio.Task] = []
+    restored = 0
+
+    def dispatch(chunks: List[str]):
+        nonlocal restored
+        for chunk in chunks:
+            timings.mark("first_dispatch", once=True)
+            chapters.append(chunk)
+            saved = job_store.lookup_chapter(job_id, chunk) if job_id is not None else None
+            if saved is not None:
+                restored += 1
+                tasks.append(asyncio.create_task(_checkpointed(saved)))
+            else:
+                tasks.append(asyncio.create_task(summarize_chapter(chunk, semaphore, job_id)))
 
-        f.write(r'\section*{Number of Chapters: ' + str(len(summaries)) + '}' + '\n')
-        f.write(r'\subsection*{Overall Summary}' + '\n')
-        f.write(overall_summary + '\n')
-        f.write(r'\newpage' + '\n')
-        f.write(r'\section*{Chapter Summaries}' + '\n')
+    try:
+        async for text in texts:
+            timings.mark("first_text", once=True)
+            dispatch(chunker.feed(text))
+        dispatch(chunker.close())
+        timings.mark("extracted")
 
-        for i, summary in enumerate(summaries):
-            f.write(r'\subsection*{Chapter ' + str(i + 1) + ' Summary}' + '\n')
-            f.write(r'\begin{itemize}' + '\n')
-            f.write(summary.replace("\\item", "\\item ") + '\n')
-            f.write(r'\end{itemize}' + '\n')
+        if not chapters:
+            return ("Error", empty_error)
 
-        f.write(r'\end{document}' + '\n')
+        summaries = await asyncio.gather(*tasks)
+        # Checked before trimming: a failed last chapter is short enough to be dropped as a fragment
+        if _any_failed(summaries):
+            return ("Error", SUMMARY_BUSY_MESSAGE)
+        summaries = trim_summaries(summaries, min_words_summary=10)
+        timings.mark("chapters")
+        if restored:
+            logger.info(f"Job {job_id}: {restored} of {len(chapters)} chapter summaries restored from checkpoints")
+    finally:
+        for task in tasks:
+            task.cancel()
 
-    # Compile LaTeX to PDF
-    command = f'pdflatex -interaction=nonstopmode -output-directory={pdf_path} {tex_file} > /dev/null 2>&1'
-    os.system(command)
+    result = await _finish_document(chapters, summaries, file_out, cache_key, timings)
+    timings.log("Summary")
+    return result
 
-    return file_out, overall_summary
 
+async def _iterate(texts: Iterable[str]) -> AsyncIterator[str]:
+    for text in texts:
+        yield text
 
-def pdf_to_summary(file_in: str, file_out: str) -> Tuple[str, str]:
-    """Convert PDF to summary PDF."""
-    try:
-        chapters = extract_text(file_in)
-        if not chapters:
-            return ("Error", "Could not extract text from PDF")
 
-        summaries = generate_summaries(chapters, min_words_summary=10)
-        if not summaries:
-            return ("Error", "Could not generate summaries")
+async def _read_text_file(file_in: str, block_size: int = 64 * 1024) -> AsyncIterator[str]:
+    with open(file_in, 'r', encoding='utf-8') as file:
+        for block in iter(lambda: file.read(block_size), ''):
+            yield block
 
-        combined_text = " ".join(summaries).replace('\\item', '')
-        overall_summary = create_summary(
-            text=combined_text,
-            max_tokens=400,
-            prompt_prefix='From the given text, generate a concise overall summary: '
-        )
 
-        return summarize_pdf(summaries, overall_summary, file_out)
+async def pdf_to_summary(
+    file_in: str, file_out: str, cache_key: Optional[str] = None, job_id: Optional[int] = None
+) -> Tuple[str, str]:
+    """Convert PDF to summary PDF."""
+    try:
+        pages = extraction.iter_pdf_pages(file_in)
+        return await summarize_stream(
+            pages, file_out, cache_key, empty_error="Could not extract text from PDF", job_id=job_id
+        )
 
     except Exception as e:
         logger.error(f"PDF summary error: {e}")
         return ("Error", f"Failed to process PDF: {str(e)}")
 
 
-def txt_to_summary(file_in: str, file_out: str) -> Tuple[str, str]:
+async def txt_to_summary(
+    file_in: str, file_out: str, cache_key: Optional[str] = None, job_id: Optional[int] = None
+) -> Tuple[str, str]:
     """Convert text file to summary PDF."""
     try:
-        with open(file_in, 'r', encoding='utf-8') as file:
-            text = file.read()
-
-        chapters = extract_chapters(text, max_words=1000)
-        if not chapters:
-            return ("Error", "Could not extract text from file")
-
-        summaries = generate_summaries(chapters, min_words_summary=10)
-        if not summaries:
-            return ("Error", "Could not generate summaries")
-
-        combined_text = " ".join(summaries).replace('\\item', '')
-        overall_summary = create_summary(
-            text=combined_text,
-            max_tokens=400,
-            prompt_prefix='From the given text, generate a concise overall summary: '
+        blocks = _read_text_file(file_in)
+        return await summarize_stream(
+            blocks, file_out, cache_key, empty_error="Could not extract text from file", job_id=job_id
         )
 
-        return summarize_pdf(summaries, overall_summary, file_out)
-
     except Exception as e:
         logger.error(f"TXT summary error: {e}")
         return ("Error", f"Failed to process text file: {str(e)}")
 
 
-def docx_to_summary(file_in: str, file_out: str) -> Tuple[str, str]:
+async def docx_to_summary(
+    file_in: str, file_out: str, cache_key: Optional[str] = None, job_id: Optional[int] = None
+) -> Tuple[str, str]:
     """Convert Word document to summary PDF."""
     try:
-        document = docx.Document(file_in)
-        text = ""
-        for paragraph in document.paragraphs:
-            text += paragraph.text + "\n"
-
-        chapters = extract_chapters(text, max_words=1000)
-        if not chapters:
-            return ("Error", "Could not extract text from document")
-
-        summaries = generate_summaries(chapters, min_words_summary=10)
-        if not summaries:
-            return ("Error", "Could not generate summaries")
-
-        combined_text = " ".join(summaries).replace('\\item', '')
-        overall_summary = create_summary(
-            text=combined_text,
-            max_tokens=400,
-            prompt_prefix='From the given text, generate a concise overall summary: '
+        text = await extraction.run(extraction.extract_docx_text, file_in)
+        return await summarize_stream(
+            _iterate([text]), file_out, cache_key, empty_error="Could not extract text from document", job_id=job_id
         )
 
-        return summarize_pdf(summaries, overall_summary, file_out)
-
     except Exception as e:
         logger.error(f"DOCX summary error: {e}")
         return ("Error", f"Failed to process Word document: {str(e)}")
 
 
-def pptx_to_summary(file_in: str, file_out: str) -> Tuple[str, str]:
+async def pptx_to_summary(
+    file_in: str, file_out: str, cache_key: Optional[str] = None, job_id: Optional[int] = None
+) -> Tuple[str, str]:
     """Convert PowerPoint to summary PDF."""
     try:
-        presentation = pptx.Presentation(file_in)
-        text = ""
-
-        for slide in presentation.slides:
-            for shape in slide.shapes:
-                if shape.has_text_frame:
-                    text += shape.text + "\n"
-
-        chapters = extract_chapters(text, max_words=1000)
-        if not chapters:
-            return ("Error", "Could not extract text from presentation")
-
-        summaries = generate_summaries(chapters, min_words_summary=10)
-        if not summaries:
-            return ("Error", "Could not generate summaries")
-
-        combined_text = " ".join(summaries).replace('\\item', '')
-        overall_summary = create_summary(
-            text=combined_text,
-            max_tokens=400,
-            prompt_prefix='From the given text, generate a concise overall summary: '
+        text = await extraction.run(extraction.extract_pptx_text, file_in)
+        return await summarize_stream(
+            _iterate([text]), file_out, cache_key, empty_error="Could not extract text from presentation", job_id=job_id
         )
 
-        return summarize_pdf(summaries, overall_summary, file_out)
-
     except Exception as e:
         logger.error(f"PPTX summary error: {e}")
         return ("Error", f"Failed to process PowerPoint: {str(e)}")
 
 
-def url_to_summary(url_in: str, file_out: str) -> Tuple[str, str]:
+async def url_to_summary(
+    url_in: str, file_out: str, use_cache: bool = True, job_id: Optional[int] = None
+) -> Tuple[str, str]:
     """Convert URL content to summary PDF."""
     try:
-        response = requests.get(url_in, timeout=30)
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-
-        text = soup.get_text()
-
-        # Clean up whitespace
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-
-        chapters = extract_chapters(text, max_words=1000)
-        if not chapters:
-            return ("Error", "Could not extract text from URL")
-
-        summaries = generate_summaries(chapters, min_words_summary=10)
-        if not summaries:
-            return ("Error", "Could not generate summaries")
-
-        combined_text = " ".join(summaries).replace('\\item', '')
-        overall_summary = create_summary(
-            text=combined_text,
-            max_tokens=400,
-            prompt_prefix='From the given text, generate a concise overall summary: '
+        html = await fetcher.fetch(url_in)
+        extract = extraction.extract_main_content if URL_MAIN_CONTENT else extraction.extract_html_text
+        text = await extraction.run(extract, html)
+
+        # Same page content (even from another URL) -> reuse the cached summary
+        cache_key = None
+        if use_cache:
+            cache_key = artifact_cache.make_key('url', artifact_cache.text_hash(text), pipeline_params())
+            cached = artifact_cache.lookup(cache_key)
+            if cached:
+                return cached.pdf_path, cached.overall_summary
+
+        return await summarize_stream(
+            _iterate([text]), file_out, cache_key, empty_error="Could not extract text from URL", job_id=job_id
         )
 
-        return summarize_pdf(summaries, overall_summary, file_out)
-
-    except requests.RequestException as e:
+    except (httpx.HTTPError, fetcher.FetchError) as e:
         logger.error(f"URL fetch error: {e}")
         return ("Error", f"Failed to fetch URL: {str(e)}")
     except Exception as e:
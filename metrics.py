@@ -0,0 +1,337 @@
+"""
+Metrics Module
+
+In-process counters, gauges and latency histograms for the bot, exposed
+in Prometheus text format on a small local HTTP endpoint and summarized by
+the admin-only /stats command.
+
+Handlers are wrapped with instrument(); calls to external services (model,
+Whisper, pdflatex, mmdc) are timed with stage(). Stage metrics carry the
+name of the handler they ran under, so the stage that dominates the p95 of
+each update type can be read directly.
+"""
+
+import os
+import time
+import asyncio
+import bisect
+import logging
+import contextlib
+import contextvars
+import functools
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Local endpoint for Prometheus scrapes ("0" disables it)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+
+# Telegram user ids allowed to use /stats
+ADMIN_USER_IDS = {
+    int(user_id) for user_id in os.environ.get("ADMIN_USER_IDS", "").replace(",", " ").split() if user_id
+}
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+Labels = Tuple[str, ...]
+
+_registry: List["Metric"] = []
+_current_handler: contextvars.ContextVar[str] = contextvars.ContextVar("current_handler", default="none")
+
+
+class Metric:
+    """Base class: a named metric family with label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    def _format_labels(self, values: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def exposition(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, description, labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{self._format_labels(labels)} {value:g}"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, description, labelnames)
+        self.values: Dict[Labels, float] = {}
+        self.functions: Dict[Labels, Callable[[], float]] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set_function(self, function: Callable[[], float], *labels: str) -> None:
+        """Read the value from function at scrape time (e.g. a queue size)."""
+        self.functions[labels] = function
+
+    def get(self, *labels: str) -> float:
+        if labels in self.functions:
+            try:
+                return float(self.functions[labels]())
+            except Exception:
+                return float("nan")
+        return self.values.get(labels, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        for labels in sorted(set(self.values) | set(self.functions)):
+            yield f"{self.name}{self._format_labels(labels)} {self.get(*labels):g}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labelnames)
+        self.buckets = buckets
+        # labels -> [per-bucket counts (+Inf last), count, sum]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += 1
+        entry[2] += value
+
+    def count(self, *labels: str) -> int:
+        entry = self.values.get(labels)
+        return entry[1] if entry else 0
+
+    def quantile(self, q: float, *labels: str) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        entry = self.values.get(labels)
+        if not entry or not entry[1]:
+            return None
+        rank = q * entry[1]
+        seen = 0
+        lower = 0.0
+        for index, bucket_count in enumerate(entry[0]):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if bucket_count and seen + bucket_count >= rank:
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = upper
+        return self.buckets[-1]
+
+    def samples(self) -> Iterator[str]:
+        for labels, (counts, count, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = self._format_labels(labels, 'le="%g"' % bound)
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            bucket_labels = self._format_labels(labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{bucket_labels} {count}"
+            yield f"{self.name}_sum{self._format_labels(labels)} {total:g}"
+            yield f"{self.name}_count{self._format_labels(labels)} {count}"
+
+
+# ============ Bot metrics ============
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time to handle one update", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Updates whose handler raised", ("handler",))
+HANDLER_IN_FLIGHT = Gauge("bot_handler_in_flight", "Updates being handled", ("handler",))
+
+STAGE_SECONDS = Histogram("bot_stage_seconds", "Time spent in external calls", ("handler", "stage"))
+STAGE_ERRORS = Counter("bot_stage_errors_total", "Failed external calls", ("handler", "stage"))
+STAGE_IN_FLIGHT = Gauge("bot_stage_in_flight", "External calls in progress", ("stage",))
+
+MODEL_TOKENS = Counter("openai_tokens_total", "Tokens reported by the OpenAI API", ("model", "kind"))
+
+COMPLETION_CACHE = Counter("bot_completion_cache_total", "Completion cache lookups by result", ("result",))
+
+QUEUE_DEPTH = Gauge("bot_queue_depth", "Items waiting in internal queues", ("queue",))
+OPENAI_CONCURRENCY = Gauge("openai_concurrency", "OpenAI requests in flight and the adaptive limit", ("kind",))
+
+DOWNLOADS = Counter("bot_downloads_total", "Voice and audio downloads by destination", ("target",))
+DOWNLOAD_MEMORY = Gauge("bot_download_memory_bytes", "Bytes reserved by in-memory downloads")
+AUDIO_BYTES = Counter("bot_audio_bytes_total", "Audio bytes received from users and uploaded to Whisper", ("stage",))
+AUDIO_SECONDS = Counter("bot_audio_seconds_total", "Audio seconds received from users and uploaded to Whisper", ("stage",))
+
+WEBHOOK_REQUESTS = Counter("bot_webhook_requests_total", "Webhook deliveries by response status", ("status",))
+
+
+def instrument(name: str, callback: Callable) -> Callable:
+    """Wrap an async handler to record latency, errors and in-flight updates."""
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        token = _current_handler.set(name)
+        HANDLER_IN_FLIGHT.inc(name)
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+            HANDLER_IN_FLIGHT.dec(name)
+            _current_handler.reset(token)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time one external call (model, whisper, pdflatex, mmdc...) under the current handler."""
+    handler = _current_handler.get()
+    STAGE_IN_FLIGHT.inc(name)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(handler, name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, handler, name)
+        STAGE_IN_FLIGHT.dec(name)
+
+
+def record_usage(model: str, usage) -> None:
+    """Count the tokens of a completion response's usage block."""
+    if usage is None:
+        return
+    MODEL_TOKENS.inc(model, "prompt", amount=getattr(usage, "prompt_tokens", 0) or 0)
+    MODEL_TOKENS.inc(model, "completion", amount=getattr(usage, "completion_tokens", 0) or 0)
+
+
+def exposition() -> str:
+    """All metrics in Prometheus text format."""
+    return "\n".join(metric.exposition() for metric in _registry) + "\n"
+
+
+def _seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def stats_report() -> str:
+    """Human-readable summary for the /stats command."""
+    lines = ["📈 Handlers (count, errors, p50, p95, slowest stage at p95)"]
+    for (handler,) in sorted(HANDLER_SECONDS.values):
+        stages = [
+            (STAGE_SECONDS.quantile(0.95, stage_handler, stage_name), stage_name)
+            for stage_handler, stage_name in STAGE_SECONDS.values
+            if stage_handler == handler
+        ]
+        slowest = max(stages) if stages else None
+        lines.append(
+            f"• {handler}: {HANDLER_SECONDS.count(handler)}, "
+            f"{HANDLER_ERRORS.values.get((handler,), 0):g} err, "
+            f"p50 {_seconds(HANDLER_SECONDS.quantile(0.5, handler))}, "
+            f"p95 {_seconds(HANDLER_SECONDS.quantile(0.95, handler))}"
+            + (f", {slowest[1]} {_seconds(slowest[0])}" if slowest else "")
+        )
+
+    lines.append("")
+    lines.append("⚙️ Stages (calls, errors, p95)")
+    totals: Dict[str, List[float]] = {}
+    for (handler, stage_name), (_, count, _) in STAGE_SECONDS.values.items():
+        entry = totals.setdefault(stage_name, [0, 0])
+        entry[0] += count
+        entry[1] += STAGE_ERRORS.values.get((handler, stage_name), 0)
+    for stage_name, (count, errors) in sorted(totals.items()):
+        p95 = max(
+            (STAGE_SECONDS.quantile(0.95, *labels) or 0.0)
+            for labels in STAGE_SECONDS.values if labels[1] == stage_name
+        )
+        lines.append(f"• {stage_name}: {count:g}, {errors:g} err, p95 {_seconds(p95)}")
+
+    tokens = {kind: value for (_, kind), value in MODEL_TOKENS.values.items()}
+    if tokens:
+        lines.append("")
+        lines.append(f"🔤 Tokens: {tokens.get('prompt', 0):g} prompt, {tokens.get('completion', 0):g} completion")
+    lookups = {result: value for (result,), value in COMPLETION_CACHE.values.items()}
+    if lookups:
+        hits = lookups.get("memory_hit", 0) + lookups.get("disk_hit", 0)
+        lines.append(f"🗃️ Completion cache: {hits:g} hits, {lookups.get('miss', 0):g} misses")
+    queues = [f"{queue} {QUEUE_DEPTH.get(queue):g}" for (queue,) in sorted(QUEUE_DEPTH.functions)]
+    if queues:
+        lines.append(f"📥 Queues: {', '.join(queues)}")
+    return "\n".join(lines)
+
+
+def is_admin(user_id: Optional[int]) -> bool:
+    return user_id is not None and user_id in ADMIN_USER_IDS
+
+
+# ============ HTTP endpoint ============
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            status, body = "200 OK", exposition().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[asyncio.AbstractServer]:
+    """Serve /metrics on host:port (None when disabled or the port is taken)."""
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_serve, host, port)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint unavailable on {host}:{port}: {e}")
+        return None
+    logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,188 @@
+"""
+Model Client Module
+
+Shared async OpenAI client for the bot handlers and the summarization
+pipelines. Every request goes through one AsyncOpenAI instance backed by a
+single pooled HTTP connection set, so a slow completion only delays the
+update that is waiting for it. Requests are paced and retried by a shared
+rate_limit.RateGovernor, which also reads the rate limit headers of every
+response. Chat completions requested with cache=True are answered from the
+completion cache when the same request was made recently.
+"""
+
+import os
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+import completion_cache
+import metrics
+import rate_limit
+
+logger = logging.getLogger(__name__)
+
+CHAT_MODEL = "gpt-4o-mini"
+TRANSCRIPTION_MODEL = "whisper-1"
+
+# Connection pool shared by every model call
+MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "20"))
+REQUEST_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "120"))
+
+_client: Optional[AsyncOpenAI] = None
+
+governor = rate_limit.RateGovernor()
+
+
+def create_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> AsyncOpenAI:
+    """Create an AsyncOpenAI client whose responses feed the governor."""
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=10.0),
+        event_hooks={"response": [governor.observe]},
+    )
+    # Retries are done by the governor, which knows about the other requests
+    return AsyncOpenAI(
+        api_key=api_key or os.environ.get("OPENAI_API_KEY"),
+        base_url=base_url,
+        http_client=http_client,
+        max_retries=0,
+    )
+
+
+def get_client() -> AsyncOpenAI:
+    """Get or create the shared AsyncOpenAI client (lazy initialization)."""
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+
+def set_client(client: Any) -> None:
+    """Replace the shared client (e.g. with a fake backend for benchmarks)."""
+    global _client
+    _client = client
+
+
+async def close() -> None:
+    """Close the shared client and its connection pool."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def _estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    # About four characters per token, plus the completion budget
+    return sum(len(message.get("content") or "") for message in messages) // 4 + max_tokens
+
+
+async def chat_completion(
+    messages: List[Dict[str, str]],
+    model: str = CHAT_MODEL,
+    max_tokens: int = 300,
+    temperature: float = 0.7,
+    cache: bool = False,
+) -> str:
+    """Run a chat completion and return the message content.
+
+    With cache=True a recent identical request is answered from the
+    completion cache, and the answer is cached otherwise.
+    """
+    key = None
+    if cache and completion_cache.enabled():
+        key = completion_cache.make_key(model, messages, max_tokens=max_tokens, temperature=temperature)
+        cached = completion_cache.lookup(key)
+        if cached is not None:
+            return cached
+
+    with metrics.stage("chat"):
+        response = await governor.run(
+            lambda: get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+            ),
+            tokens=_estimate_tokens(messages, max_tokens),
+        )
+    metrics.record_usage(model, getattr(response, "usage", None))
+    content = response.choices[0].message.content
+    if key is not None and content:
+        completion_cache.store(key, content)
+    return content
+
+
+async def stream_chat_completion(
+    messages: List[Dict[str, str]],
+    model: str = CHAT_MODEL,
+    max_tokens: int = 300,
+    temperature: float = 0.7,
+    cache: bool = False,
+) -> AsyncIterator[str]:
+    """Run a streamed chat completion and yield content deltas as they arrive.
+
+    Only opening the stream is governed (and retried); once tokens arrive
+    the stream is read to the end, and its token usage is recorded from the
+    final chunk. With cache=True a cached answer is
+    yielded as a single delta, and a stream read to the end is cached.
+    """
+    key = None
+    if cache and completion_cache.enabled():
+        key = completion_cache.make_key(model, messages, max_tokens=max_tokens, temperature=temperature)
+        cached = completion_cache.lookup(key)
+        if cached is not None:
+            yield cached
+            return
+
+    # Timed until the stream opens (time to first byte)
+    with metrics.stage("chat_stream"):
+        stream = await governor.run(
+            lambda: get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                # The last chunk then carries the usage block (with no choices)
+                stream_options={"include_usage": True},
+            ),
+            tokens=_estimate_tokens(messages, max_tokens),
+        )
+    parts = []
+    async for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            metrics.record_usage(model, chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    if key is not None and parts:
+        completion_cache.store(key, "".join(parts))
+
+
+async def transcribe(audio_file, model: str = TRANSCRIPTION_MODEL) -> str:
+    """Transcribe an audio file object with Whisper (language auto-detected)."""
+    def request():
+        # A retried upload starts again from the beginning of the file
+        audio_file.seek(0)
+        return get_client().audio.transcriptions.create(
+            model=model,
+            file=audio_file,
+            response_format="text",
+            language=None,
+        )
+
+    with metrics.stage("whisper"):
+        transcript = await governor.run(request)
+    return transcript.text if hasattr(transcript, 'text') else transcript
+
+
+async def generate_image(prompt: str, size: str = "512x512") -> str:
+    """Generate a single image and return its URL."""
+    with metrics.stage("image"):
+        out = await governor.run(lambda: get_client().images.generate(prompt=prompt, n=1, size=size))
+    return out.data[0].url
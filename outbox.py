@@ -0,0 +1,195 @@
+"""
+Outbound Message Module
+
+Every message the bot sends or edits goes through here. Requests wait for
+a per-chat and a global token bucket so bursts stay under Telegram's flood
+limits (about one message per second in a private chat, 20 per minute in a
+group and 30 per second overall), a RetryAfter answer pauses the chat for
+the time Telegram asks for and retries, and texts longer than Telegram's
+4096 character limit are split at paragraph, line or sentence boundaries.
+
+Status messages ("Processing...") are sent once and then edited in place,
+ending with the final reply, instead of adding a new message per step.
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+from telegram import Bot, Chat, Message
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+# Sustained rates (messages per second) and bursts of the token buckets
+GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", "25"))
+GLOBAL_BURST = 25
+PRIVATE_CHAT_RATE = float(os.environ.get("OUTBOX_PRIVATE_CHAT_RATE", "1"))
+GROUP_CHAT_RATE = float(os.environ.get("OUTBOX_GROUP_CHAT_RATE", str(20 / 60)))
+CHAT_BURST = 3
+
+# RetryAfter answers accepted for one request before giving up
+MAX_RETRIES = 3
+
+# Chats whose buckets are kept (least recently used are dropped)
+MAX_TRACKED_CHATS = 10000
+
+_BREAKS = [re.compile(r'\n\s*\n'), re.compile(r'\n'), re.compile(r'[.!?]\s'), re.compile(r'\s')]
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Token bucket that makes callers wait for a free token."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next seconds (e.g. after RetryAfter)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+_global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+_chat_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+
+def _chat_bucket(chat: Chat) -> TokenBucket:
+    bucket = _chat_buckets.get(chat.id)
+    if bucket is None:
+        rate = PRIVATE_CHAT_RATE if chat.type == Chat.PRIVATE else GROUP_CHAT_RATE
+        bucket = _chat_buckets[chat.id] = TokenBucket(rate, CHAT_BURST)
+        if len(_chat_buckets) > MAX_TRACKED_CHATS:
+            _chat_buckets.popitem(last=False)
+    else:
+        _chat_buckets.move_to_end(chat.id)
+    return bucket
+
+
+def _seconds(retry_after) -> float:
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+async def call(chat: Chat, request: Callable[[], Awaitable[T]]) -> T:
+    """Run one Telegram request for chat within the rate limits.
+
+    ``request`` is called again after a RetryAfter, so it must create a new
+    awaitable each time (e.g. ``lambda: bot.send_message(...)``).
+    """
+    bucket = _chat_bucket(chat)
+    for attempt in range(MAX_RETRIES + 1):
+        await bucket.acquire()
+        await _global_bucket.acquire()
+        try:
+            return await request()
+        except RetryAfter as e:
+            delay = _seconds(e.retry_after)
+            if attempt == MAX_RETRIES:
+                raise
+            logger.warning(f"Flood control in chat {chat.id}, retrying in {delay:.0f}s")
+            bucket.pause(delay)
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split text into parts of at most limit characters at natural boundaries."""
+    parts = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = 0
+        for pattern in _BREAKS:
+            ends = [match.end() for match in pattern.finditer(window)]
+            # Only accept a boundary in the second half, else parts get tiny
+            if ends and ends[-1] > limit // 2:
+                cut = ends[-1]
+                break
+        cut = cut or limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+
+async def _send_parts(bot: Bot, chat: Chat, parts: List[str]) -> Message:
+    message = None
+    for part in parts:
+        message = await call(chat, lambda part=part: bot.send_message(chat_id=chat.id, text=part))
+    return message
+
+
+async def send(bot: Bot, chat: Chat, text: str) -> Message:
+    """Send text to chat, split into several messages if needed; return the last."""
+    return await _send_parts(bot, chat, split_text(text))
+
+
+async def reply(message: Message, text: str) -> Message:
+    """Reply to message (quoted in groups, like reply_text); return the last message sent."""
+    sent = None
+    for part in split_text(text):
+        sent = await call(message.chat, lambda part=part: message.reply_text(part))
+    return sent
+
+
+async def edit(message: Message, text: str) -> Message:
+    """Replace the text of a sent message; overflow is sent as follow-up messages."""
+    parts = split_text(text)
+    try:
+        await call(message.chat, lambda: message.edit_text(parts[0]))
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    if len(parts) > 1:
+        message = await _send_parts(message.get_bot(), message.chat, parts[1:])
+    return message
+
+
+class Status:
+    """One status message per request, edited in place as work progresses."""
+
+    def __init__(self, message: Message):
+        self.request = message
+        self.message: Optional[Message] = None
+        self.text = None
+
+    async def update(self, text: str) -> None:
+        """Show a progress text (sent the first time, edited afterwards)."""
+        if text == self.text:
+            return
+        self.text = text
+        if self.message is None:
+            self.message = await reply(self.request, text)
+        else:
+            self.message = await edit(self.message, text)
+
+    async def finish(self, text: str) -> Message:
+        """Turn the status message into the final reply."""
+        self.text = text
+        if self.message is None:
+            self.message = await reply(self.request, text)
+        else:
+            self.message = await edit(self.message, text)
+        return self.message
@@ -0,0 +1,254 @@
+"""
+OpenAI Rate Limit Module
+
+A governor shared by every model call. It follows the request and token
+budgets OpenAI reports in its x-ratelimit-* response headers and paces
+requests so a budget is spent no faster than it refills, retries throttled
+and transient failures with jittered exponential backoff (or the server's
+Retry-After), and adapts the number of concurrent requests AIMD-style:
+the limit grows by one per limit-many successes and halves on a 429.
+Slots under that limit are handed out by a scheduler.FairQueue, fairly
+across users and with interactive requests ahead of batch work.
+"""
+
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+import openai
+
+import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Concurrency window: start, floor and ceiling of the AIMD limit
+INITIAL_CONCURRENCY = float(os.environ.get("OPENAI_INITIAL_CONCURRENCY", "8"))
+MIN_CONCURRENCY = 1.0
+MAX_CONCURRENCY = float(os.environ.get("OPENAI_MAX_CONCURRENCY", "32"))
+
+# 429s within this many seconds of a decrease count as the same congestion event
+DECREASE_COOLDOWN = 1.0
+
+# Requests one user may have in flight per lane (0: SCHEDULER_USER_SHARE of the current limit)
+USER_MAX_IN_FLIGHT = int(os.environ.get("OPENAI_USER_MAX_IN_FLIGHT", "0"))
+
+# Retries of a throttled or failed request, and the backoff bounds (seconds)
+MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "6"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+_DURATION_PART = re.compile(r'([\d.]+)(ms|h|m|s)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+T = TypeVar("T")
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse an OpenAI reset duration such as "1s", "6m0s" or "20ms" to seconds."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _header_int(headers: httpx.Headers, name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class Budget:
+    """Estimate of one rate limit budget (requests or tokens).
+
+    OpenAI refills a budget continuously; the refill rate is derived from
+    the headers as (limit - remaining) / time-until-reset. Between responses
+    the estimate is spent locally, and a response never raises it above
+    what was spent meanwhile (its numbers are older than our own sends).
+    """
+
+    def __init__(self):
+        self.limit: Optional[float] = None
+        self.available = 0.0
+        self.rate = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.limit is not None:
+            self.available = min(self.limit, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def observe(self, limit: Optional[int], remaining: Optional[int], reset: Optional[float]) -> None:
+        if limit is None or remaining is None:
+            return
+        now = time.monotonic()
+        first = self.limit is None
+        self._refill(now)
+        self.limit = float(limit)
+        if reset and limit > remaining:
+            self.rate = (limit - remaining) / reset
+        elif not self.rate:
+            # Full budget: assume it refills over a minute
+            self.rate = limit / 60.0
+        self.available = float(remaining) if first else min(self.available, float(remaining))
+
+    def delay(self, cost: float) -> float:
+        """Seconds until cost can be spent (0 when the budget is unknown)."""
+        if self.limit is None:
+            return 0.0
+        self._refill(time.monotonic())
+        # A request larger than the whole budget waits for a full budget only
+        cost = min(cost, self.limit)
+        if self.available >= cost or self.rate <= 0:
+            return 0.0
+        return (cost - self.available) / self.rate
+
+    def spend(self, cost: float) -> None:
+        if self.limit is not None:
+            self.available -= cost
+
+
+def retry_after(headers: Optional[httpx.Headers]) -> Optional[float]:
+    """Seconds the server asked us to wait (retry-after-ms / retry-after), if any."""
+    if headers is None:
+        return None
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry attempt (0-based)."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class RateGovernor:
+    """Request/token budgets, retries and adaptive concurrency for one API key."""
+
+    def __init__(
+        self,
+        initial: float = INITIAL_CONCURRENCY,
+        minimum: float = MIN_CONCURRENCY,
+        maximum: float = MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        user_max_in_flight: Optional[int] = USER_MAX_IN_FLIGHT,
+    ):
+        self.limit = max(minimum, min(maximum, initial))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_retries = max_retries
+        self.slots = scheduler.FairQueue(
+            lambda: self.limit,
+            # A fixed cap, or a share that follows the adaptive limit
+            flow_cap=user_max_in_flight or scheduler.user_share(lambda: self.limit),
+        )
+
+        self.requests = Budget()
+        self.tokens = Budget()
+        self.paused_until = 0.0
+
+        self.throttled = 0
+        self.retries = 0
+        self._last_decrease = 0.0
+
+    @property
+    def in_flight(self) -> int:
+        return self.slots.in_flight
+
+    @property
+    def waiting(self) -> int:
+        return self.slots.waiting
+
+    # ---- budgets from response headers ----
+
+    async def observe(self, response: httpx.Response) -> None:
+        """httpx response hook: record the budgets reported by the server."""
+        headers = response.headers
+        for budget, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            budget.observe(
+                _header_int(headers, f"x-ratelimit-limit-{kind}"),
+                _header_int(headers, f"x-ratelimit-remaining-{kind}"),
+                parse_duration(headers.get(f"x-ratelimit-reset-{kind}")),
+            )
+
+    async def _wait_for_budget(self, tokens: int) -> None:
+        """Wait until the request and token budgets allow one more request."""
+        while True:
+            wait = max(
+                self.paused_until - time.monotonic(),
+                self.requests.delay(1),
+                self.tokens.delay(tokens),
+            )
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+
+        self.requests.spend(1)
+        self.tokens.spend(tokens)
+
+    # ---- AIMD concurrency ----
+
+    def _on_success(self) -> None:
+        # Slots added here are handed out when the finished request releases its own
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def _on_throttled(self, server_delay: Optional[float]) -> None:
+        self.throttled += 1
+        now = time.monotonic()
+        if server_delay:
+            # The server named a time: nobody sends before it
+            self.paused_until = max(self.paused_until, now + server_delay)
+        if now - self._last_decrease >= DECREASE_COOLDOWN:
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit / 2)
+            logger.warning(f"OpenAI rate limited, concurrency limit now {int(self.limit)}")
+
+    # ---- entry point ----
+
+    async def run(self, request: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        """Run a model request within the budgets, retrying throttled attempts.
+
+        ``request`` is called once per attempt and must create a new request
+        each time; ``tokens`` is the estimated prompt + completion size.
+        """
+        attempt = 0
+        while True:
+            async with self.slots.slot():
+                # Pace inside the slot so only in-flight candidates wait on the budget
+                await self._wait_for_budget(tokens)
+                try:
+                    result = await request()
+                except openai.RateLimitError as e:
+                    # An exhausted quota does not recover by waiting
+                    if e.code == "insufficient_quota" or attempt >= self.max_retries:
+                        raise
+                    server_delay = retry_after(e.response.headers)
+                    self._on_throttled(server_delay)
+                    delay = server_delay or backoff(attempt)
+                except (openai.APIConnectionError, openai.InternalServerError) as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = backoff(attempt)
+                    logger.warning(f"OpenAI request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                else:
+                    self._on_success()
+                    return result
+
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,320 @@
+"""
+Rendering Module
+
+Async rendering of summary documents and Mermaid diagrams. pdflatex runs
+as an asyncio subprocess with a bounded number of concurrent compiles,
+using a precompiled format file for the fixed preamble so the packages are
+not reloaded for every document. When TeX is not installed (or a compile
+fails) a plain-text PDF is written in pure Python instead.
+
+Mermaid diagrams are rendered to PNG and PDF concurrently and cached by
+the hash of their source.
+"""
+
+import os
+import shutil
+import asyncio
+import hashlib
+import logging
+import textwrap
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+import scheduler
+
+logger = logging.getLogger(__name__)
+
+LATEX_CONCURRENCY = int(os.environ.get("LATEX_CONCURRENCY", "2"))
+LATEX_TIMEOUT = float(os.environ.get("LATEX_TIMEOUT", "60"))
+FORMAT_DIR = os.environ.get(
+    "LATEX_FORMAT_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "telegram_bot_ai", "latex"),
+)
+
+PREAMBLE = (
+    r'\documentclass[12pt]{article}' + '\n'
+    r'\usepackage[utf8]{inputenc}' + '\n'
+    r'\usepackage{amsmath}' + '\n'
+    r'\usepackage{amsfonts}' + '\n'
+    r'\usepackage{amssymb}' + '\n'
+    r'\usepackage{graphicx}' + '\n'
+)
+
+MERMAID_CONCURRENCY = int(os.environ.get("MERMAID_CONCURRENCY", "2"))
+MERMAID_CACHE_DIR = os.environ.get(
+    "MERMAID_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "telegram_bot_ai", "mermaid"),
+)
+MERMAID_CACHE_MAX_FILES = int(os.environ.get("MERMAID_CACHE_MAX_FILES", "1000"))
+
+_latex_slots = scheduler.FairQueue(LATEX_CONCURRENCY, flow_cap=scheduler.user_share(LATEX_CONCURRENCY))
+# The per-user cap counts whole diagrams, so the PNG and PDF of one still render side by side
+_mermaid_slots = scheduler.FairQueue(MERMAID_CONCURRENCY, flow_cap=scheduler.user_share(MERMAID_CONCURRENCY, unit=2))
+_mermaid_inflight: Dict[str, asyncio.Future] = {}
+_format_lock = asyncio.Lock()
+_format_name: Optional[str] = None
+_format_failed = False
+
+
+async def _run(args: List[str], cwd: str = None, env: dict = None, timeout: float = LATEX_TIMEOUT) -> int:
+    """Run a command with a timeout, discarding its output."""
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=cwd,
+        env=env,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        return await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logger.error(f"{args[0]} timed out after {timeout:.0f}s")
+        return -1
+
+
+def latex_available() -> bool:
+    return shutil.which('pdflatex') is not None
+
+
+async def _ensure_format() -> Optional[str]:
+    """Build the preamble format file once; return its name or None."""
+    global _format_name, _format_failed
+    async with _format_lock:
+        if _format_name or _format_failed:
+            return _format_name
+
+        # The name covers the preamble so a changed preamble gets a new format
+        name = 'summary_' + hashlib.sha256(PREAMBLE.encode()).hexdigest()[:12]
+        if not os.path.exists(os.path.join(FORMAT_DIR, name + '.fmt')):
+            os.makedirs(FORMAT_DIR, exist_ok=True)
+            source = os.path.join(FORMAT_DIR, name + '.tex')
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write(PREAMBLE + r'\dump' + '\n')
+
+            code = await _run(
+                ['pdflatex', '-ini', '-interaction=nonstopmode', f'-jobname={name}', '&pdflatex', source],
+                cwd=FORMAT_DIR,
+            )
+            if code != 0 or not os.path.exists(os.path.join(FORMAT_DIR, name + '.fmt')):
+                logger.warning("Could not build LaTeX preamble format, compiling with full preamble")
+                _format_failed = True
+                return None
+            logger.info(f"Built LaTeX preamble format {name}")
+
+        _format_name = name
+        return _format_name
+
+
+async def render_latex(body: str, file_out: str, use_format: bool = True) -> bool:
+    """Compile a LaTeX document body (from \\begin{document}) to file_out.
+
+    Returns False when TeX is unavailable or produced no PDF.
+    """
+    if not latex_available():
+        return False
+
+    out_file_raw, _ = os.path.splitext(file_out)
+    out_dir = os.path.dirname(file_out) or '.'
+    tex_file = out_file_raw + '.tex'
+
+    format_name = await _ensure_format() if use_format else None
+    with open(tex_file, 'w', encoding='utf-8') as f:
+        if format_name is None:
+            f.write(PREAMBLE)
+        f.write(body)
+
+    args = ['pdflatex', '-interaction=nonstopmode', f'-output-directory={out_dir}']
+    env = None
+    if format_name is not None:
+        args.append(f'-fmt={format_name}')
+        # Trailing separator keeps TeX's default format search path
+        env = dict(os.environ, TEXFORMATS=FORMAT_DIR + os.pathsep)
+    args.append(tex_file)
+
+    async with _latex_slots.slot():
+        with metrics.stage("pdflatex"):
+            await _run(args, env=env)
+
+    return os.path.exists(file_out)
+
+
+# ============ Mermaid diagrams ============
+
+def mermaid_available() -> bool:
+    return shutil.which('mmdc') is not None
+
+
+async def _mmdc(source_file: str, out_path: str) -> str:
+    """Render source_file to out_path (format from extension) with mmdc."""
+    if os.path.exists(out_path):
+        return out_path
+
+    root, extension = os.path.splitext(out_path)
+    partial = f"{root}.{os.getpid()}.{id(asyncio.current_task())}.partial{extension}"
+    async with _mermaid_slots.slot():
+        with metrics.stage("mmdc"):
+            code = await _run(['mmdc', '-i', source_file, '-o', partial])
+    if code != 0 or not os.path.exists(partial):
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise RuntimeError(f"mmdc failed with exit code {code}")
+
+    os.replace(partial, out_path)
+    return out_path
+
+
+def _prune_mermaid_cache() -> None:
+    """Remove the least recently used files beyond MERMAID_CACHE_MAX_FILES.
+
+    Files of diagrams that are being rendered (their source, outputs and
+    partial outputs) are kept, since a queued mmdc run still needs them.
+    """
+    busy = {os.path.basename(path).split('.')[0] for path in _mermaid_inflight}
+    try:
+        names = os.listdir(MERMAID_CACHE_DIR)
+        entries = [
+            os.path.join(MERMAID_CACHE_DIR, name) for name in names
+            if '.partial' not in name and name.split('.')[0] not in busy
+        ]
+        entries.sort(key=os.path.getmtime)
+    except OSError:
+        return
+    for path in entries[:max(0, len(names) - MERMAID_CACHE_MAX_FILES)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _touch(path: str) -> None:
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _retrieve_exception(future: asyncio.Future) -> None:
+    # The PDF is awaited only after the PNG was sent; avoid "never retrieved" noise
+    if not future.cancelled():
+        future.exception()
+
+
+def render_mermaid(source: str) -> Tuple[asyncio.Future, asyncio.Future]:
+    """Render a diagram to PNG and PDF; return futures for both file paths.
+
+    Both formats are rendered concurrently so the PNG can be sent while the
+    PDF is still being produced. Results are cached by source hash, and a
+    diagram that is already being rendered is shared, not rendered twice.
+    """
+    key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+    os.makedirs(MERMAID_CACHE_DIR, exist_ok=True)
+    source_file = os.path.join(MERMAID_CACHE_DIR, key + '.mmd')
+    if os.path.exists(source_file):
+        # Used again: the source must not be the first file pruned
+        _touch(source_file)
+    else:
+        with open(source_file + '.partial', 'w', encoding='utf-8') as f:
+            f.write(source)
+        os.replace(source_file + '.partial', source_file)
+
+    futures = []
+    for extension in ('.png', '.pdf'):
+        out_path = os.path.join(MERMAID_CACHE_DIR, key + extension)
+        future = _mermaid_inflight.get(out_path)
+        if future is None:
+            if os.path.exists(out_path):
+                _touch(out_path)
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(out_path)
+            else:
+                future = asyncio.ensure_future(_mmdc(source_file, out_path))
+                _mermaid_inflight[out_path] = future
+                future.add_done_callback(lambda _, path=out_path: _mermaid_inflight.pop(path, None))
+                future.add_done_callback(lambda _: _prune_mermaid_cache())
+            future.add_done_callback(_retrieve_exception)
+        futures.append(future)
+
+    return futures[0], futures[1]
+
+
+# ============ Pure-Python fallback ============
+
+_PAGE_WIDTH, _PAGE_HEIGHT, _MARGIN = 595, 842, 64
+_STYLES = {
+    'title': ('F2', 16),
+    'heading': ('F2', 13),
+    'text': ('F1', 11),
+}
+
+
+def _pdf_string(text: str) -> bytes:
+    data = text.encode('cp1252', errors='replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _layout(blocks: List[Tuple[str, str]]) -> List[List[Tuple[str, int, float, str]]]:
+    """Wrap (style, text) blocks into pages of (font, size, y, line) entries."""
+    pages: List[List[Tuple[str, int, float, str]]] = [[]]
+    y = _PAGE_HEIGHT - _MARGIN
+    for style, text in blocks:
+        font, size = _STYLES[style]
+        leading = size * 1.35
+        # Helvetica averages about half an em per character
+        width = int((_PAGE_WIDTH - 2 * _MARGIN) / (size * 0.5))
+        lines = textwrap.wrap(text, width) or ['']
+        if style != 'text':
+            y -= size * 0.6
+        for line in lines:
+            if y - leading < _MARGIN:
+                pages.append([])
+                y = _PAGE_HEIGHT - _MARGIN
+            y -= leading
+            pages[-1].append((font, size, y, line))
+        y -= size * 0.4
+    return pages
+
+
+def write_text_pdf(file_out: str, blocks: List[Tuple[str, str]]) -> str:
+    """Write a simple PDF of (style, text) blocks; style is title, heading or text."""
+    pages = _layout(blocks)
+
+    objects: List[bytes] = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'',  # page tree, filled in below
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    page_ids = []
+    for entries in pages:
+        stream = b'BT\n' + b''.join(
+            b'/%s %d Tf 1 0 0 1 %d %.1f Tm %s Tj\n' % (font.encode(), size, _MARGIN, y, _pdf_string(line))
+            for font, size, y, line in entries
+        ) + b'ET\n'
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'endstream')
+        content_id = len(objects)
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+            % (_PAGE_WIDTH, _PAGE_HEIGHT, content_id)
+        )
+        page_ids.append(len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % i for i in page_ids), len(page_ids)
+    )
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+
+    with open(file_out, 'wb') as f:
+        f.write(output)
+    return file_out
@@ -0,0 +1,193 @@
+"""
+Scheduler Module
+
+Fair sharing of the bot's backends (model requests, text extraction,
+LaTeX and Mermaid rendering) between users. Work runs in one of two lanes:
+interactive (chat, short voice messages, images, diagrams) and batch
+(documents, URLs, long recordings).
+
+Each backend is a FairQueue. Waiting requests are granted by start-time
+fair queuing over flows (one flow per user and lane): a flow's requests
+are spaced by cost / lane weight in virtual time, so a user with five large
+documents gets the same share as a user with one, and the interactive lane
+(weighted higher) gets ahead of batch work without starving it. A per-flow
+cap on requests in flight (by default three quarters of a backend's slots)
+keeps one user's batch from filling the backend when others are idle and
+then being slow to give it back.
+
+Handlers are wrapped with handler(), which tags their work with the user
+and lane; set_lane() moves the rest of a handler to another lane.
+"""
+
+import os
+import asyncio
+import functools
+import itertools
+import contextlib
+import contextvars
+from collections import Counter
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Share of an interactive flow relative to a batch flow
+LANE_WEIGHTS = {
+    INTERACTIVE: float(os.environ.get("SCHEDULER_INTERACTIVE_WEIGHT", "8")),
+    BATCH: 1.0,
+}
+
+# Share of a backend's slots one flow may hold (0 = no cap unless the backend sets one)
+USER_SHARE = float(os.environ.get("SCHEDULER_USER_SHARE", "0.75"))
+
+# Fair queuing on/off ("0" grants requests in arrival order, e.g. for comparisons)
+FAIR = os.environ.get("SCHEDULER_FAIR", "1") == "1"
+
+# Flow tags are forgotten once there are more than this many idle flows
+MAX_IDLE_FLOWS = 1000
+
+Flow = Tuple[str, str]
+
+_current: contextvars.ContextVar[Flow] = contextvars.ContextVar("scheduler_flow", default=("", BATCH))
+
+
+def current_flow() -> Flow:
+    """(lane, user) the current task's work is accounted to."""
+    return _current.get()
+
+
+def set_lane(lane: str) -> None:
+    """Account the rest of the current handler's work to lane."""
+    _current.set((lane, _current.get()[1]))
+
+
+@contextlib.contextmanager
+def flow(user, lane: str):
+    """Account the work inside the block to user in lane."""
+    token = _current.set((lane, str(user)))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def handler(lane: str, callback: Callable) -> Callable:
+    """Wrap an async update handler so its work is accounted to the update's user in lane."""
+    @functools.wraps(callback)
+    async def wrapper(update, *args, **kwargs):
+        user = update.effective_user.id if update.effective_user else update.effective_chat.id
+        with flow(user, lane):
+            return await callback(update, *args, **kwargs)
+
+    return wrapper
+
+
+def user_share(limit: Union[int, Callable[[], int]], unit: int = 1) -> Optional[Callable[[], int]]:
+    """Per-flow cap of USER_SHARE of limit, or None without a share.
+
+    The cap is a whole number of units of ``unit`` slots (work that takes
+    several slots at once), and at least one unit.
+    """
+    if USER_SHARE <= 0:
+        return None
+    get_limit = limit if callable(limit) else (lambda: limit)
+    return lambda: unit * max(1, int(get_limit() // unit * USER_SHARE))
+
+
+class _Waiter:
+    __slots__ = ("flow", "start", "finish", "sequence", "future")
+
+    def __init__(self, flow: Flow, start: float, finish: float, sequence: int):
+        self.flow = flow
+        self.start = start
+        self.finish = finish
+        self.sequence = sequence
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class FairQueue:
+    """Slots of one backend, granted fairly across flows.
+
+    ``limit`` is the number of slots (a callable for a limit that changes,
+    like the adaptive OpenAI concurrency); ``flow_cap`` bounds the slots one
+    flow may hold, also as a callable to follow a changing limit.
+    """
+
+    def __init__(
+        self,
+        limit: Union[int, Callable[[], int]],
+        flow_cap: Union[int, Callable[[], int], None] = None,
+    ):
+        self._limit = limit if callable(limit) else (lambda: limit)
+        self._flow_cap = flow_cap if callable(flow_cap) or flow_cap is None else (lambda: flow_cap)
+        self.in_flight = 0
+        self._flow_in_flight: Counter = Counter()
+        self._waiters: List[_Waiter] = []
+        self._last_finish: Dict[Flow, float] = {}
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, cost: float = 1.0) -> Flow:
+        """Wait for a slot; return the flow it is accounted to (pass it to release)."""
+        flow = current_flow() if FAIR else ("", BATCH)
+        start = max(self._virtual_time, self._last_finish.get(flow, 0.0))
+        finish = start + cost / LANE_WEIGHTS.get(flow[0], 1.0)
+        self._last_finish[flow] = finish
+
+        waiter = _Waiter(flow, start, finish, next(self._sequence))
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just before the cancellation: hand the slot on
+                self.release(flow)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        return flow
+
+    def release(self, flow: Flow) -> None:
+        self.in_flight -= 1
+        self._flow_in_flight[flow] -= 1
+        if not self._flow_in_flight[flow]:
+            del self._flow_in_flight[flow]
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, cost: float = 1.0) -> AsyncIterator[None]:
+        flow = await self.acquire(cost)
+        try:
+            yield
+        finally:
+            self.release(flow)
+
+    def _dispatch(self) -> None:
+        """Grant free slots to the eligible waiters with the smallest finish tags."""
+        # Waiters cancelled since the last dispatch leave on their own; never grant them
+        self._waiters = [waiter for waiter in self._waiters if not waiter.future.cancelled()]
+        while self._waiters and self.in_flight < max(1, int(self._limit())):
+            cap = self._flow_cap() if self._flow_cap is not None and FAIR else None
+            eligible = [
+                waiter for waiter in self._waiters
+                if cap is None or self._flow_in_flight[waiter.flow] < cap
+            ]
+            if not eligible:
+                break
+            waiter = min(eligible, key=lambda waiter: (waiter.finish, waiter.sequence))
+            self._waiters.remove(waiter)
+            self._virtual_time = max(self._virtual_time, waiter.start)
+            self.in_flight += 1
+            self._flow_in_flight[waiter.flow] += 1
+            waiter.future.set_result(None)
+
+        if len(self._last_finish) > MAX_IDLE_FLOWS:
+            # A flow whose last tag is behind virtual time starts afresh anyway
+            self._last_finish = {
+                flow: finish for flow, finish in self._last_finish.items() if finish > self._virtual_time
+            }
@@ -0,0 +1,241 @@
+"""
+Webhook Module
+
+Receives updates from Telegram over a webhook instead of long polling.
+A small asyncio HTTP server (usually behind a TLS-terminating reverse
+proxy) checks the X-Telegram-Bot-Api-Secret-Token header of every delivery
+and hands the update to the application. Only a bounded number of updates
+may be accepted but not yet handled; when that backlog stays full the
+delivery is answered with 503, so Telegram keeps the update and sends it
+again later instead of the bot buffering without limit.
+
+Pending updates are kept when the webhook is registered, so updates that
+arrive while the bot restarts are delivered once it is back.
+"""
+
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import secrets
+import collections
+import urllib.parse
+from typing import Any, Awaitable, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application, SimpleUpdateProcessor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Public HTTPS URL Telegram posts to; setting it switches the bot to webhook mode
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+
+# Local address of the intake server (the reverse proxy forwards to it)
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+
+# Shared secret Telegram sends with every delivery (random per start when unset)
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+
+# Concurrent connections Telegram may open to deliver updates (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Seconds a delivery waits for room in the backlog before it is refused
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.environ.get("WEBHOOK_ENQUEUE_TIMEOUT", "5"))
+
+# Largest accepted request body (updates are a few KB)
+MAX_BODY_BYTES = 1024 * 1024
+
+_SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class BoundedUpdateProcessor(SimpleUpdateProcessor):
+    """Concurrent update processing with a cap on admitted, unfinished updates.
+
+    The application hands every queued update to a task right away, so the
+    update queue itself never fills up; the webhook intake calls admit()
+    instead, and the slot is released when that update has been handled.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_waiting: int):
+        super().__init__(max_concurrent_updates)
+        self._capacity = max_concurrent_updates + max_waiting
+        self._reset()
+
+    def _reset(self) -> None:
+        # The semaphore binds to the event loop of one run, and a crashed run never releases its slots
+        self._room = asyncio.Semaphore(self._capacity)
+        # update_id -> admitted deliveries not yet handled (Telegram may deliver an update twice)
+        self._admitted: "collections.Counter[int]" = collections.Counter()
+
+    async def initialize(self) -> None:
+        """Start every run (a restart after a failure too) with a full, unbound backlog."""
+        await super().initialize()
+        self._reset()
+
+    @property
+    def backlog(self) -> int:
+        """Updates admitted by the intake and not yet handled."""
+        return sum(self._admitted.values())
+
+    async def admit(self, update: Update, timeout: float) -> bool:
+        """Wait up to timeout seconds for room for update; False when there was none."""
+        try:
+            await asyncio.wait_for(self._room.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._admitted[update.update_id] += 1
+        return True
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        try:
+            await coroutine
+        finally:
+            # Updates from polling were never admitted and hold no slot
+            if isinstance(update, Update) and self._admitted[update.update_id] > 0:
+                self._admitted[update.update_id] -= 1
+                if not self._admitted[update.update_id]:
+                    del self._admitted[update.update_id]
+                self._room.release()
+
+
+class WebhookServer:
+    """HTTP intake for webhook deliveries of one application."""
+
+    def __init__(self, application: Application, path: str, secret: str):
+        self.application = application
+        self.path = path
+        self.secret = secret
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections = {}
+
+    async def start(self, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT) -> int:
+        """Start listening; return the bound port (useful with port 0)."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Webhook intake on http://{host}:{port}{self.path}")
+        return port
+
+    async def stop(self) -> None:
+        """Stop accepting deliveries; updates already queued stay queued."""
+        if self._server is None:
+            return
+        self._server.close()
+        # Idle keep-alive connections would otherwise keep their handlers waiting
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*self._connections.values(), return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _deliver(self, method: str, path: str, headers: dict, body: bytes) -> Tuple[str, dict]:
+        """Handle one request; return the status line and extra headers."""
+        if path.split("?")[0] != self.path:
+            return "404 Not Found", {}
+        if method != "POST":
+            return "405 Method Not Allowed", {"Allow": "POST"}
+        if not hmac.compare_digest(headers.get(_SECRET_HEADER, "").encode(), self.secret.encode()):
+            return "403 Forbidden", {}
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.warning(f"Rejected malformed webhook delivery: {e}")
+            return "400 Bad Request", {}
+
+        processor = self.application.update_processor
+        if isinstance(processor, BoundedUpdateProcessor):
+            if not await processor.admit(update, WEBHOOK_ENQUEUE_TIMEOUT):
+                # Telegram retries refused deliveries, so the update is delayed, not lost
+                logger.warning(f"Update backlog full, refusing update {update.update_id}")
+                return "503 Service Unavailable", {"Retry-After": str(max(1, int(WEBHOOK_ENQUEUE_TIMEOUT)))}
+        await self.application.update_queue.put(update)
+        return "200 OK", {}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    status, extra, keep_alive = "413 Payload Too Large", {}, False
+                else:
+                    body = await reader.readexactly(length)
+                    status, extra = await self._deliver(method, path, headers, body)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                metrics.WEBHOOK_REQUESTS.inc(status.split()[0])
+
+                head = [f"HTTP/1.1 {status}", "Content-Length: 0"]
+                head += [f"{name}: {value}" for name, value in extra.items()]
+                if not keep_alive:
+                    head.append("Connection: close")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+
+async def run(application: Application, url: str = WEBHOOK_URL, secret: str = WEBHOOK_SECRET,
+              host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT) -> None:
+    """Run the application on webhook deliveries until SIGINT/SIGTERM.
+
+    Follows the lifecycle of Application.run_polling: post_init after
+    initialization, and on shutdown every update already accepted is
+    handled before post_shutdown.
+    """
+    secret = secret or secrets.token_urlsafe(32)
+    path = urllib.parse.urlsplit(url).path or "/"
+    server = WebhookServer(application, path, secret)
+
+    await application.initialize()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start(host, port)
+        await application.start()
+        # Keep the updates queued at Telegram while the bot was down
+        await application.bot.set_webhook(
+            url,
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=False,
+        )
+        logger.info(f"Webhook registered for {url}")
+        await stop.wait()
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)